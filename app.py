@@ -1,9 +1,24 @@
 import streamlit as st
-import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
-import re
-import io
+import os
+import html
+import json
+import threading
+import time
+import uuid
+import functools
+
+import stress_core as core
+from stress_core import (
+    CACHE_DIR, DIRECTION_METHODS, FILE_PATH, ISO3_TO_AREA, MATCH_MODES,
+    ExportCache, export_key, parse_extra, scenario_bounds, scenario_rows, to_bps,
+)
+
+# Copy-on-Write: sempre attivo da pandas 3; su pandas 2 va acceso perché i frame derivati
+# dal Dataset condiviso (filtri, slice, assign) non scrivano nei suoi array
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
 
 # ─── PAGE CONFIG ───────────────────────────────────────────────────────────────
 st.set_page_config(page_title="Stress Test Mapping", page_icon="📊", layout="wide")
@@ -129,43 +144,37 @@ st.markdown("""
     font-size: 0.875rem; font-weight: 400; transition: all 0.1s ease;
 }
 .stButton > button:hover { border-color: #ff4b4b; color: #ff4b4b; background: #fff5f5; }
+
+/* ── Bottoni di direzione: classi st-key-<key> dei widget, nessuno script nel browser ── */
+[class*="st-key-mini_pos_"] button, .st-key-filter_pos button,
+[class*="st-key-mini_neg_"] button, .st-key-filter_neg button,
+[class*="st-key-mini_zero_"] button, .st-key-filter_zero button, .st-key-mf_zero button {
+    font-size: 0.72rem !important; font-weight: 600 !important;
+    min-height: 28px !important; height: 28px !important;
+    padding: 0 8px !important; border-radius: 5px !important;
+}
+[class*="st-key-mini_pos_"] button, .st-key-filter_pos button {
+    background-color: #16a34a !important; color: #ffffff !important; border: 1.5px solid #15803d !important;
+}
+[class*="st-key-mini_neg_"] button, .st-key-filter_neg button {
+    background-color: #dc2626 !important; color: #ffffff !important; border: 1.5px solid #b91c1c !important;
+}
+[class*="st-key-mini_zero_"] button, .st-key-filter_zero button, .st-key-mf_zero button {
+    background-color: #ffffff !important; color: #b45309 !important; border: 1.5px solid #b45309 !important;
+}
 </style>
 """, unsafe_allow_html=True)
 
 # ─── HELPERS ───────────────────────────────────────────────────────────────────
-
-def to_bps(value, unit):
-    if pd.isna(value) or pd.isna(unit):
-        return np.nan
-    unit = str(unit).strip().lower()
-    if unit == 'bps':    return float(value)
-    if unit == 'pct':    return float(value) * 100
-    if unit == 'rel %':  return float(value) * 100
-    return np.nan
-
-def group_direction_score(sub):
-    bps_vals = [to_bps(r['Value'], r['Unit']) for _, r in sub.iterrows()]
-    bps_vals = [v for v in bps_vals if not np.isnan(v)]
-    return float(np.mean(bps_vals)) if bps_vals else np.nan
-
-def scenario_direction(score):
-    if pd.isna(score): return 'zero'
-    if score > 0:      return 'pos'
-    if score < 0:      return 'neg'
-    return 'zero'
-
-def count_directions(df_sub):
-    n_pos = n_neg = n_zero = 0
-    for _, sc_df in df_sub.groupby('Scenario'):
-        d = scenario_direction(group_direction_score(sc_df))
-        if d == 'pos':   n_pos  += 1
-        elif d == 'neg': n_neg  += 1
-        else:            n_zero += 1
-    return n_pos, n_neg, n_zero
-
-def get_scenario_directions(df_sub):
-    return {sc: scenario_direction(group_direction_score(sc_df))
-            for sc, sc_df in df_sub.groupby('Scenario')}
+# Testi per metodologia di direzione (popup e tooltip dei box)
+METHOD_HELP = {
+    'mean':     'The <b>arithmetic mean</b> of all converted values is computed',
+    'median':   'The <b>median</b> of all converted values is computed — robust to a few outsized shocks',
+    'vote':     'A <b>sign vote</b> is taken: (shocks &gt; 0 − shocks &lt; 0) / directional shocks, every shock counts once',
+    'weighted': 'A <b>magnitude-weighted mean</b> is computed: Σ bps·|bps| / Σ |bps|, larger shocks weigh more',
+}
+METHOD_SCORE = {'mean': 'average shock', 'median': 'median shock', 'vote': 'sign vote',
+                'weighted': 'magnitude-weighted average shock'}
 
 def clean_items(series):
     return sorted([str(i) for i in series.dropna().unique()
@@ -180,203 +189,447 @@ def format_shock(value, unit):
         return f"{val_str} {unit}"
     return val_str
 
-def parse_extra(extra):
-    """Estrae i token con underscore dalla colonna Extra, escludendo 'target block/to'."""
-    if pd.isna(extra) or str(extra).strip() in ('', 'nan'):
-        return ''
-    s = re.sub(r'^target\s+(block|to)\s+', '', str(extra).strip(), flags=re.IGNORECASE)
-    tokens = re.split(r'[,\s\-]+', s)
-    tokens = [t.strip() for t in tokens if '_' in t and t.strip()]
-    return ' · '.join(tokens)
+# ─── TRACING ───────────────────────────────────────────────────────────────────
+# Span per sezione dello script: tempo wall, righe toccate, hit/miss di cache.
+# Attivo con STRESS_TRACE=1 o ?trace=1 (pannello in sidebar); STRESS_TRACE_LOG=<file> accoda JSON-lines.
+TRACE_LOG = os.environ.get("STRESS_TRACE_LOG")
+TRACE_ON  = bool(TRACE_LOG or os.environ.get("STRESS_TRACE")) or st.query_params.get("trace") == "1"
+TRACE_RUN = uuid.uuid4().hex[:8] if TRACE_ON else None
+# Budget di avvio: una sessione fredda (primo rerun) deve rendere la vista iniziale entro questa soglia
+STARTUP_BUDGET_MS = float(os.environ.get("STRESS_STARTUP_BUDGET_MS", 1500))
+
+_trace_t0     = time.perf_counter()
+_trace_cold   = 'session_started' not in st.session_state   # primo rerun della sessione
+st.session_state.session_started = True
+_trace_spans  = []                   # span chiusi in questo rerun
+_trace_local  = threading.local()    # stack degli span aperti (per thread: i download girano fuori dal rerun)
+
+def _trace_stack():
+    if not hasattr(_trace_local, 'stack'):
+        _trace_local.stack = []
+    return _trace_local.stack
+
+def _trace_write(record):
+    with open(TRACE_LOG, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+class Span:
+    """Intervallo di tracing; si usa con `with trace(...)` o start()/stop() attorno a blocchi di markdown."""
+    __slots__ = ('name', 'rows', 'hits', 'misses', 'depth', 't0', 'ms')
+
+    def __init__(self, name, rows=0):
+        self.name, self.rows, self.hits, self.misses = name, rows, 0, 0
+
+    def start(self):
+        stack = _trace_stack()
+        self.depth = len(stack)
+        stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def stop(self):
+        self.ms = (time.perf_counter() - self.t0) * 1000
+        stack = _trace_stack()
+        if self in stack:
+            stack.remove(self)
+        _trace_spans.append(self)
+        if TRACE_LOG:
+            _trace_write({'ts': round(time.time(), 3), 'run': TRACE_RUN, 'span': self.name,
+                          'depth': self.depth, 'ms': round(self.ms, 3), 'rows': int(self.rows),
+                          'hits': self.hits, 'misses': self.misses})
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class _NullSpan:
+    """Span vuoto usato a tracing spento: nessun costo oltre la chiamata."""
+    rows = hits = misses = 0
+    def start(self): return self
+    def stop(self): pass
+    def __enter__(self): return self
+    def __exit__(self, *exc): pass
+
+_NULL_SPAN = _NullSpan()
+
+def trace(name, rows=0):
+    return Span(name, rows) if TRACE_ON else _NULL_SPAN
+
+def traced(name):
+    """Decoratore: esegue la funzione dentro uno span `name`."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACE_ON:
+                return fn(*args, **kwargs)
+            with Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def trace_mark(name):
+    """Istante notevole del rerun (ms dall'avvio dello script), es. il primo paint."""
+    if not TRACE_ON:
+        return
+    span = Span(name)
+    span.depth, span.t0 = 0, _trace_t0
+    span.stop()
+
+def trace_rows(n):
+    """Aggiunge n righe toccate allo span più interno."""
+    if TRACE_ON and _trace_stack():
+        _trace_stack()[-1].rows += n
+
+def trace_cache(hit):
+    """Registra un hit/miss di cache sullo span più interno."""
+    if TRACE_ON and _trace_stack():
+        span = _trace_stack()[-1]
+        if hit:
+            span.hits += 1
+        else:
+            span.misses += 1
+
+def cached_call(fn, *args):
+    """Chiama una funzione in cache contando l'hit: il corpo segnala il miss con trace_cache(False)."""
+    if not (TRACE_ON and _trace_stack()):
+        return fn(*args)
+    span   = _trace_stack()[-1]
+    before = span.misses
+    out    = fn(*args)
+    if span.misses == before:
+        span.hits += 1
+    return out
 
 # ─── DATA ──────────────────────────────────────────────────────────────────────
-FILE_PATH = "Lista_scenari_shocks.xlsx"
-
-@st.cache_data
-def load_data():
-    df = pd.read_excel(FILE_PATH, sheet_name="Shocks")
-    df = df.rename(columns={'Livello 1': 'L1', 'Livello 2': 'L2', 'Livello 3': 'L3'})
-
-    for col in ['Scenario', 'Scenario Type', 'L1', 'L2', 'L3', 'Factor', 'Unit']:
-        df[col] = df[col].astype(str).str.strip()
-        df[col] = df[col].replace('nan', np.nan)
-
-    df = df.dropna(subset=['Scenario', 'L1'])
-    df = df[df['L1'].str.strip().astype(bool)]
-
-    desc_map = (
-        df.dropna(subset=['Description'])
-          .drop_duplicates(subset='Scenario')[['Scenario', 'Description']]
-          .set_index('Scenario')['Description']
-          .to_dict()
-    ) if 'Description' in df.columns else {}
-    type_map = (
-        df.drop_duplicates(subset='Scenario')[['Scenario', 'Scenario Type']]
-          .set_index('Scenario')['Scenario Type']
-          .to_dict()
-    )
-    return df, desc_map, type_map
+@st.cache_resource
+def dataset_store():
+    """Dataset condiviso tra le sessioni; un thread lo aggiorna quando il workbook cambia."""
+    trace_cache(False)
+    return core.DatasetStore(FILE_PATH, CACHE_DIR).watch(float(os.environ.get("STRESS_WATCH_INTERVAL", 5)))
 
 try:
-    df, desc_map, type_map = load_data()
+    with trace('dataset'):
+        ds = cached_call(dataset_store).current()   # letto una volta: versione coerente per tutto il rerun
+        trace_rows(len(ds.df))
 except FileNotFoundError:
     st.error(f"File `{FILE_PATH}` not found.")
     st.stop()
 
-# ─── GEO DATA ─────────────────────────────────────────────────────────────────
-
+df, desc_map, type_map, cube, sc_index, l1_matrix = ds.df, ds.desc_map, ds.type_map, ds.cube, ds.index, ds.matrix
+df_all = df
+
+if st.session_state.get('data_version') not in (None, ds.version):
+    _diff = dataset_store().last_diff
+    st.toast(f"Shocks workbook reloaded · {_diff.summary()} scenarios" if _diff else "Shocks workbook reloaded")
+st.session_state.data_version = ds.version
+
+@st.cache_resource(max_entries=4)
+def type_frame(version, type_filter, _df):
+    """Righe di un tipo di scenario, filtrate una volta per versione e condivise tra le sessioni."""
+    trace_cache(False)
+    return _df[(_df['Scenario Type'] == type_filter).to_numpy()]
+
+@st.cache_resource(max_entries=2)
+def header_view(version, _df):
+    """Conteggi di header, chip e footer e HTML della strip per asset class, una volta per versione."""
+    trace_cache(False)
+    summary = core.dataset_summary(_df)
+    max_c   = max(summary['l1_counts'].values(), default=1)
+    cells   = ''
+    for l1_name, cnt in summary['l1_counts'].items():
+        bar_h = max(3, int(16 * cnt / max_c))
+        bar_svg = (f'<svg width="48" height="16" style="display:block;margin-top:3px">'
+                   f'<rect x="0" y="{16-bar_h}" width="48" height="{bar_h}" '
+                   f'fill="#ff4b4b" rx="2" opacity="0.7"/>'
+                   f'</svg>')
+        cells += (f'<div class="hm-cell">'
+                  f'<div class="hm-label">{str(l1_name)[:15]}</div>'
+                  f'<div class="hm-count">{cnt}</div>'
+                  f'{bar_svg}'
+                  f'</div>')
+    return core.read_only({**summary, 'strip_html': cells})
 
-# ── Factor → ISO3 specifico (paese singolo) ───────────────────────────────────
-FACTOR_TO_ISO3 = {
-    # Europe
-    'Austria ATX': 'AUT', 'Belgium 20': 'BEL', 'DAX 30': 'DEU',
-    'Denmark OMX Copenhag20': 'DNK', 'FTSE 100': 'GBR',
-    'FTSE All Share - FTSE 100': 'GBR', 'France CAC 40': 'FRA',
-    'Greece ASE/General': 'GRC', 'Ireland ISEQ/General': 'IRL',
-    'Italy S&P MIB': 'ITA', 'Italy S&P MIB - MSCI EUROPE(EUR)': 'ITA',
-    'Luxembourg LUXX': 'LUX', 'Netherlands AEX Stk': 'NLD',
-    'Poland WIG': 'POL', 'Portugal PSI 20': 'PRT',
-    'Spain IBEX 35': 'ESP', 'Sweden OMX': 'SWE', 'Switzerland SMI': 'CHE',
-    # Emerging Markets - indici
-    'Brazil Bovespa': 'BRA', 'China Shanghai SECmp': 'CHN',
-    'China Shenzhen SEAll': 'CHN', 'Czech Republic PX 50': 'CZE',
-    'Hungary BUX': 'HUN', 'India BSE 100': 'IND',
-    'Korea KOSPI Comp': 'KOR', 'Mexican Bolsa': 'MEX',
-    'Pakistan KSE 100': 'PAK', 'Philippines PSEi': 'PHL',
-    'Russia RTS': 'RUS', 'Taiwan TSEC': 'TWN', 'Taiwan TWSE': 'TWN',
-    'Turkey ISE Natl 100': 'TUR',
-    # Emerging Markets - Country Allocation
-    'Argentina': 'ARG', 'Brazil': 'BRA', 'China Domestic': 'CHN',
-    'China Offshore': 'CHN', 'Hungary': 'HUN', 'Indonesia': 'IDN',
-    'Mexico': 'MEX', 'Pakistan': 'PAK', 'Qatar': 'QAT',
-    'Saudi Arabia': 'SAU', 'South Africa': 'ZAF', 'Taiwan': 'TWN',
-    'Turkey': 'TUR', 'Ukraine': 'UKR', 'Venezuela': 'VEN', 'Viet Nam': 'VNM',
-    # Pacific ex Japan
-    'Hang Seng': 'HKG', 'S&P ASX 200': 'AUS', 'Singapore StraitsTms': 'SGP',
-    # North America
-    'Canada': 'CAN',
-    # Japan
-    'NIKKEI 225': 'JPN', 'NIKKEI 225 - MSCI World Net TR': 'JPN',
-    'MSCI Japan - MSCI World Net TR': 'JPN', 'MSCI Japan - MSCI EUROPE(EUR)': 'JPN',
-    # US
-    'S&P 500': 'USA', 'Nasdaq': 'USA', 'VIX': 'USA', 'VIX Volatility': 'USA',
-    'S&P Mid Cap': 'USA', 'S&P Small Cap': 'USA',
-    'Russell 1000 - Russell 2000': 'USA',
-    'Russell 3000 Growth - Russell 3000 Value': 'USA',
-}
+def direction_method():
+    """Metodologia di direzione selezionata: tutte precalcolate nel cubo, cambiarla non ricalcola nulla."""
+    return st.session_state.get('direction_method', core.DEFAULT_METHOD)
 
-# ISO3 -> Area
-_ISO3_TO_AREA = {
-    'USA': 'US', 'CAN': 'North America',
-    'GBR': 'Europe', 'DEU': 'Europe', 'FRA': 'Europe', 'ITA': 'Europe',
-    'ESP': 'Europe', 'CHE': 'Europe', 'NLD': 'Europe', 'BEL': 'Europe',
-    'SWE': 'Europe', 'NOR': 'Europe', 'DNK': 'Europe', 'FIN': 'Europe',
-    'AUT': 'Europe', 'POL': 'Europe', 'PRT': 'Europe', 'GRC': 'Europe',
-    'IRL': 'Europe', 'LUX': 'Europe',
-    'JPN': 'Japan',
-    'AUS': 'Pacific ex Japan', 'HKG': 'Pacific ex Japan',
-    'SGP': 'Pacific ex Japan', 'NZL': 'Pacific ex Japan',
-    'KOR': 'Pacific ex Japan', 'TWN': 'Pacific ex Japan',
-    'CHN': 'Emerging Markets', 'IND': 'Emerging Markets',
-    'BRA': 'Emerging Markets', 'MEX': 'Emerging Markets',
-    'RUS': 'Emerging Markets', 'ZAF': 'Emerging Markets',
-    'TUR': 'Emerging Markets', 'SAU': 'Emerging Markets',
-    'IDN': 'Emerging Markets', 'THA': 'Emerging Markets',
-    'MYS': 'Emerging Markets', 'PHL': 'Emerging Markets',
-    'PAK': 'Emerging Markets', 'ARG': 'Emerging Markets',
-    'CHL': 'Emerging Markets', 'COL': 'Emerging Markets',
-    'PER': 'Emerging Markets', 'VEN': 'Emerging Markets',
-    'EGY': 'Emerging Markets', 'MAR': 'Emerging Markets',
-    'NGA': 'Emerging Markets', 'QAT': 'Emerging Markets',
-    'ARE': 'Emerging Markets', 'ISR': 'Emerging Markets',
-    'HUN': 'Emerging Markets', 'CZE': 'Emerging Markets',
-    'UKR': 'Emerging Markets', 'VNM': 'Emerging Markets',
-}
+def node_directions(path):
+    """Direzione per scenario del nodo `path` (L1[, L2[, L3]]), rispettando filtro tipo e metodologia."""
+    return core.node_directions(cube, path, st.session_state.get('scenario_type', 'All'), direction_method())
 
+def node_counts(path):
+    return core.node_counts(cube, path, st.session_state.get('scenario_type', 'All'), direction_method())
 
-@st.cache_data
-def load_geo_data():
-    df_raw = pd.read_excel(FILE_PATH, sheet_name="Shocks")
-    if 'Country' not in df_raw.columns:
-        return pd.DataFrame(columns=[
-            'Scenario', 'Scenario Type', 'Area', 'ISO3', 'Value', 'Factor', 'level'
-        ])
+def match_asset_classes(selected, mode='all', k=None, excluded=(), constraints=None):
+    return core.match_asset_classes(l1_matrix, selected, mode, k, excluded, constraints,
+                                    st.session_state.get('scenario_type', 'All'), direction_method())
 
-    sub = df_raw[df_raw['Country'].notna()][
-        ['Scenario', 'Scenario Type', 'Factor', 'Country', 'Value']
-    ].copy()
+def common_direction(mask, included):
+    return core.common_direction(l1_matrix, mask, included, direction_method())
 
-    rows = []
-    for _, r in sub.iterrows():
-        iso3_specific = FACTOR_TO_ISO3.get(str(r['Factor']).strip())
-        rows.append({
-            'Scenario':      r['Scenario'],
-            'Scenario Type': r['Scenario Type'],
-            'Area':          r['Country'],
-            'ISO3':          iso3_specific if iso3_specific else None,
-            'Value':         r['Value'],
-            'Factor':        r['Factor'],
-            'level':         'country' if iso3_specific else 'area',
-        })
-    return pd.DataFrame(rows)
+# ─── GEO DATA ─────────────────────────────────────────────────────────────────
+def geo_data():
+    """(geo, fattori non mappati, indice) della versione corrente: costruito alla prima apertura della mappa."""
+    trace_cache(ds.geo.built)
+    return ds.geo.get()
 
+@st.cache_resource(max_entries=6)
+def geo_view(type_filter, version):
+    """Aggregati della mappa per filtro tipo e versione (vedi stress_core.geo_aggregates), condivisi in sola lettura."""
+    trace_cache(False)
+    geo_df, _, geo_index = geo_data()
+    return core.read_only(core.geo_aggregates(geo_df, geo_index, type_map, type_filter))
 
+@st.cache_resource(max_entries=6)
+def geo_base_figure(type_filter, version):
+    """Choropleth di base (senza evidenziazione) come dict, una volta per filtro tipo e versione.
 
-try:
-    geo_df = load_geo_data()
-    GEO_AVAILABLE = not geo_df.empty
-except Exception:
-    geo_df = pd.DataFrame()
-    GEO_AVAILABLE = False
+    Condiviso tra le sessioni: go.Figure(dict) costruisce una figura nuova senza modificarlo.
+    """
+    trace_cache(False)
+    return core.choropleth_figure(geo_view(type_filter, version)['country_agg'])
 
 
 # ─── EXPORT ───────────────────────────────────────────────────────────────────
-def build_export_bytes(df_sub, include_all_scenarios=False):
-    cols_out = ['Scenario', 'Scenario Type', 'Description', 'Factor',
-                'Value', 'Unit', 'Extra', 'L3', 'L2', 'L1']
-    cols_out = [c for c in cols_out if c in df_sub.columns]
-
-    if include_all_scenarios:
-        all_known = set(desc_map.keys()) | set(type_map.keys())
-        present   = set(df_sub['Scenario'].unique())
-        missing   = all_known - present
-        if missing:
-            empty_rows = pd.DataFrame([{
-                'Scenario':      sc,
-                'Scenario Type': type_map.get(sc, ''),
-                'Description':   desc_map.get(sc, ''),
-                'Factor': '', 'Value': np.nan, 'Unit': '',
-                'Extra': '', 'L3': '', 'L2': '', 'L1': '',
-            } for sc in sorted(missing)])
-            df_sub = pd.concat([df_sub, empty_rows], ignore_index=True)
-
-    export_df = df_sub[cols_out].sort_values(
-        ['Scenario', 'L1', 'L2', 'L3'], na_position='last'
-    ).copy()
-    export_df = export_df.rename(columns={'L1': 'Livello 1', 'L2': 'Livello 2', 'L3': 'Livello 3'})
-
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine='openpyxl') as writer:
-        export_df.to_excel(writer, index=False, sheet_name='Scenarios')
-        ws = writer.sheets['Scenarios']
-        for col_cells in ws.columns:
-            max_len = max((len(str(c.value or '')) for c in col_cells), default=10)
-            ws.column_dimensions[col_cells[0].column_letter].width = min(max_len + 4, 60)
-    buf.seek(0)
-    return buf.getvalue()
+XLSX_MIME            = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_INLINE_ROWS   = int(os.environ.get("STRESS_EXPORT_INLINE_ROWS", 5_000))   # fino a qui: file al click
+EXPORT_WORKERS       = int(os.environ.get("STRESS_EXPORT_WORKERS", 2))
+EXPORT_SESSION_LIMIT = 2        # export in background attivi per sessione
+BULK_WORKERS         = int(os.environ.get("STRESS_BULK_WORKERS", 0)) or None   # processi per gli ZIP (0: n. core)
+
+@traced('build_export_bytes')
+def build_export_bytes(df_sub, include_all_scenarios=False, progress=None):
+    trace_rows(len(df_sub))
+    return core.build_export_bytes(df_sub, include_all_scenarios, desc_map, type_map, progress=progress)
+
+@traced('build_scenario_zip')
+def build_scenario_zip(scenarios, fmt, progress=None):
+    trace_rows(len(scenarios))
+    return core.build_scenario_zip(df_all, scenarios, fmt, desc_map, type_map, BULK_WORKERS, progress)
+
+@st.cache_resource
+def export_cache():
+    return ExportCache()
+
+@st.cache_resource
+def export_jobs():
+    """Pool condiviso per gli export pesanti: EXPORT_WORKERS thread, EXPORT_SESSION_LIMIT job per sessione."""
+    return core.ExportJobs(export_cache(), workers=EXPORT_WORKERS, per_owner=EXPORT_SESSION_LIMIT)
+
+def export_spec(scenarios, type_filter, include_all=False, fmt='xlsx', per_scenario=False):
+    """(chiave, build, righe) di un export: build(progress=None) produce i byte del file,
+    o dello ZIP con un file per scenario se per_scenario."""
+    scenarios = list(scenarios)
+    # L'export completo dipende solo dalla versione: niente hash di tutti gli scenari a ogni rerun
+    key = f"all:{ds.version}" if include_all else export_key(scenarios, type_filter, include_all, ds.fingerprints)
+    if fmt != 'xlsx' or per_scenario:
+        key = f"{key}:{fmt}{':zip' if per_scenario else ''}"
+    def build(progress=None):
+        if per_scenario:
+            return build_scenario_zip(scenarios, fmt, progress)
+        source = df_all if include_all else scenario_rows(df_all, scenarios, sc_index)
+        if fmt == 'xlsx':
+            return build_export_bytes(source, include_all_scenarios=include_all, progress=progress)
+        return core.export_file_bytes(source, fmt, desc_map, type_map, include_all)
+    n_rows = len(df_all) if include_all else sum(hi - lo for lo, hi in (sc_index[sc] for sc in set(scenarios) if sc in sc_index))
+    return key, build, n_rows
+
+def serve_export(key, build):
+    """Callable per st.download_button: il file si costruisce solo al click, una volta per contenuto."""
+    cache = export_cache()
+    def serve():
+        with trace('export_download'):
+            data, hit = cache.lookup(key, build)
+            trace_cache(hit)
+            return data
+    return serve
+
+def lazy_export(scenarios, type_filter, include_all=False):
+    key, build, _ = export_spec(scenarios, type_filter, include_all)
+    return serve_export(key, build)
+
+def queue_export(key, build, file_name, mime=XLSX_MIME):
+    job = export_jobs().submit(key, build, st.session_state.session_id)
+    if job is None:
+        st.toast(f"Up to {EXPORT_SESSION_LIMIT} exports at a time: wait for one to finish.", icon="⏳")
+        return
+    st.session_state.export_tray[key] = {'file': file_name, 'build': build, 'mime': mime}
+
+def drop_export(key):
+    st.session_state.export_tray.pop(key, None)
+
+def export_button(label, file_name, spec, widget_key, mime=XLSX_MIME, **kwargs):
+    """Download diretto per gli export piccoli o già pronti; oltre EXPORT_INLINE_ROWS righe il file
+    si prepara in background e compare nel riquadro dei download a fine costruzione."""
+    key, build, n_rows = spec
+    if n_rows <= EXPORT_INLINE_ROWS or export_cache().peek(key) is not None:
+        st.download_button(label=label, data=serve_export(key, build), file_name=file_name,
+                           mime=mime, key=widget_key, use_container_width=True, **kwargs)
+        return
+    job  = export_jobs().get(key)
+    busy = job is not None and job.active and key in st.session_state.export_tray
+    st.button(f"⏳ Preparing… {job.progress:.0%}" if busy else label, key=widget_key,
+              on_click=queue_export, args=(key, build, file_name, mime), disabled=busy,
+              help=f"{n_rows:,} rows: the file is built in the background, keep browsing "
+                   f"and download it from the exports panel when ready.",
+              use_container_width=True, **kwargs)
+
+def render_export_tray():
+    """Export in background della sessione: avanzamento finché il file è in costruzione, poi il download.
+
+    Il frammento si aggiorna da solo (ogni secondo) solo mentre c'è almeno un job attivo.
+    """
+    if not st.session_state.export_tray:
+        return
+    jobs    = export_jobs()
+    polling = any(j is not None and j.active for j in map(jobs.get, st.session_state.export_tray))
+
+    @st.fragment(run_every=1.0 if polling else None)
+    def tray():
+        running = False
+        for key, entry in list(st.session_state.export_tray.items()):
+            job = jobs.get(key)
+            c_name, c_state, c_drop = st.columns([3, 5, 0.6])
+            c_name.markdown(f'<div style="font-size:0.75rem;color:#374151;padding-top:8px;">'
+                            f'📄 {html.escape(entry["file"])}</div>', unsafe_allow_html=True)
+            with c_state:
+                if job is not None and job.active:
+                    running = True
+                    st.progress(job.progress, text="Queued…" if job.state == 'queued'
+                                else f"Building… {job.progress:.0%}")
+                elif job is not None and job.state == 'failed':
+                    st.error(f"Export failed: {job.error}")
+                else:
+                    st.download_button(label=f"⬇ Download {entry['file']}", data=serve_export(key, entry['build']),
+                                       file_name=entry['file'], mime=entry['mime'], key=f"tray_dl_{key}",
+                                       use_container_width=True)
+            c_drop.button("✕", key=f"tray_x_{key}", on_click=drop_export, args=(key,), help="Remove")
+        if polling and not running:
+            st.rerun()       # tutto pronto: rerun completo per fermare il polling
+
+    tray()
+
+# ─── COMPARE ──────────────────────────────────────────────────────────────────
+@st.cache_resource(max_entries=4)
+def uploaded_dataset(data):
+    """Dataset di un workbook caricato, con la stessa normalizzazione del principale; in cache per contenuto."""
+    trace_cache(False)
+    return core.prepare_dataset(core.read_shocks_bytes(data))
+
+@st.cache_resource(max_entries=8)
+def version_comparison(old_version, new_version, method, _old, _new):
+    """Confronto tra due Dataset, calcolato una volta per coppia di versioni e metodologia e condiviso."""
+    trace_cache(False)
+    return core.compare_datasets(_old, _new, method)
+
+def lazy_comparison_export(cmp, old_version, new_version, type_filter):
+    """Callable per st.download_button con l'export del confronto (un foglio per tabella)."""
+    key, cache = ('compare', old_version, new_version, direction_method(), type_filter), export_cache()
+    def build():
+        sheets = core.comparison_sheets(cmp)
+        if type_filter != 'All':
+            sheets = {name: frame[frame['Scenario Type'] == type_filter] if 'Scenario Type' in frame else frame
+                      for name, frame in sheets.items()}
+        return core.build_sheets_bytes(sheets)
+    def serve():
+        with trace('export_download'):
+            data, hit = cache.lookup(key, build)
+            trace_cache(hit)
+            return data
+    return serve
+
+# ─── PORTFOLIO P&L ────────────────────────────────────────────────────────────
+@st.cache_resource(max_entries=2)
+def shock_matrix(version, _df):
+    """Matrice sparsa scenari × fattori in bps, costruita una volta per versione del dataset."""
+    trace_cache(False)
+    return core.read_only(core.build_shock_matrix(_df))
+
+@st.cache_data(max_entries=8)
+def uploaded_exposures(data, name):
+    """Esposizioni per fattore (P&L per 1 bp) dal file caricato."""
+    trace_cache(False)
+    return core.read_exposures(data, name)
+
+def lazy_pnl_export(result, table, exposures_key):
+    """Callable per st.download_button: P&L per scenario e scomposizione L1/L2/L3."""
+    key, cache = ('pnl', ds.version, exposures_key, _type_sel), export_cache()
+    def build():
+        scenarios = set(table['Scenario'])
+        sheets = {'P&L': table}
+        sheets.update({f'By {level}': frame[frame['Scenario'].isin(scenarios)]
+                       for level, frame in result.breakdown.items()})
+        sheets['Unmatched factors'] = result.unmatched.rename('Exposure per bp').rename_axis('Factor').reset_index()
+        return core.build_sheets_bytes(sheets)
+    def serve():
+        with trace('export_download'):
+            data, hit = cache.lookup(key, build)
+            trace_cache(hit)
+            return data
+    return serve
+
+# ─── SIMILARITY ───────────────────────────────────────────────────────────────
+@st.cache_resource(max_entries=2)
+def similarity_index(version, _df, _type_map):
+    """Vicini per coseno e cluster di ogni scenario: il lavoro a coppie si fa una volta per versione."""
+    trace_cache(False)
+    return core.read_only(core.build_similarity_index(shock_matrix(version, _df), _type_map))
+
+SIMILAR_SHOWN = 8
+
+def similar_panel_html(sim_index, scenario):
+    """Contenuto del pannello "scenari simili" di una riga."""
+    similar = core.similar_scenarios(sim_index, scenario, SIMILAR_SHOWN, _type_sel)
+    if not similar:
+        return ('<div style="font-size:0.75rem;color:#6b6b6b;">'
+                'No scenario shares directional (bps) shocks with this one.</div>')
+    cluster, members = core.scenario_cluster(sim_index, scenario)
+    out = ('<div style="font-size:0.65rem;color:#9ca3af;text-transform:uppercase;letter-spacing:0.06em;'
+           'margin-bottom:6px;">Most similar · cosine on normalized shocks</div>')
+    for other, score in similar:
+        sc_type   = type_map.get(other, '')
+        badge_cls = 'type-brs' if sc_type == 'BRS' else 'type-ec'
+        width     = max(0, int(round(score * 100)))
+        out += (f'<div class="factor-row" title="{html.escape(str(desc_map.get(other, "")))}">'
+                f'<span class="factor-name"><strong>{other}</strong>'
+                f'<span class="type-badge {badge_cls}">{sc_type}</span></span>'
+                f'<span style="display:inline-flex;align-items:center;gap:6px;white-space:nowrap;">'
+                f'<span style="display:inline-block;width:48px;height:5px;background:#f0f0f0;border-radius:3px;">'
+                f'<span style="display:block;width:{width}%;height:5px;background:#ff4b4b;border-radius:3px;"></span></span>'
+                f'{score:.2f}</span></div>')
+    out += (f'<div style="font-size:0.68rem;color:#6b6b6b;margin-top:8px;">'
+            f'Cluster #{cluster + 1} · {len(members)} scenario{"s" if len(members) != 1 else ""}</div>')
+    return out
+
+# ─── SEARCH ───────────────────────────────────────────────────────────────────
+@st.cache_resource(max_entries=2)
+def search_index(version, _df, _desc_map, _type_map):
+    """Indice invertito + trigrammi su scenari, descrizioni, fattori, L1–L3 e token Extra, per versione."""
+    trace_cache(False)
+    return core.read_only(core.build_search_index(_df, _desc_map, _type_map))
+
+def clear_search():
+    st.session_state.search_q = ''
 
 # ─── SESSION STATE ─────────────────────────────────────────────────────────────
 for k, v in {
     'sel_l1_set': set(), 'sel_l1_single': None, 'sel_l2': None, 'sel_l3': None,
     'mode': 'drill', 'shock_filter': 'all', 'quick_view': None, 'multi_dir_filter': None,
-    'scenario_type': 'All', 'geo_area': None,
+    'scenario_type': 'All', 'geo_area': None, 'direction_method': core.DEFAULT_METHOD,
+    'session_id': None, 'export_tray': {},
 }.items():
     if k not in st.session_state:
         st.session_state[k] = v
+if st.session_state.session_id is None:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # ─── HEADER ────────────────────────────────────────────────────────────────────
-_n_sc = df['Scenario'].nunique()
-_n_l1 = df['L1'].nunique()
+_sp_header = trace('header', rows=len(df)).start()
+_hv   = cached_call(header_view, ds.version, df_all)
+_n_sc = _hv['n_scenarios']
+_n_l1 = _hv['n_l1']
 
 st.markdown(f"""
 <div class="fin-header">
@@ -388,33 +641,19 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-_l1_counts = df.groupby('L1')['Scenario'].nunique().sort_values(ascending=False)
-_max_c = max(_l1_counts.values) if len(_l1_counts) else 1
-
-_hm_cells = ''
-for l1_name, cnt in _l1_counts.items():
-    bar_h = max(3, int(16 * cnt / _max_c))
-    bar_svg = (f'<svg width="48" height="16" style="display:block;margin-top:3px">'
-               f'<rect x="0" y="{16-bar_h}" width="48" height="{bar_h}" '
-               f'fill="#ff4b4b" rx="2" opacity="0.7"/>'
-               f'</svg>')
-    _hm_cells += (f'<div class="hm-cell">'
-                  f'<div class="hm-label">{str(l1_name)[:15]}</div>'
-                  f'<div class="hm-count">{cnt}</div>'
-                  f'{bar_svg}'
-                  f'</div>')
-
 st.markdown(f"""
 <div class="hm-strip">
   <div class="hm-strip-title">
     Scenarios per asset class &nbsp;·&nbsp; {_n_sc} total &nbsp;·&nbsp; {_n_l1} classes
   </div>
-  {_hm_cells}
+  {_hv['strip_html']}
 </div>
 """, unsafe_allow_html=True)
+_sp_header.stop()
+trace_mark('first_paint')
 
 # Mode buttons + download all
-col_m1, col_m2, col_m3, col_m4 = st.columns([2, 2, 2, 6])
+col_m1, col_m2, col_m3, col_m5, col_m6, col_m4 = st.columns([2, 2, 2, 2, 2, 4])
 with col_m1:
     if st.button("🔍 Single Asset Class Analysis", use_container_width=True):
         st.session_state.update({'mode': 'drill', 'sel_l1_set': set(), 'sel_l1_single': None,
@@ -431,17 +670,22 @@ with col_m3:
     if st.button("🌍 Geographic Map", use_container_width=True):
         st.session_state.update({'mode': 'map', 'geo_area': None})
         st.rerun()
+with col_m5:
+    if st.button("🆚 Compare Versions", use_container_width=True):
+        st.session_state.update({'mode': 'compare', 'geo_area': None})
+        st.rerun()
+with col_m6:
+    if st.button("💼 Portfolio P&L", use_container_width=True):
+        st.session_state.update({'mode': 'pnl', 'geo_area': None})
+        st.rerun()
 with col_m4:
     inner_left, inner_right = st.columns([5, 3])
+    with inner_left:
+        st.selectbox("Direction methodology", list(DIRECTION_METHODS), format_func=DIRECTION_METHODS.get,
+                     key='direction_method', label_visibility='collapsed')
     with inner_right:
-        st.download_button(
-            label="⬇ Download All Scenarios",
-            data=build_export_bytes(df, include_all_scenarios=True),
-            file_name="all_scenarios.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key="dl_all",
-            use_container_width=True,
-        )
+        export_button("⬇ Download All Scenarios", "all_scenarios.xlsx",
+                      export_spec((), 'All', include_all=True), "dl_all")
 with col_m4:
     st.markdown("""
     <style>
@@ -472,7 +716,9 @@ with col_m4:
     .mp-green { color:#4ade80; font-weight:600; }
     .mp-red   { color:#f87171; font-weight:600; }
     .mp-amber { color:#fbbf24; font-weight:600; }
+    .mp-alt   { color:#9ca3af; }
     </style>
+    """ + f"""
     <div class="method-tip">
         <div class="method-icon">?
             <div class="method-popup">
@@ -480,23 +726,26 @@ with col_m4:
                 <div class="mp-row">For each scenario, all shocks belonging to the selected <b>asset class</b> (or sub-level) are collected and converted to a <b>common unit (bps)</b>:</div>
                 <div class="mp-row">· bps → as-is &nbsp;· pct × 100 &nbsp;· rel% × 100</div>
                 <div class="mp-row"><b>Excluded</b>: pct/yr, Price, Index Level, FX Rate — these are absolute levels, not directional shocks.</div>
-                <div class="mp-row">The <b>arithmetic mean</b> of all converted values is computed:</div>
-                <div class="mp-row"><span class="mp-green">▲ Positive</span> — mean &gt; 0</div>
-                <div class="mp-row"><span class="mp-red">▼ Negative</span> — mean &lt; 0</div>
-                <div class="mp-row"><span class="mp-amber">~ Mixed</span> — mean = 0, or no directional shocks available</div>
+                <div class="mp-row">{METHOD_HELP[direction_method()]}:</div>
+                <div class="mp-row"><span class="mp-green">▲ Positive</span> — score &gt; 0</div>
+                <div class="mp-row"><span class="mp-red">▼ Negative</span> — score &lt; 0</div>
+                <div class="mp-row"><span class="mp-amber">~ Mixed</span> — score = 0, or no directional shocks available</div>
+                <div class="mp-row mp-alt">Other methods: {' · '.join(label for m, label in DIRECTION_METHODS.items() if m != direction_method())} — switch with the selector.</div>
                 <div class="mp-row" style="margin-top:8px;color:#9ca3af;font-size:0.65rem;">
                 Direction re-evaluates as you drill down: at L2 only that L2's shocks are used, at L3 only that L3's shocks.</div>
             </div>
         </div>
-        <span class="method-label">Direction methodology</span>
+        <span class="method-label">Direction methodology · {DIRECTION_METHODS[direction_method()]}</span>
     </div>
     """, unsafe_allow_html=True)
+render_export_tray()
 st.markdown("---")
 
 # ─── FILTRO SCENARIO TYPE ──────────────────────────────────────────────────────
-_sc_brs   = df[df['Scenario Type'] == 'BRS']['Scenario'].nunique()
-_sc_ec    = df[df['Scenario Type'] == 'EC']['Scenario'].nunique()
-_sc_all   = df['Scenario'].nunique()
+_sp_chips = trace('filter_chips', rows=len(df)).start()
+_sc_brs   = _hv['by_type'].get('BRS', 0)
+_sc_ec    = _hv['by_type'].get('EC', 0)
+_sc_all   = _n_sc
 _cur_type = st.session_state.scenario_type
 
 def _chip_cls(kind, active):
@@ -574,64 +823,36 @@ with _tc3:
 
 _type_sel = st.session_state.scenario_type
 if _type_sel in ('BRS', 'EC'):
-    df = df[df['Scenario Type'] == _type_sel]
+    df = cached_call(type_frame, ds.version, _type_sel, df_all)
+_sp_chips.stop()
 
-st.markdown("---")
+# ─── RICERCA ───────────────────────────────────────────────────────────────────
+_search_q = st.text_input(
+    "Search", key='search_q', label_visibility='collapsed',
+    placeholder="🔎 Search scenarios, descriptions, factors, asset classes, target blocks…").strip()
+if st.session_state.get('search_last') != _search_q:
+    st.session_state.update({'search_last': _search_q, 'page_search': 0})
 
-# ─── JS colora bottoni ─────────────────────────────────────────────────────────
-components.html("""
-<script>
-(function() {
-    function styleMiniBtns(doc) {
-        doc.querySelectorAll('button').forEach(function(btn) {
-            var txt = (btn.innerText || btn.textContent || '').trim();
-            if (txt.includes('Positive')) {
-                btn.style.setProperty('background-color', '#16a34a', 'important');
-                btn.style.setProperty('color', '#ffffff', 'important');
-                btn.style.setProperty('border', '1.5px solid #15803d', 'important');
-                btn.style.setProperty('font-size', '0.72rem', 'important');
-                btn.style.setProperty('font-weight', '600', 'important');
-                btn.style.setProperty('min-height', '28px', 'important');
-                btn.style.setProperty('height', '28px', 'important');
-                btn.style.setProperty('padding', '0 8px', 'important');
-                btn.style.setProperty('border-radius', '5px', 'important');
-            } else if (txt.includes('Negative')) {
-                btn.style.setProperty('background-color', '#dc2626', 'important');
-                btn.style.setProperty('color', '#ffffff', 'important');
-                btn.style.setProperty('border', '1.5px solid #b91c1c', 'important');
-                btn.style.setProperty('font-size', '0.72rem', 'important');
-                btn.style.setProperty('font-weight', '600', 'important');
-                btn.style.setProperty('min-height', '28px', 'important');
-                btn.style.setProperty('height', '28px', 'important');
-                btn.style.setProperty('padding', '0 8px', 'important');
-                btn.style.setProperty('border-radius', '5px', 'important');
-            } else if (txt.includes('Mixed')) {
-                btn.style.setProperty('background-color', '#ffffff', 'important');
-                btn.style.setProperty('color', '#b45309', 'important');
-                btn.style.setProperty('border', '1.5px solid #b45309', 'important');
-                btn.style.setProperty('font-size', '0.72rem', 'important');
-                btn.style.setProperty('font-weight', '600', 'important');
-                btn.style.setProperty('min-height', '28px', 'important');
-                btn.style.setProperty('height', '28px', 'important');
-                btn.style.setProperty('padding', '0 8px', 'important');
-                btn.style.setProperty('border-radius', '5px', 'important');
-            }
-        });
-    }
-    var target = window.parent.document.body;
-    styleMiniBtns(window.parent.document);
-    var observer = new MutationObserver(function() { styleMiniBtns(window.parent.document); });
-    observer.observe(target, { childList: true, subtree: true });
-})();
-</script>
-""", height=0)
+st.markdown("---")
 
 # ─── EXPORT ROW ───────────────────────────────────────────────────────────────
+def render_bulk_export(scenarios, fname_base):
+    """Export multi-formato (xlsx, csv, parquet): file unico o ZIP con un file per scenario."""
+    with st.popover("📦 Bulk export", use_container_width=True, disabled=not len(scenarios)):
+        fmt = st.radio("Format", list(core.EXPORT_FORMATS), horizontal=True, key=f"bulk_fmt_{fname_base}",
+                       format_func=lambda f: core.EXPORT_FORMATS[f][0])
+        per_scenario = st.toggle("One file per scenario (ZIP)", value=True, key=f"bulk_zip_{fname_base}")
+        file_name = f"{fname_base}.{'zip' if per_scenario else fmt}".replace(' ', '_')
+        export_button(f"⬇ {file_name}", file_name,
+                      export_spec(scenarios, _type_sel, fmt=fmt, per_scenario=per_scenario),
+                      f"bulk_dl_{fname_base}",
+                      mime=core.ZIP_MIME if per_scenario else core.EXPORT_FORMATS[fmt][1])
+        st.caption("CSV and Parquet keep the Excel columns and order and load much faster downstream.")
+
 def render_export_row(df_full, df_display, fname_base):
     n = df_display['Scenario'].nunique()
     scenarios_to_export = df_display['Scenario'].unique()
-    df_export = df[df['Scenario'].isin(scenarios_to_export)]
-    col_info, col_dl, _ = st.columns([2.5, 2, 6])
+    col_info, col_dl, col_bulk, _ = st.columns([2.5, 2, 2, 4])
     with col_info:
         st.markdown(
             f'<div style="font-size:0.72rem;color:#6b6b6b;padding-top:8px;">'
@@ -641,140 +862,258 @@ def render_export_row(df_full, df_display, fname_base):
             f'</div>',
             unsafe_allow_html=True
         )
+    with col_dl:
+        export_button("⬇ Export Excel", f"{fname_base}.xlsx".replace(' ', '_'),
+                      export_spec(scenarios_to_export, _type_sel), f"dl_{fname_base}_{id(df_display)}")
+    with col_bulk:
+        render_bulk_export(scenarios_to_export, fname_base)
+
+# ─── SCENARIO ROWS ─────────────────────────────────────────────────────────────
+ROW_HTML_ITEMS = 4096   # frammenti di riga in cache (LRU, tutte le sessioni)
+ROWS_PAGE_SIZE = 25
+
+def _scenario_page(scenarios, key):
+    """Paginazione lato server: restituisce solo gli scenari della pagina corrente."""
+    n       = len(scenarios)
+    n_pages = max(1, -(-n // ROWS_PAGE_SIZE))
+    state   = f"page_{key}"
+    page    = min(st.session_state.get(state, 0), n_pages - 1)
+    lo, hi  = page * ROWS_PAGE_SIZE, min((page + 1) * ROWS_PAGE_SIZE, n)
+    if n_pages > 1:
+        c_prev, c_info, c_next, _ = st.columns([0.5, 2, 0.5, 8])
+        with c_prev:
+            if st.button("‹", key=f"pg_prev_{key}", disabled=page == 0, use_container_width=True):
+                st.session_state[state] = page - 1
+                st.rerun()
+        with c_info:
+            st.markdown(
+                f'<div style="font-size:0.72rem;color:#6b6b6b;padding-top:8px;text-align:center;">'
+                f'Scenarios {lo + 1}–{hi} of {n} · page {page + 1}/{n_pages}</div>',
+                unsafe_allow_html=True
+            )
+        with c_next:
+            if st.button("›", key=f"pg_next_{key}", disabled=page == n_pages - 1,
+                         use_container_width=True):
+                st.session_state[state] = page + 1
+                st.rerun()
+    return scenarios[lo:hi]
+
+def scenario_summary(df_display, path_mode=False):
+    """Una riga per scenario (fattori e shock concatenati) per la vista tabellare."""
+    rows  = df_display.sort_values(['Scenario', 'L3'])
+    label = rows['L3'].astype(str).where(rows['L3'].notna(), '—')
+    if path_mode:
+        label = rows['L1'].astype(str)
+        for c in ['L2', 'L3']:
+            label = label.where(rows[c].isna(), label + ' › ' + rows[c].astype(str))
+    label = label.where(rows['Factor'].isna(), label + ' · ' + rows['Factor'].astype(str))
+    shock = rows['Value'].map('{:+.1f}'.format, na_action='ignore').fillna('—')
+    shock = shock.where(rows['Unit'].isna() | rows['Value'].isna(), shock + ' ' + rows['Unit'].astype(str))
+    grouped = (label + ': ' + shock).groupby(rows['Scenario'], sort=True, observed=True)
+    summary = pd.DataFrame({'Shocks': grouped.size(), 'Factors · Shock Value': grouped.agg('; '.join)})
+    summary.index.name = 'Scenario'
+    summary = summary.reset_index()
+    summary.insert(1, 'Type', summary['Scenario'].map(type_map))
+    summary['Description'] = summary['Scenario'].map(desc_map)
+    return summary
+
+def render_scenario_grid(df_display, key, path_mode=False, order=None):
+    summary = scenario_summary(df_display, path_mode)
+    if order is not None:
+        summary = summary.set_index('Scenario').reindex(order).dropna(how='all').reset_index()
+    event = st.dataframe(
+        summary, hide_index=True, use_container_width=True,
+        height=min(38 + 35 * len(summary), 560),
+        on_select='rerun', selection_mode='multi-row', key=f"grid_{key}",
+        column_config={
+            'Scenario':              st.column_config.TextColumn(width='medium'),
+            'Type':                  st.column_config.TextColumn(width='small'),
+            'Shocks':                st.column_config.NumberColumn(width='small'),
+            'Factors · Shock Value': st.column_config.TextColumn(width='large'),
+            'Description':           st.column_config.TextColumn(width='large'),
+        },
+    )
+    selected = summary['Scenario'].iloc[event.selection.rows].tolist()
+    col_info, col_dl, col_bulk, _ = st.columns([2.5, 2, 2, 4])
+    with col_info:
+        st.markdown(
+            f'<div style="font-size:0.72rem;color:#6b6b6b;padding-top:8px;">'
+            f'{len(selected)} selected<br>'
+            f'<span style="font-size:0.65rem;color:#9ca3af;font-style:italic;">'
+            f'Select rows to export all their shocks.</span></div>',
+            unsafe_allow_html=True
+        )
     with col_dl:
         st.download_button(
-            label="⬇ Export Excel",
-            data=build_export_bytes(df_export),
-            file_name=f"{fname_base}.xlsx".replace(' ', '_'),
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key=f"dl_{fname_base}_{id(df_display)}",
+            label="⬇ Export selected",
+            data=lazy_export(selected, _type_sel),
+            file_name=(f"scenario_{selected[0]}.xlsx" if len(selected) == 1
+                       else f"scenarios_{key}_selected.xlsx").replace(' ', '_'),
+            mime=XLSX_MIME,
+            key=f"dl_sel_{key}",
+            disabled=not selected,
             use_container_width=True,
         )
+    with col_bulk:
+        render_bulk_export(selected, f"scenarios_{key}_selected")
+
+@st.cache_resource
+def row_html_cache():
+    """Frammenti HTML delle righe scenario già rese, condivisi tra le sessioni (LRU limitata)."""
+    return core.LRUCache(max_items=ROW_HTML_ITEMS)
+
+def scenario_row_html(scenario, sc_rows, path_mode=False):
+    """(cella scenario, cella fattori) di una riga della vista dettagliata."""
+    sc_rows  = sc_rows.sort_values('L3')
+    long_des = desc_map.get(str(scenario).strip(), '')
+    sc_type  = type_map.get(str(scenario).strip(), '')
+    badge_cls = 'type-brs' if sc_type == 'BRS' else 'type-ec'
+
+    # Fattori che compaiono più volte in questo scenario → mostra extra per disambiguare
+    _factor_counts = sc_rows['Factor'].value_counts()
+    _dup_factors   = set(_factor_counts[_factor_counts > 1].index.tolist())
+
+    factors_html = '<div class="factor-list" style="margin-top:0">'
+    for _, r in sc_rows.iterrows():
+        val  = r['Value']
+        unit = r['Unit'] if not pd.isna(r['Unit']) else ''
+        shock_str = format_shock(val, unit)
+
+        _fc = str(r.get('Factor', '')).strip()
+        # Mostra extra solo se il fattore è duplicato nello scenario
+        _ex = parse_extra(r.get('Extra', '')) if _fc in _dup_factors else ''
+        _extra_tag = (
+            f' <span style="color:#b0b7c3;font-size:0.68rem;font-weight:400;'
+            f'font-style:italic;">[{_ex}]</span>'
+            if _ex else ''
+        )
+        _factor_suffix = (
+            f' <span style="color:#9ca3af;font-size:0.72rem;font-weight:400;">· {_fc}</span>{_extra_tag}'
+            if _fc not in ('', 'nan') else _extra_tag
+        )
+        if path_mode:
+            _path = " › ".join([str(r[c]) for c in ['L1', 'L2', 'L3']
+                                if str(r.get(c, '')).strip() not in ('', 'nan')])
+            factor_label = _path + _factor_suffix
+        else:
+            _l3 = str(r['L3']) if str(r.get('L3', '')).strip() not in ('', 'nan') else '—'
+            factor_label = _l3 + _factor_suffix
+
+        try:
+            is_num = not pd.isna(val)
+            num = float(val)
+        except:
+            is_num = False
+            num = np.nan
+
+        bps_v = to_bps(val, unit)
+        if not pd.isna(bps_v):
+            if bps_v > 0:   val_cls, arrow = "factor-val-pos", "▲ "
+            elif bps_v < 0: val_cls, arrow = "factor-val-neg", "▼ "
+            else:           val_cls, arrow = "factor-val-zero", ""
+        elif is_num and num > 0:   val_cls, arrow = "factor-val-pos", "▲ "
+        elif is_num and num < 0:   val_cls, arrow = "factor-val-neg", "▼ "
+        else:                      val_cls, arrow = "factor-val-zero", ""
+
+        factors_html += (f'<div class="factor-row">'
+                         f'<span class="factor-name">{factor_label}</span>'
+                         f'<span class="{val_cls}">{arrow}{shock_str}</span>'
+                         f'</div>')
+    factors_html += '</div>'
+    des_html = f'<div class="long-des">{long_des}</div>' if long_des else ''
+    badge_html = f'<span class="type-badge {badge_cls}">{sc_type}</span>'
+    sc_html = (f'<div style="padding:8px 12px;border-bottom:1px solid #f0f0f0;'
+               f'border-left:1px solid #e6e6e6;min-height:48px;">'
+               f'<strong>{scenario}</strong>{badge_html}{des_html}</div>')
+    factors_html = (f'<div style="padding:4px 12px;border-bottom:1px solid #f0f0f0;'
+                    f'border-left:1px solid #e6e6e6;">{factors_html}</div>')
+    return sc_html, factors_html
+
+@traced('render_scenario_rows')
+def render_scenario_rows(df_display, th_class="", path_mode=False, key=None, order=None):
+    """Vista dettagliata o tabellare degli scenari; `order` (es. ranking della ricerca) sostituisce
+    l'ordine alfabetico."""
+    key = key or th_class or 'all'
+    trace_rows(len(df_display))
+    view = st.radio("View", ["Detailed", "Table"], horizontal=True, key=f"view_{key}",
+                    label_visibility="collapsed")
+    if view == "Table":
+        render_scenario_grid(df_display, key, path_mode, order)
+        return
 
-# ─── SCENARIO ROWS ─────────────────────────────────────────────────────────────
-def render_scenario_rows(df_display, df_all_shocks, th_class="", path_mode=False):
     th_color = {"pos-th": "#16a34a", "neg-th": "#dc2626",
                 "mix-th": "#b45309"}.get(th_class, "#ff4b4b")
+    display_index  = scenario_bounds(df_display)
+    page_scenarios = _scenario_page(order if order is not None else sorted(display_index), key)
+    with trace('similarity'):
+        sim_index = cached_call(similarity_index, ds.version, df_all, type_map)
 
     st.markdown(f"""
     <table class="scenario-table" style="margin-bottom:0">
         <thead><tr>
             <th class="{th_class}" style="background:{th_color};width:30%">Scenario</th>
             <th class="{th_class}" style="background:{th_color}">Factors (L3) · Shock Value</th>
-            <th class="{th_class}" style="background:{th_color};width:40px"></th>
+            <th class="{th_class}" style="background:{th_color};width:80px"></th>
         </tr></thead>
     </table>""", unsafe_allow_html=True)
 
-    for scenario in sorted(df_display['Scenario'].unique()):
-        sc_rows  = df_display[df_display['Scenario'] == scenario].sort_values('L3')
-        long_des = desc_map.get(str(scenario).strip(), '')
-        sc_type  = type_map.get(str(scenario).strip(), '')
-        badge_cls = 'type-brs' if sc_type == 'BRS' else 'type-ec'
-
-        # Fattori che compaiono più volte in questo scenario → mostra extra per disambiguare
-        _factor_counts = sc_rows['Factor'].value_counts()
-        _dup_factors   = set(_factor_counts[_factor_counts > 1].index.tolist())
-
-        factors_html = '<div class="factor-list" style="margin-top:0">'
-        for _, r in sc_rows.iterrows():
-            val  = r['Value']
-            unit = r['Unit'] if not pd.isna(r['Unit']) else ''
-            shock_str = format_shock(val, unit)
-
-            _fc = str(r.get('Factor', '')).strip()
-            # Mostra extra solo se il fattore è duplicato nello scenario
-            _ex = parse_extra(r.get('Extra', '')) if _fc in _dup_factors else ''
-            _extra_tag = (
-                f' <span style="color:#b0b7c3;font-size:0.68rem;font-weight:400;'
-                f'font-style:italic;">[{_ex}]</span>'
-                if _ex else ''
-            )
-            _factor_suffix = (
-                f' <span style="color:#9ca3af;font-size:0.72rem;font-weight:400;">· {_fc}</span>{_extra_tag}'
-                if _fc not in ('', 'nan') else _extra_tag
-            )
-            if path_mode:
-                _path = " › ".join([str(r[c]) for c in ['L1', 'L2', 'L3']
-                                    if str(r.get(c, '')).strip() not in ('', 'nan')])
-                factor_label = _path + _factor_suffix
-            else:
-                _l3 = str(r['L3']) if str(r.get('L3', '')).strip() not in ('', 'nan') else '—'
-                factor_label = _l3 + _factor_suffix
-
-            try:
-                is_num = not pd.isna(val)
-                num = float(val)
-            except:
-                is_num = False
-                num = np.nan
-
-            bps_v = to_bps(val, unit)
-            if not pd.isna(bps_v):
-                if bps_v > 0:   val_cls, arrow = "factor-val-pos", "▲ "
-                elif bps_v < 0: val_cls, arrow = "factor-val-neg", "▼ "
-                else:           val_cls, arrow = "factor-val-zero", ""
-            elif is_num and num > 0:   val_cls, arrow = "factor-val-pos", "▲ "
-            elif is_num and num < 0:   val_cls, arrow = "factor-val-neg", "▼ "
-            else:                      val_cls, arrow = "factor-val-zero", ""
-
-            factors_html += (f'<div class="factor-row">'
-                             f'<span class="factor-name">{factor_label}</span>'
-                             f'<span class="{val_cls}">{arrow}{shock_str}</span>'
-                             f'</div>')
-        factors_html += '</div>'
-        des_html = f'<div class="long-des">{long_des}</div>' if long_des else ''
-        badge_html = f'<span class="type-badge {badge_cls}">{sc_type}</span>'
-
-        col_sc, col_factors, col_dl = st.columns([3, 6, 0.7])
+    # Frammenti per (versione, scenario, path_mode, righe mostrate): le righe sono etichette di
+    # ds.df, quindi codificano filtro di nodo, tipo e segno; rivedere uno scenario è un lookup
+    cache = row_html_cache()
+    with trace('row_html'):
+        fragments = {}
+        for scenario in page_scenarios:
+            sc_rows = scenario_rows(df_display, [scenario], display_index)
+            frag_key = (ds.version, scenario, path_mode, sc_rows.index.to_numpy().tobytes())
+            fragments[scenario], hit = cache.lookup(frag_key, lambda: scenario_row_html(scenario, sc_rows, path_mode))
+            trace_cache(hit)
+
+    for scenario in page_scenarios:
+        sc_html, factors_html = fragments[scenario]
+        col_sc, col_factors, col_sim, col_dl = st.columns([3, 6, 0.7, 0.7])
         with col_sc:
-            st.markdown(
-                f'<div style="padding:8px 12px;border-bottom:1px solid #f0f0f0;'
-                f'border-left:1px solid #e6e6e6;min-height:48px;">'
-                f'<strong>{scenario}</strong>{badge_html}{des_html}</div>',
-                unsafe_allow_html=True
-            )
+            st.markdown(sc_html, unsafe_allow_html=True)
         with col_factors:
-            st.markdown(
-                f'<div style="padding:4px 12px;border-bottom:1px solid #f0f0f0;'
-                f'border-left:1px solid #e6e6e6;">{factors_html}</div>',
-                unsafe_allow_html=True
-            )
+            st.markdown(factors_html, unsafe_allow_html=True)
+        with col_sim:
+            with st.popover("≈", use_container_width=True, help=f"Scenarios similar to {scenario}"):
+                st.markdown(similar_panel_html(sim_index, scenario), unsafe_allow_html=True)
         with col_dl:
-            df_sc_full = df_all_shocks[df_all_shocks['Scenario'] == scenario]
             st.download_button(
                 label="⬇",
-                data=build_export_bytes(df_sc_full),
+                data=lazy_export([scenario], _type_sel),
                 file_name=f"scenario_{scenario}.xlsx".replace(' ', '_'),
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key=f"dl_sc_{scenario}_{th_class}",
+                mime=XLSX_MIME,
+                key=f"dl_sc_{scenario}_{key}",
                 use_container_width=True,
                 help=f"Download all shocks for {scenario}",
             )
 
 # ─── QUICK-VIEW ───────────────────────────────────────────────────────────────
-def render_quick_view(df_context, col_name):
+def render_quick_view(df_context, col_name, parent=()):
     qv = st.session_state.quick_view
     if qv is None or qv['col'] != col_name:
         return
     item, direction = qv['item'], qv['dir']
-    df_item  = df_context[df_context[col_name] == item].copy()
-    sc_dirs  = get_scenario_directions(df_item)
-    matching = [sc for sc, d in sc_dirs.items() if d == direction]
+    sc_dirs  = node_directions(parent + (item,))
+    matching = sc_dirs.index[sc_dirs == direction].tolist()
+    # Prima le righe degli scenari (slice/take posizionale), poi una sola maschera: il contesto non viene copiato
+    df_sc    = scenario_rows(df_context, matching)
+    in_item  = (df_sc[col_name] == item).to_numpy()
+    df_item  = df_sc[in_item]
 
     if direction == 'pos':
         th_class   = "pos-th"
         label      = f"▲ Positive scenarios — {item}"
-        df_display = df_item[df_item['Scenario'].isin(matching)]
-        df_display = df_display[df_display['Value'].notna() & (df_display['Value'] > 0)]
+        df_display = df_sc[in_item & (df_sc['Value'] > 0).to_numpy()]
     elif direction == 'neg':
         th_class   = "neg-th"
         label      = f"▼ Negative scenarios — {item}"
-        df_display = df_item[df_item['Scenario'].isin(matching)]
-        df_display = df_display[df_display['Value'].notna() & (df_display['Value'] < 0)]
+        df_display = df_sc[in_item & (df_sc['Value'] < 0).to_numpy()]
     else:
         th_class   = "mix-th"
         label      = f"~ Mixed scenarios — {item}"
-        df_display = df_item[df_item['Scenario'].isin(matching)]
+        df_display = df_item
 
     st.markdown(f'<div class="section-header">{label}</div>', unsafe_allow_html=True)
     col_close, _ = st.columns([1.2, 8])
@@ -785,19 +1124,20 @@ def render_quick_view(df_context, col_name):
     if not matching:
         st.info("No scenarios found for this selection.")
         return
-    render_export_row(df_item[df_item['Scenario'].isin(matching)], df_display,
+    render_export_row(df_item, df_display,
                       f"scenarios_{item}_{direction}")
-    render_scenario_rows(df_display, df, th_class)
+    render_scenario_rows(df_display, th_class, key=f"qv_{col_name}")
 
 # ─── CARD RENDERER ────────────────────────────────────────────────────────────
-def render_cards(items, df_filtered, col_name, on_select_key, multi=False, show_mini=False):
+@traced('render_cards')
+def render_cards(items, parent, col_name, on_select_key, multi=False, show_mini=False):
     if not items: return
     ncols = min(len(items), 4)
     cols  = st.columns(ncols)
 
     for i, item in enumerate(items):
-        sub   = df_filtered[df_filtered[col_name] == item]
-        n_pos, n_neg, n_zero = count_directions(sub)
+        n_pos, n_neg, n_zero = node_counts(parent + (item,))
+        trace_rows(n_pos + n_neg + n_zero)
         is_sel    = (item in st.session_state.sel_l1_set) if multi else (st.session_state.get(on_select_key) == item)
         btn_label = f"{'✓ ' if is_sel else ''}{item}"
 
@@ -859,10 +1199,12 @@ def render_cards(items, df_filtered, col_name, on_select_key, multi=False, show_
                 st.rerun()
 
 # ─── STAT BOXES ───────────────────────────────────────────────────────────────
-def render_stat_boxes(df_sub):
-    n_sc                 = df_sub['Scenario'].nunique()
-    n_pos, n_neg, n_zero = count_directions(df_sub)
+@traced('render_stat_boxes')
+def render_stat_boxes(path):
+    n_pos, n_neg, n_zero = node_counts(path)
+    n_sc                 = n_pos + n_neg + n_zero
     cur_filter           = st.session_state.shock_filter
+    trace_rows(n_sc)
 
     tip_style = ('display:inline-flex;align-items:center;justify-content:center;'
                  'width:14px;height:14px;border-radius:50%;background:#e5e7eb;color:#6b7280;'
@@ -882,7 +1224,7 @@ def render_stat_boxes(df_sub):
         active_pos = cur_filter == 'pos'
         st.markdown(
             f'<div style="font-size:0.68rem;color:#16a34a;font-weight:600;margin-bottom:2px;">'
-            f'▲ Positive <span style="{tip_style}" title="Scenarios whose average shock (converted to bps) is positive.">?</span>'
+            f'▲ Positive <span style="{tip_style}" title="Scenarios whose {METHOD_SCORE[direction_method()]} (converted to bps) is positive.">?</span>'
             f'</div>', unsafe_allow_html=True)
         if st.button(f"▲ {n_pos}  Positive", key="filter_pos", use_container_width=True):
             st.session_state.shock_filter = 'all' if active_pos else 'pos'
@@ -894,7 +1236,7 @@ def render_stat_boxes(df_sub):
         active_neg = cur_filter == 'neg'
         st.markdown(
             f'<div style="font-size:0.68rem;color:#dc2626;font-weight:600;margin-bottom:2px;">'
-            f'▼ Negative <span style="{tip_style}" title="Scenarios whose average shock (converted to bps) is negative.">?</span>'
+            f'▼ Negative <span style="{tip_style}" title="Scenarios whose {METHOD_SCORE[direction_method()]} (converted to bps) is negative.">?</span>'
             f'</div>', unsafe_allow_html=True)
         if st.button(f"▼ {n_neg}  Negative", key="filter_neg", use_container_width=True):
             st.session_state.shock_filter = 'all' if active_neg else 'neg'
@@ -910,7 +1252,7 @@ def render_stat_boxes(df_sub):
                 '~ Mixed <span style="display:inline-flex;align-items:center;justify-content:center;'
                 'width:14px;height:14px;border-radius:50%;background:#e5e7eb;color:#6b7280;'
                 'font-size:0.6rem;font-weight:700;cursor:default;vertical-align:middle;" '
-                'title="Scenarios with a mean shock of exactly zero.">?</span></div>',
+                f'title="Scenarios with a {METHOD_SCORE[direction_method()]} of exactly zero.">?</span></div>',
                 unsafe_allow_html=True)
             if st.button(f"~ {n_zero}  Mixed", key="filter_zero", use_container_width=True):
                 st.session_state.shock_filter = 'all' if active_zero else 'zero'
@@ -920,10 +1262,10 @@ def render_stat_boxes(df_sub):
                             unsafe_allow_html=True)
 
 # ─── SCENARIO TABLE ───────────────────────────────────────────────────────────
-def render_scenario_table(df_sub):
-    render_stat_boxes(df_sub)
+def render_scenario_table(df_sub, path):
+    render_stat_boxes(path)
     f       = st.session_state.shock_filter
-    sc_dirs = get_scenario_directions(df_sub)
+    sc_dirs = node_directions(path).to_dict()
 
     if f == 'pos':
         matching          = [sc for sc, d in sc_dirs.items() if d == 'pos']
@@ -942,7 +1284,7 @@ def render_scenario_table(df_sub):
         st.info("No scenarios found for this filter.")
         return
 
-    df_matching = df_sub[df_sub['Scenario'].isin(matching)]
+    df_matching = scenario_rows(df_sub, matching)
 
     if f == 'pos':
         df_display = df_matching[df_matching['Value'].notna() & (df_matching['Value'] > 0)]
@@ -953,13 +1295,34 @@ def render_scenario_table(df_sub):
 
     fname = f"scenarios_{st.session_state.get('sel_l3', st.session_state.get('sel_l2', 'export'))}_{sign}"
     render_export_row(df_matching, df_display, fname)
-    render_scenario_rows(df_display, df, th_class)
+    render_scenario_rows(df_display, th_class, key="l3")
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # MODE A — SINGLE-ASSET DRILL-DOWN
 # ══════════════════════════════════════════════════════════════════════════════
-if st.session_state.mode == 'drill':
+if _search_q:
+    with trace('search'):
+        _s_index         = cached_call(search_index, ds.version, df_all, desc_map, type_map)
+        _s_hits, _       = core.search_scenarios(_s_index, _search_q, _type_sel)
+        trace_rows(len(_s_hits))
+
+    col_hdr, col_clear = st.columns([8, 1.2])
+    with col_hdr:
+        st.markdown(
+            f'<div class="section-header">Search — {len(_s_hits)} scenario{"s" if len(_s_hits) != 1 else ""} '
+            f'for “{html.escape(_search_q)}”</div>', unsafe_allow_html=True)
+    with col_clear:
+        st.button("✕ Clear", key="search_clear", on_click=clear_search)
+
+    if not len(_s_hits):
+        st.info("No scenario matches all the search terms.")
+    else:
+        df_hits = scenario_rows(df_all, _s_hits, sc_index)
+        render_export_row(df_hits, df_hits, "search_results")
+        render_scenario_rows(df_hits, th_class="", path_mode=True, key="search", order=list(_s_hits))
+
+elif st.session_state.mode == 'drill':
     qv = st.session_state.quick_view
 
     parts = ['<span>All</span>']
@@ -972,7 +1335,7 @@ if st.session_state.mode == 'drill':
     st.markdown(f'<div class="breadcrumb">{"".join(parts)}</div>', unsafe_allow_html=True)
 
     st.markdown('<div class="section-header">Level 1 Mapping — Asset Class</div>', unsafe_allow_html=True)
-    render_cards(clean_items(df['L1']), df, 'L1', 'sel_l1_single', multi=False, show_mini=True)
+    render_cards(clean_items(df['L1']), (), 'L1', 'sel_l1_single', multi=False, show_mini=True)
 
     if qv and qv['col'] == 'L1':
         render_quick_view(df, 'L1')
@@ -991,10 +1354,11 @@ if st.session_state.mode == 'drill':
         if l2_items:
             st.markdown(f'<div class="section-header">Level 2 — {st.session_state.sel_l1_single}</div>',
                         unsafe_allow_html=True)
-            render_cards(l2_items, df_l1, 'L2', 'sel_l2', multi=False, show_mini=True)
+            render_cards(l2_items, (st.session_state.sel_l1_single,), 'L2', 'sel_l2',
+                         multi=False, show_mini=True)
 
             if qv and qv['col'] == 'L2':
-                render_quick_view(df_l1, 'L2')
+                render_quick_view(df_l1, 'L2', (st.session_state.sel_l1_single,))
 
             elif st.session_state.sel_l2:
                 df_l2    = df[(df['L1'] == st.session_state.sel_l1_single) &
@@ -1011,7 +1375,8 @@ if st.session_state.mode == 'drill':
                 if l3_items:
                     st.markdown(f'<div class="section-header">Level 3 — {st.session_state.sel_l2}</div>',
                                 unsafe_allow_html=True)
-                    render_cards(l3_items, df_l2, 'L3', 'sel_l3', multi=False, show_mini=False)
+                    render_cards(l3_items, (st.session_state.sel_l1_single, st.session_state.sel_l2),
+                                 'L3', 'sel_l3', multi=False, show_mini=False)
 
                 if st.session_state.sel_l3:
                     df_l3 = df[(df['L1'] == st.session_state.sel_l1_single) &
@@ -1024,7 +1389,9 @@ if st.session_state.mode == 'drill':
                             st.rerun()
                     st.markdown(f'<div class="section-header">Scenarios — {st.session_state.sel_l3}</div>',
                                 unsafe_allow_html=True)
-                    render_scenario_table(df_l3)
+                    render_scenario_table(df_l3, (st.session_state.sel_l1_single,
+                                                  st.session_state.sel_l2,
+                                                  st.session_state.sel_l3))
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -1036,14 +1403,15 @@ elif st.session_state.mode == 'multi':
     st.markdown(
         '<div class="hint-box">'
         '💡 Select one or more Level-1 areas. With a single area you see all its scenarios. '
-        'With multiple areas you see scenarios <strong>common to all</strong>.<br>'
+        'With multiple areas you see scenarios <strong>common to all</strong>, or switch to '
+        '<strong>any of / at least k of n / all except</strong>.<br>'
         '🎯 Use <strong>▲ Positive / ▼ Negative</strong> buttons on each card to cross-filter by direction.'
         '</div>',
         unsafe_allow_html=True
     )
 
     st.markdown('<div class="section-header">Select Asset Class (multi-select)</div>', unsafe_allow_html=True)
-    render_cards(clean_items(df['L1']), df, 'L1', 'sel_l1_set', multi=True, show_mini=True)
+    render_cards(clean_items(df['L1']), (), 'L1', 'sel_l1_set', multi=True, show_mini=True)
 
     if qv and qv['col'] == 'L1':
         render_quick_view(df, 'L1')
@@ -1061,36 +1429,67 @@ elif st.session_state.mode == 'multi':
                 st.rerun()
 
         selected_list = sorted(st.session_state.sel_l1_set)
-
-        if len(selected_list) == 1:
-            df_show = df[df['L1'].isin(selected_list)].copy()
-            label   = f"Scenarios in: {selected_list[0]}"
+        n_sel         = len(selected_list)
+        match_mode, k_min, excluded, constraints = 'all', n_sel, [], {}
+
+        if n_sel > 1:
+            if st.session_state.multi_dir_filter is None:
+                for l1 in l1_matrix['l1']:
+                    st.session_state.pop(f"mdir_{l1}", None)
+            if 'multi_k' in st.session_state:
+                st.session_state.multi_k = min(max(st.session_state.multi_k, 1), n_sel)
+            if 'multi_except' in st.session_state:
+                st.session_state.multi_except = [x for x in st.session_state.multi_except
+                                                 if x in selected_list]
+
+            c_mode, c_arg, _ = st.columns([4.5, 3, 3])
+            with c_mode:
+                match_mode = st.radio("Match", list(MATCH_MODES), format_func=MATCH_MODES.get,
+                                      horizontal=True, key="multi_match")
+            with c_arg:
+                if match_mode == 'atleast':
+                    k_min = st.slider("k", 1, n_sel, value=min(2, n_sel), key="multi_k")
+                elif match_mode == 'except':
+                    excluded = st.multiselect("Except (must not match)", selected_list,
+                                              key="multi_except")
+            with st.expander("Direction constraint per asset class"):
+                dir_cols = st.columns(min(n_sel, 4))
+                for i, l1 in enumerate(selected_list):
+                    with dir_cols[i % len(dir_cols)]:
+                        constraints[l1] = st.selectbox(
+                            l1, ['any', 'pos', 'neg', 'zero'], key=f"mdir_{l1}",
+                            format_func={'any': 'Any direction', 'pos': '▲ Positive',
+                                         'neg': '▼ Negative', 'zero': '~ Mixed'}.get)
+            st.session_state.multi_dir_filter = constraints
+
+        included = [l1 for l1 in selected_list if l1 not in excluded]
+        mask     = (match_asset_classes(selected_list, match_mode, k_min, excluded, constraints)
+                    if included else np.zeros(len(l1_matrix['scenarios']), dtype=bool))
+        matched  = l1_matrix['scenarios'][mask]
+        df_show  = scenario_rows(df_all, matched, sc_index)
+        df_show  = df_show[df_show['L1'].isin(included)]
+
+        if n_sel == 1:
+            label = f"Scenarios in: {selected_list[0]}"
+        elif match_mode == 'any':
+            label = f"Scenarios in any of: {' · '.join(selected_list)}"
+        elif match_mode == 'atleast':
+            label = f"Scenarios in at least {k_min} of {n_sel}: {' · '.join(selected_list)}"
+        elif match_mode == 'except' and excluded:
+            label = f"Scenarios in {' · '.join(included)} but not {' · '.join(excluded)}"
         else:
-            sets_per_l1 = [set(df[df['L1'] == l1]['Scenario'].unique()) for l1 in selected_list]
-            common      = sets_per_l1[0].intersection(*sets_per_l1[1:])
-            df_show     = df[df['L1'].isin(selected_list) & df['Scenario'].isin(common)].copy()
-            label       = f"Common scenarios: {' · '.join(selected_list)}"
+            label = f"Common scenarios: {' · '.join(selected_list)}"
 
         if df_show.empty:
-            st.info("No scenarios shared across all selected areas.")
+            st.info("No scenarios shared across all selected areas." if match_mode == 'all'
+                    else "No scenarios match this asset class combination.")
         else:
             st.markdown(f'<div class="section-header">{label}</div>', unsafe_allow_html=True)
-            all_scenarios = sorted(df_show['Scenario'].unique())
-
-            dir_matrix = {}
-            for l1 in selected_list:
-                sub_l1 = df_show[df_show['L1'] == l1]
-                for sc, sc_df in sub_l1.groupby('Scenario'):
-                    dir_matrix.setdefault(sc, {})[l1] = scenario_direction(group_direction_score(sc_df))
-
-            def filter_by_direction(direction):
-                return [sc for sc in all_scenarios
-                        if all(dir_matrix.get(sc, {}).get(l1) == direction for l1 in selected_list)]
-
-            pos_scenarios  = filter_by_direction('pos')
-            neg_scenarios  = filter_by_direction('neg')
-            zero_scenarios = [sc for sc in all_scenarios
-                              if sc not in pos_scenarios and sc not in neg_scenarios]
+            all_scenarios  = matched.tolist()
+            dir_codes      = common_direction(mask, included)
+            pos_scenarios  = matched[dir_codes == 1].tolist()
+            neg_scenarios  = matched[dir_codes == -1].tolist()
+            zero_scenarios = matched[dir_codes == 0].tolist()
             has_zero       = len(zero_scenarios) > 0
             cur_mf         = st.session_state.shock_filter
 
@@ -1115,8 +1514,8 @@ elif st.session_state.mode == 'multi':
             </style>
             """
             tips = {
-                'pos': "Scenarios positive in <b>all selected asset classes</b>.",
-                'neg': "Scenarios negative in <b>all selected asset classes</b>.",
+                'pos': "Scenarios positive in <b>all selected asset classes</b> where they have shocks.",
+                'neg': "Scenarios negative in <b>all selected asset classes</b> where they have shocks.",
                 'zer': "No clear single direction across all selected areas.",
             }
             def tip_icon(key):
@@ -1132,7 +1531,7 @@ elif st.session_state.mode == 'multi':
             with cfa:
                 st.markdown(f"""<div class="stat-box">
                     <div class="sv">{len(all_scenarios)}</div>
-                    <div class="sk">Total common</div>
+                    <div class="sk">{"Total common" if match_mode == 'all' else "Total matching"}</div>
                 </div>""", unsafe_allow_html=True)
             with cfb:
                 active_pos = cur_mf == 'pos'
@@ -1178,13 +1577,13 @@ elif st.session_state.mode == 'multi':
             if not active_scenarios:
                 st.info("No scenarios match this direction filter across all selected areas.")
             else:
-                df_active = df_show[df_show['Scenario'].isin(active_scenarios)]
+                df_active = scenario_rows(df_show, active_scenarios)
                 if sign_filter == 'pos':   df_display = df_active[df_active['Value'].notna() & (df_active['Value'] > 0)]
                 elif sign_filter == 'neg': df_display = df_active[df_active['Value'].notna() & (df_active['Value'] < 0)]
                 else:                      df_display = df_active
                 fname = f"multi_{'_'.join(selected_list)}_{sign_filter}"
                 render_export_row(df_active, df_display, fname)
-                render_scenario_rows(df_display, df, th_class, path_mode=True)
+                render_scenario_rows(df_display, th_class, path_mode=True, key="multi")
     else:
         st.markdown(
             '<div style="font-size:0.78rem;color:#6b7280;margin-top:1rem;">'
@@ -1201,132 +1600,66 @@ elif st.session_state.mode == 'multi':
 elif st.session_state.mode == 'map':
     import plotly.graph_objects as go
 
-    if not GEO_AVAILABLE or geo_df.empty:
+    with trace('geo_data'):
+        geo_df, geo_unmapped, geo_index = geo_data()
+    if geo_df.empty:
         st.warning("Geographic data not available.")
     else:
-        _type_sel_geo = st.session_state.scenario_type
-        geo_filtered = geo_df.copy()
-        if _type_sel_geo in ('BRS', 'EC'):
-            valid_scenarios = df['Scenario'].unique()
-            geo_filtered = geo_filtered[geo_filtered['Scenario'].isin(valid_scenarios)]
-
-        # Normalizza: vecchio formato stringa -> reset a None
-        if not isinstance(st.session_state.geo_area, (dict, type(None))):
-            st.session_state.geo_area = None
-        sel = st.session_state.geo_area  # None | {'type':'area'|'country', 'value':str}
-
-        # ── Aggrega per paese specifico (level=='country') ────────────────────
-        country_df = geo_filtered[geo_filtered['level'] == 'country'].copy()
-        country_agg = (
-            country_df.groupby(['ISO3', 'Area'])['Scenario']
-            .nunique().reset_index()
-            .rename(columns={'Scenario': 'n_sc'})
-        )
-
-        max_n = max(country_agg['n_sc'].max() if not country_agg.empty else 1, 1)
-
-        # ── Hover text per paese specifico ────────────────────────────────────
-        hover_texts = []
-        for _, row in country_agg.iterrows():
-            scs = sorted(country_df[country_df['ISO3'] == row['ISO3']]['Scenario'].unique())
-            sc_list = '<br>'.join(f'  · {s}' for s in scs[:8])
-            if len(scs) > 8:
-                sc_list += f'<br>  ... +{len(scs)-8} more'
-            hover_texts.append(
-                f"<b>{row['ISO3']} ({row['Area']})</b>"
-                f"<br>Specific scenarios: <b>{row['n_sc']}</b>"
-                f"<br><br>{sc_list}"
-            )
-
-        # ── Figura: solo paesi specifici colorati, resto grigio ───────────────
-        fig = go.Figure()
-
-        # Layer 1: paesi specifici (rosso, intensità = n scenari)
-        if not country_agg.empty:
-            fig.add_trace(go.Choropleth(
-                locations=country_agg['ISO3'],
-                z=country_agg['n_sc'],
-                customdata=list(zip(
-                    country_agg['ISO3'],
-                    country_agg['Area'],
-                    hover_texts,
-                )),
-                hovertemplate='%{customdata[2]}<extra></extra>',
-                colorscale=[
-                    [0.0, '#fee2e2'], [0.33, '#f87171'],
-                    [0.66, '#dc2626'], [1.0,  '#7f1d1d'],
-                ],
-                zmin=0, zmax=max_n,
-                marker_line_color='#e5e7eb', marker_line_width=0.6,
-                showscale=True,
-                colorbar=dict(
-                    title=dict(text='Country\nscenarios', font=dict(size=10, color='#6b7280')),
-                    tickfont=dict(size=9, color='#6b7280'),
-                    len=0.45, thickness=11, x=1.01,
-                    bgcolor='rgba(255,255,255,0.9)',
-                    bordercolor='#e6e6e6', borderwidth=1,
-                ),
-            ))
-
-        # Layer 2: highlight selezione corrente
-        if sel:
-            if sel['type'] == 'country':
-                hi_rows = country_agg[country_agg['ISO3'] == sel['value']]
+        with trace('map'):
+            _type_sel_geo = st.session_state.scenario_type
+            view          = cached_call(geo_view, _type_sel_geo, ds.version)
+            country_agg   = view['country_agg']
+            trace_rows(len(country_agg))
+
+            # Normalizza: vecchio formato stringa -> reset a None
+            if not isinstance(st.session_state.geo_area, (dict, type(None))):
+                st.session_state.geo_area = None
+            sel = st.session_state.geo_area  # None | {'type':'area'|'country', 'value':str}
+
+            # ── Figura di base in cache; sulla selezione si aggiunge solo l'highlight ──
+            fig = go.Figure(cached_call(geo_base_figure, _type_sel_geo, ds.version))
+
+            # Layer 2: highlight selezione corrente
+            if sel:
+                if sel['type'] == 'country':
+                    hi_rows = country_agg[country_agg['ISO3'] == sel['value']]
+                else:  # area selezionata: evidenzia tutti i paesi specifici dell'area
+                    hi_rows = country_agg[country_agg['Area'] == sel['value']]
                 if not hi_rows.empty:
                     fig.add_trace(go.Choropleth(
-                        locations=[sel['value']],
-                        z=[hi_rows['n_sc'].values[0]],
-                        colorscale=[[0, '#ff4b4b'], [1, '#ff4b4b']],
-                        showscale=False,
-                        marker_line_color='#ff4b4b', marker_line_width=3,
-                        hoverinfo='skip',
-                    ))
-            else:  # area selezionata: evidenzia tutti i paesi specifici dell'area
-                area_iso3 = country_agg[country_agg['Area'] == sel['value']]['ISO3'].tolist()
-                area_z    = country_agg[country_agg['Area'] == sel['value']]['n_sc'].tolist()
-                if area_iso3:
-                    fig.add_trace(go.Choropleth(
-                        locations=area_iso3, z=area_z,
+                        locations=hi_rows['ISO3'].tolist(), z=hi_rows['n_sc'].tolist(),
                         colorscale=[[0, '#ff4b4b'], [1, '#ff4b4b']],
                         showscale=False,
                         marker_line_color='#ff4b4b', marker_line_width=3,
                         hoverinfo='skip',
                     ))
 
-        fig.update_layout(
-            geo=dict(
-                showframe=False, showcoastlines=True,
-                coastlinecolor='#d1d5db', showland=True, landcolor='#f3f4f6',
-                showocean=True, oceancolor='#eff6ff', showlakes=False,
-                showcountries=True, countrycolor='#e5e7eb',
-                projection_type='natural earth', bgcolor='#ffffff',
-            ),
-            paper_bgcolor='#ffffff', plot_bgcolor='#ffffff',
-            margin=dict(l=0, r=0, t=8, b=0), height=480,
-        )
+            # ── Info strip ────────────────────────────────────────────────────
+            n_countries  = country_agg['ISO3'].nunique()
+            n_areas      = len(view['area_scenarios'])
+            n_sc_geo     = view['n_sc']
+            st.markdown(
+                f'<div style="display:flex;align-items:center;gap:16px;background:#f8f9fb;' 
+                f'border:1px solid #e6e6e6;border-radius:8px;padding:8px 16px;margin-bottom:0.8rem;">' 
+                f'<span style="font-size:0.65rem;color:#9ca3af;text-transform:uppercase;letter-spacing:0.08em;">Coverage</span>' 
+                f'<span style="font-size:0.82rem;font-weight:700;color:#0e1117;">{n_countries} countries</span>' 
+                f'<span style="color:#e6e6e6;">|</span>' 
+                f'<span style="font-size:0.82rem;color:#6b7280;">{n_areas} areas · {n_sc_geo} scenarios</span>' 
+                f'<span style="color:#e6e6e6;">|</span>' 
+                f'<span style="font-size:0.72rem;color:#9ca3af;font-style:italic;">Click paese → scenari specifici + area &nbsp;·&nbsp; Click card area → tutti gli scenari area</span>' 
+                f'</div>',
+                unsafe_allow_html=True
+            )
 
-        # ── Info strip ────────────────────────────────────────────────────────
-        n_countries  = country_agg['ISO3'].nunique()
-        n_areas      = geo_filtered['Area'].nunique()
-        n_sc_geo     = geo_filtered['Scenario'].nunique()
-        st.markdown(
-            f'<div style="display:flex;align-items:center;gap:16px;background:#f8f9fb;' 
-            f'border:1px solid #e6e6e6;border-radius:8px;padding:8px 16px;margin-bottom:0.8rem;">' 
-            f'<span style="font-size:0.65rem;color:#9ca3af;text-transform:uppercase;letter-spacing:0.08em;">Coverage</span>' 
-            f'<span style="font-size:0.82rem;font-weight:700;color:#0e1117;">{n_countries} countries</span>' 
-            f'<span style="color:#e6e6e6;">|</span>' 
-            f'<span style="font-size:0.82rem;color:#6b7280;">{n_areas} areas · {n_sc_geo} scenarios</span>' 
-            f'<span style="color:#e6e6e6;">|</span>' 
-            f'<span style="font-size:0.72rem;color:#9ca3af;font-style:italic;">Click paese → scenari specifici + area &nbsp;·&nbsp; Click card area → tutti gli scenari area</span>' 
-            f'</div>',
-            unsafe_allow_html=True
-        )
+            if not geo_unmapped.empty:
+                with st.expander(f"Factors without a country mapping ({len(geo_unmapped)}) — shown at area level only"):
+                    st.dataframe(geo_unmapped, hide_index=True, use_container_width=True)
 
-        # ── Mappa ─────────────────────────────────────────────────────────────
-        event = st.plotly_chart(
-            fig, use_container_width=True,
-            on_select='rerun', key='geo_map', selection_mode='points',
-        )
+            # ── Mappa ─────────────────────────────────────────────────────────
+            event = st.plotly_chart(
+                fig, use_container_width=True,
+                on_select='rerun', key='geo_map', selection_mode='points',
+            )
 
         if event and hasattr(event, 'selection') and event.selection:
             pts = event.selection.get('points', [])
@@ -1337,20 +1670,14 @@ elif st.session_state.mode == 'map':
                     if clicked_iso in country_agg['ISO3'].values:
                         new_sel = {'type': 'country', 'value': clicked_iso}
                     else:
-                        area = _ISO3_TO_AREA.get(clicked_iso)
+                        area = ISO3_TO_AREA.get(clicked_iso)
                         new_sel = {'type': 'area', 'value': area} if area else None
                     if new_sel and new_sel != st.session_state.geo_area:
                         st.session_state.geo_area = new_sel
                         st.rerun()
 
         # ── Cards area (sempre visibili sotto la mappa) ───────────────────────
-        area_counts = (
-            geo_filtered.groupby('Area')['Scenario']
-            .nunique().reset_index()
-            .rename(columns={'Scenario': 'n_sc'})
-            .sort_values('n_sc', ascending=False)
-            .reset_index(drop=True)
-        )
+        area_counts = view['area_counts']
         st.markdown('<div class="section-header">Geographic areas</div>', unsafe_allow_html=True)
         ncards = min(len(area_counts), 6)
         card_cols = st.columns(ncards)
@@ -1381,56 +1708,221 @@ elif st.session_state.mode == 'map':
                 area_name = area_name[0] if len(area_name) else iso3
 
                 # ── A) Scenari con fattori specifici di questo paese ──────────
-                sc_specific = sorted(
-                    country_df[country_df['ISO3'] == iso3]['Scenario'].unique()
-                )
+                sc_specific = view['country_scenarios'].get(iso3, [])
                 with col_hdr:
                     st.markdown(
                         f'<div class="section-header">🏳 {iso3} ({area_name}) — ' 
                         f'{len(sc_specific)} specific scenario{"s" if len(sc_specific)!=1 else ""}</div>',
                         unsafe_allow_html=True
                     )
-                df_specific = df[df['Scenario'].isin(sc_specific)].copy()
+                df_specific = scenario_rows(df_all, sc_specific, sc_index)
                 if not df_specific.empty:
                     render_export_row(df_specific, df_specific,
                                       f"geo_country_{iso3}_specific")
-                    render_scenario_rows(df_specific, df, th_class="", path_mode=True)
+                    render_scenario_rows(df_specific, th_class="", path_mode=True,
+                                         key="geo_specific")
                 else:
                     st.info("No shock detail for specific country scenarios.")
 
                 # ── B) Tutti gli scenari dell'area ────────────────────────────
-                sc_area = sorted(
-                    geo_filtered[geo_filtered['Area'] == area_name]['Scenario'].unique()
-                )
-                sc_area_only = [s for s in sc_area if s not in sc_specific]
+                sc_area = view['area_scenarios'].get(area_name, [])
 
                 st.markdown(
                     f'<div class="section-header" style="margin-top:2rem;">🌍 All {area_name} scenarios ' 
                     f'({len(sc_area)} total)</div>',
                     unsafe_allow_html=True
                 )
-                df_area = df[df['Scenario'].isin(sc_area)].copy()
+                df_area = scenario_rows(df_all, sc_area, sc_index)
                 if not df_area.empty:
                     render_export_row(df_area, df_area, f"geo_area_{area_name}")
-                    render_scenario_rows(df_area, df, th_class="", path_mode=True)
+                    render_scenario_rows(df_area, th_class="", path_mode=True,
+                                         key="geo_country_area")
 
             else:  # type == 'area'
                 area_name = sel['value']
-                sc_area   = sorted(
-                    geo_filtered[geo_filtered['Area'] == area_name]['Scenario'].unique()
-                )
+                sc_area   = view['area_scenarios'].get(area_name, [])
                 with col_hdr:
                     st.markdown(
                         f'<div class="section-header">🌍 {area_name} — ' 
                         f'{len(sc_area)} scenario{"s" if len(sc_area)!=1 else ""}</div>',
                         unsafe_allow_html=True
                     )
-                df_area = df[df['Scenario'].isin(sc_area)].copy()
+                df_area = scenario_rows(df_all, sc_area, sc_index)
                 if df_area.empty:
                     st.info("No shock detail available.")
                 else:
                     render_export_row(df_area, df_area, f"geo_{area_name.replace(' ','_')}")
-                    render_scenario_rows(df_area, df, th_class="", path_mode=True)
+                    render_scenario_rows(df_area, th_class="", path_mode=True,
+                                         key="geo_area")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODE D — COMPARE VERSIONS
+# ══════════════════════════════════════════════════════════════════════════════
+elif st.session_state.mode == 'compare':
+    CMP_MAX_ROWS = 10_000   # righe mostrate in tabella; l'export le contiene tutte
+
+    st.markdown('<div class="section-header">Compare workbook versions</div>', unsafe_allow_html=True)
+    c_old, c_new = st.columns(2)
+    with c_old:
+        up_old = st.file_uploader("Previous version (.xlsx)", type=['xlsx'], key='cmp_old')
+    with c_new:
+        up_new = st.file_uploader("New version (.xlsx) — leave empty to use the current workbook",
+                                  type=['xlsx'], key='cmp_new')
+
+    if up_old is None:
+        st.info("Upload a previous version of the shocks workbook to compare it with the current one.")
+    else:
+        with trace('compare'):
+            try:
+                old_ds = cached_call(uploaded_dataset, up_old.getvalue())
+                new_ds = cached_call(uploaded_dataset, up_new.getvalue()) if up_new is not None else ds
+            except (KeyError, ValueError) as exc:
+                st.error(f"Could not read the workbook (a \"Shocks\" sheet with the usual columns is required): {exc}")
+                st.stop()
+            cmp = cached_call(version_comparison, old_ds.version, new_ds.version, direction_method(),
+                              old_ds, new_ds)
+            trace_rows(len(cmp.shocks))
+
+        def by_type(frame):
+            return frame if _type_sel == 'All' else frame[frame['Scenario Type'] == _type_sel]
+
+        sc_tab    = by_type(cmp.scenarios)
+        sh_tab    = by_type(cmp.shocks)
+        sc_counts = sc_tab['status'].value_counts()
+        sh_counts = sh_tab['status'].value_counts()
+
+        boxes = [(sc_counts.get('added', 0), "Scenarios added"), (sc_counts.get('removed', 0), "Scenarios removed"),
+                 (sh_counts.get('added', 0), "Shocks added"), (sh_counts.get('removed', 0), "Shocks removed"),
+                 (sh_counts.get('changed', 0), "Shocks changed"), (len(by_type(cmp.flips['L1'])), "L1 direction flips")]
+        for col, (value, label) in zip(st.columns(len(boxes)), boxes):
+            with col:
+                st.markdown(f'''<div class="stat-box">
+                    <div class="sv">{value}</div>
+                    <div class="sk">{label}</div>
+                </div>''', unsafe_allow_html=True)
+
+        _, col_dl = st.columns([8, 2])
+        with col_dl:
+            st.download_button(
+                label="⬇ Export comparison",
+                data=lazy_comparison_export(cmp, old_ds.version, new_ds.version, _type_sel),
+                file_name=f"comparison_{old_ds.version}_{new_ds.version}.xlsx",
+                mime=XLSX_MIME,
+                key="dl_compare",
+                use_container_width=True,
+            )
+
+        tab_flips, tab_shocks, tab_sc = st.tabs(["Direction flips", "Shock changes", "Scenarios"])
+        with tab_flips:
+            level = st.radio("Level", list(cmp.flips), horizontal=True, key='cmp_level')
+            flips = by_type(cmp.flips[level])
+            if flips.empty:
+                st.info(f"No scenario changed direction at {level} level.")
+            else:
+                st.dataframe(flips, hide_index=True, use_container_width=True,
+                             column_config={'score old': st.column_config.NumberColumn(format="%.1f"),
+                                            'score new': st.column_config.NumberColumn(format="%.1f")})
+        with tab_shocks:
+            statuses = st.multiselect("Status", ['changed', 'added', 'removed'],
+                                      default=['changed', 'added', 'removed'], key='cmp_status')
+            shocks = sh_tab[sh_tab['status'].isin(statuses)]
+            if shocks.empty:
+                st.info("No shock differences for the selected status.")
+            else:
+                if len(shocks) > CMP_MAX_ROWS:
+                    st.caption(f"Showing the first {CMP_MAX_ROWS:,} of {len(shocks):,} rows — the export contains all of them.")
+                st.dataframe(shocks.head(CMP_MAX_ROWS), hide_index=True, use_container_width=True)
+        with tab_sc:
+            changed = sc_tab[sc_tab['status'] != 'common']
+            if changed.empty:
+                st.info("Both versions contain the same scenarios.")
+            else:
+                st.dataframe(changed, hide_index=True, use_container_width=True)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# MODE E — PORTFOLIO P&L
+# ══════════════════════════════════════════════════════════════════════════════
+elif st.session_state.mode == 'pnl':
+    st.markdown('<div class="section-header">Portfolio P&L by scenario</div>', unsafe_allow_html=True)
+    up_exp = st.file_uploader(
+        "Portfolio sensitivities (.csv / .xlsx)", type=['csv', 'xlsx'], key='pnl_file',
+        help="Columns: Factor, Exposure (P&L per 1 unit of shock) and optional Unit — "
+             "bp (default, e.g. DV01) or pct (e.g. equity / FX delta per 1% move). "
+             "Rows of the same factor are summed.")
+
+    if up_exp is None:
+        st.info("Upload a file with your exposures per Factor to compute the P&L of every scenario. "
+                "Shocks are converted to bps with the same rules as the direction methodology.")
+    else:
+        try:
+            exposures = cached_call(uploaded_exposures, up_exp.getvalue(), up_exp.name)
+        except ValueError as exc:
+            st.error(f"Could not read the sensitivities file: {exc}")
+            st.stop()
+
+        with trace('pnl'):
+            matrix = cached_call(shock_matrix, ds.version, df_all)
+            result = core.portfolio_pnl(matrix, exposures)
+            table  = core.pnl_table(result, desc_map, type_map)
+            trace_rows(len(matrix['data']))
+        if _type_sel != 'All':
+            table = table[table['Scenario Type'] == _type_sel].reset_index(drop=True)
+
+        if table.empty:
+            st.info("No scenario with directional shocks for the current filter.")
+            st.stop()
+
+        worst, best = table.iloc[0], table.iloc[-1]
+        boxes = [(f"{len(table)}", "Scenarios"),
+                 (f"{worst['P&L']:,.0f}", f"Worst · {worst['Scenario']}"),
+                 (f"{best['P&L']:,.0f}", f"Best · {best['Scenario']}"),
+                 (f"{int((table['P&L'] < 0).sum())}", "Scenarios with a loss"),
+                 (f"{len(result.matched)} / {len(exposures)}", "Factors matched")]
+        for col, (value, label) in zip(st.columns(len(boxes)), boxes):
+            with col:
+                st.markdown(f'''<div class="stat-box">
+                    <div class="sv">{value}</div>
+                    <div class="sk">{label}</div>
+                </div>''', unsafe_allow_html=True)
+
+        if not result.unmatched.empty:
+            with st.expander(f"Factors without any shock ({len(result.unmatched)}) — not included in the P&L"):
+                st.dataframe(result.unmatched.rename('Exposure per bp').rename_axis('Factor').reset_index(),
+                             hide_index=True, use_container_width=True)
+
+        _, col_dl = st.columns([8, 2])
+        with col_dl:
+            st.download_button(
+                label="⬇ Export P&L",
+                data=lazy_pnl_export(result, table, int(pd.util.hash_pandas_object(exposures).sum())),
+                file_name="portfolio_pnl.xlsx",
+                mime=XLSX_MIME,
+                key="dl_pnl",
+                use_container_width=True,
+            )
+
+        money = st.column_config.NumberColumn(format="localized")
+        st.caption("Scenarios from the worst P&L, with the contribution of each asset class. "
+                   "Select a row for the L2 / L3 breakdown.")
+        event = st.dataframe(
+            table, hide_index=True, use_container_width=True, on_select='rerun',
+            selection_mode='single-row', key='pnl_grid',
+            column_config={c: money for c in table.columns if c not in ('Scenario', 'Scenario Type', 'Description')})
+
+        rows = event.selection.rows if event and event.selection else []
+        if rows:
+            sc = table.iloc[rows[0]]['Scenario']
+            st.markdown(f'<div class="section-header" style="margin-top:1.5rem;">{sc} — P&L breakdown</div>',
+                        unsafe_allow_html=True)
+            col_l2, col_l3 = st.columns(2)
+            for col, level in ((col_l2, 'L2'), (col_l3, 'L3')):
+                frame = result.breakdown[level]
+                part  = frame[frame['Scenario'] == sc].drop(columns='Scenario').sort_values('P&L', kind='stable')
+                with col:
+                    st.dataframe(part, hide_index=True, use_container_width=True,
+                                 column_config={'P&L': money})
 
 
 # ─── FOOTER ────────────────────────────────────────────────────────────────────
@@ -1441,3 +1933,32 @@ st.markdown(
     f'Stress Test Dashboard · Lista_scenari_shocks.xlsx · {_n_sc} scenarios · {_n_l1} asset classes{_type_label}</div>',
     unsafe_allow_html=True
 )
+
+# ─── TRACE PANEL ───────────────────────────────────────────────────────────────
+if TRACE_ON:
+    _trace_ms = (time.perf_counter() - _trace_t0) * 1000
+    _paint_ms = next((sp.ms for sp in _trace_spans if sp.name == 'first_paint'), None)
+    if TRACE_LOG:
+        _trace_write({'ts': round(time.time(), 3), 'run': TRACE_RUN, 'span': 'rerun', 'depth': -1,
+                      'ms': round(_trace_ms, 3), 'mode': st.session_state.mode,
+                      'type': _type_sel, 'spans': len(_trace_spans), 'cold': _trace_cold,
+                      'first_paint_ms': None if _paint_ms is None else round(_paint_ms, 3),
+                      'budget_ms': STARTUP_BUDGET_MS if _trace_cold else None})
+    with st.sidebar:
+        st.markdown(f"**⏱ Trace** · run `{TRACE_RUN}` · {_trace_ms:.0f} ms")
+        if _trace_cold:
+            _startup = (f"Cold start · first paint {_paint_ms or 0:.0f} ms · "
+                        f"landing view {_trace_ms:.0f} ms / budget {STARTUP_BUDGET_MS:.0f} ms")
+            (st.warning if _trace_ms > STARTUP_BUDGET_MS else st.caption)(_startup)
+        st.dataframe(
+            pd.DataFrame({
+                'Section': ['  ' * sp.depth + sp.name for sp in _trace_spans],
+                'ms':      [round(sp.ms, 1) for sp in _trace_spans],
+                'Rows':    [int(sp.rows) for sp in _trace_spans],
+                'Hits':    [sp.hits for sp in _trace_spans],
+                'Misses':  [sp.misses for sp in _trace_spans],
+            }),
+            hide_index=True, use_container_width=True,
+        )
+        if TRACE_LOG:
+            st.caption(f"Appending to `{TRACE_LOG}`")
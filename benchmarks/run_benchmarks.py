@@ -0,0 +1,232 @@
+"""Benchmark dei percorsi caldi di app.py su workbook sintetici di dimensione crescente.
+
+Per ogni dimensione genera (o riusa) un Lista_scenari_shocks.xlsx sintetico in una
+cartella di lavoro dedicata e, in un sottoprocesso isolato con quella cartella come cwd:
+
+  * importa stress_core e app.py (bare mode) e cronometra il caricamento del dataset
+    (cold: parse xlsx, snapshot: da Parquet), le righe geo (costruite al primo uso della
+    mappa), il reload con l'1% degli scenari modificati (incrementale e ricostruzione
+    integrale con prepare_dataset), count_directions, get_scenario_directions e
+    build_export_bytes (tutti gli scenari), gli export csv/parquet e lo ZIP per scenario
+    (100 scenari, xlsx);
+  * esegue con AppTest un rerun a pagina intera per ogni modalità (drill fino a L3,
+    multi-asset con 3 classi, mappa con un'area selezionata), primo run e rerun a caldo;
+  * apre sessioni nuove sulla vista iniziale a server caldo: tempo totale e primo paint
+    (span first_paint del log di tracing), da confrontare con STRESS_STARTUP_BUDGET_MS.
+
+I risultati sono scritti in JSON (una voce per dimensione × metrica, con tutti i
+campioni e la mediana) per confrontare le release:
+
+    python benchmarks/run_benchmarks.py --rows 10000 100000 1000000 --out bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+HERE     = os.path.dirname(os.path.abspath(__file__))
+REPO     = os.path.dirname(HERE)
+APP_PATH = os.path.join(REPO, 'app.py')
+DATA_DIR = os.path.join(HERE, '.data')
+WORKBOOK = 'Lista_scenari_shocks.xlsx'
+
+
+def _timed(fn, repeat):
+    """Esegue fn `repeat` volte; restituisce (campioni in secondi, ultimo risultato)."""
+    samples, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append(time.perf_counter() - t0)
+    return samples, out
+
+
+# ─── WORKER (sottoprocesso, cwd = cartella col workbook sintetico) ─────────────
+
+def bench_functions(repeat):
+    import logging
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    sys.path.insert(0, REPO)
+
+    t0 = time.perf_counter()
+    import stress_core as core
+    results = {'import_core': [time.perf_counter() - t0]}
+
+    t0 = time.perf_counter()
+    import app
+    results['import_app'] = [time.perf_counter() - t0]
+
+    def load_cold():
+        for name in os.listdir(core.CACHE_DIR):
+            os.remove(os.path.join(core.CACHE_DIR, name))
+        return core.load_dataset()
+
+    raw = core.read_shocks()
+    results['load_data.cold'], _      = _timed(load_cold, repeat)
+    results['load_data.snapshot'], ds = _timed(core.load_dataset, repeat)
+    results['load_geo_data'], _       = _timed(lambda: core.GeoRows(raw).get(), repeat)
+
+    # Hot reload: 1% degli scenari modificati, ricalcolo incrementale contro ricostruzione integrale
+    changed  = list(ds.index)[::100]
+    modified = raw.copy()
+    rows     = modified['Scenario'].astype(str).str.strip().isin(changed)
+    modified.loc[rows, 'Value'] = modified.loc[rows, 'Value'] + 1
+    results['reload.incremental_1pct'], _ = _timed(lambda: core.update_dataset(ds, modified), repeat)
+    results['reload.full_rebuild'], _     = _timed(lambda: core.prepare_dataset(modified), repeat)
+
+    df = ds.df
+    results['count_directions'], _        = _timed(lambda: core.count_directions(df), repeat)
+    results['get_scenario_directions'], _ = _timed(lambda: core.get_scenario_directions(df), repeat)
+    results['build_export_bytes'], data   = _timed(
+        lambda: core.build_export_bytes(df, True, ds.desc_map, ds.type_map), repeat)
+    for fmt in ('csv', 'parquet'):
+        results[f'export_file_bytes.{fmt}'], _ = _timed(
+            lambda: core.export_file_bytes(df, fmt, ds.desc_map, ds.type_map, True), repeat)
+    bulk = list(ds.index)[:100]
+    results['build_scenario_zip.xlsx_100'], _ = _timed(
+        lambda: core.build_scenario_zip(df, bulk, 'xlsx', ds.desc_map, ds.type_map), repeat)
+
+    meta = {'loaded_rows': int(len(df)), 'scenarios': int(df['Scenario'].nunique()),
+            'export_bytes': len(data)}
+    return meta, results
+
+
+def bench_pages(repeat):
+    from streamlit.testing.v1 import AppTest
+    import pandas as pd
+
+    shocks = pd.read_excel(WORKBOOK, sheet_name='Shocks', nrows=50_000)
+    path   = shocks[['Livello 1', 'Livello 2', 'Livello 3']].dropna().iloc[0].tolist()
+    l1s    = shocks['Livello 1'].dropna().value_counts().index[:3].tolist()
+    areas  = shocks['Country'].dropna().value_counts().index.tolist()
+
+    modes = {
+        'drill': {'mode': 'drill', 'sel_l1_single': path[0], 'sel_l2': path[1], 'sel_l3': path[2]},
+        'multi': {'mode': 'multi', 'sel_l1_set': set(l1s)},
+        'map':   {'mode': 'map', 'geo_area': {'type': 'area', 'value': areas[0]} if areas else None},
+    }
+
+    results = {}
+    for name, state in modes.items():
+        at = AppTest.from_file(APP_PATH, default_timeout=3600)
+        for k, v in state.items():
+            at.session_state[k] = v
+        samples = []
+        for _ in range(repeat + 1):
+            t0 = time.perf_counter()
+            at.run()
+            samples.append(time.perf_counter() - t0)
+            if at.exception:
+                raise RuntimeError(f"{name}: {at.exception[0].message}")
+        results[f'page.{name}.first'] = samples[:1]
+        results[f'page.{name}.rerun'] = samples[1:]
+
+    # Sessioni fredde sulla vista iniziale: il primo paint arriva dal log di tracing dell'app
+    log = os.path.abspath('landing_trace.jsonl')
+    os.environ['STRESS_TRACE_LOG'] = log
+    try:
+        total, paint = [], []
+        for _ in range(repeat):
+            if os.path.exists(log):
+                os.remove(log)
+            at = AppTest.from_file(APP_PATH, default_timeout=3600)
+            t0 = time.perf_counter()
+            at.run()
+            total.append(time.perf_counter() - t0)
+            if at.exception:
+                raise RuntimeError(f"landing: {at.exception[0].message}")
+            with open(log) as fh:
+                paint += [r['ms'] / 1000 for r in map(json.loads, fh) if r['span'] == 'first_paint']
+    finally:
+        os.environ.pop('STRESS_TRACE_LOG', None)
+    results['page.landing.cold_session'] = total
+    results['page.landing.first_paint']  = paint
+    return results
+
+
+def worker(args):
+    meta, results = bench_functions(args.repeat)
+    if not args.skip_pages:
+        results.update(bench_pages(args.repeat))
+    print(json.dumps({'meta': meta, 'results': results}))
+
+
+# ─── DRIVER ────────────────────────────────────────────────────────────────────
+
+def ensure_workbook(n_rows, seed):
+    """Cartella di lavoro per n_rows con il workbook sintetico (generato una volta sola)."""
+    from synthetic import write_workbook
+    workdir = os.path.join(DATA_DIR, f'rows_{n_rows}_seed_{seed}')
+    path    = os.path.join(workdir, WORKBOOK)
+    if not os.path.exists(path):
+        t0 = time.perf_counter()
+        write_workbook(path + '.tmp', n_rows, seed=seed)
+        os.replace(path + '.tmp', path)
+        print(f"  generated {n_rows:,} rows in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return workdir
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    import numpy, pandas, streamlit, openpyxl
+    return {'python': platform.python_version(), 'pandas': pandas.__version__,
+            'numpy': numpy.__version__, 'streamlit': streamlit.__version__,
+            'openpyxl': openpyxl.__version__}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--skip-pages', action='store_true', help="salta i rerun AppTest")
+    ap.add_argument('--out', default='bench_results.json')
+    ap.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    sys.path.insert(0, HERE)
+    report = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'commit': _git_commit(), 'versions': _versions(), 'repeat': args.repeat,
+              'results': []}
+
+    for n_rows in args.rows:
+        print(f"[{n_rows:,} rows]", file=sys.stderr)
+        workdir = ensure_workbook(n_rows, args.seed)
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker', '--repeat', str(args.repeat)]
+        if args.skip_pages:
+            cmd.append('--skip-pages')
+        proc = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr[-4000:])
+            raise SystemExit(f"benchmark worker failed for {n_rows} rows")
+        out = json.loads(proc.stdout.strip().splitlines()[-1])
+
+        for metric, samples in out['results'].items():
+            entry = {'rows': n_rows, **out['meta'], 'metric': metric,
+                     'samples': [round(s, 6) for s in samples],
+                     'median': round(statistics.median(samples), 6)}
+            report['results'].append(entry)
+            print(f"  {metric:<28} {entry['median']:>10.4f}s", file=sys.stderr)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Generatore di workbook sintetici con lo stesso schema di Lista_scenari_shocks.xlsx.
+
+Il foglio "Shocks" ha le stesse colonne del file reale (Scenario, Scenario Type,
+Description, Spread Shocks, Factor, Value, Unit, Extra, Livello 3/2/1, Country)
+e una gerarchia L1 › L2 › L3 › Factor plausibile, così che i percorsi caldi
+dell'app (cubo direzioni, multi-asset, mappa, export) lavorino su dati realistici.
+
+    python benchmarks/synthetic.py --rows 100000 --out /tmp/shocks_100k.xlsx
+"""
+import argparse
+import os
+
+import numpy as np
+from openpyxl import Workbook
+
+COLUMNS = ['Scenario', 'Scenario Type', 'Description', 'Spread Shocks', 'Factor', 'Value',
+           'Unit', 'Extra', 'Livello 3', 'Livello 2', 'Livello 1', 'Country']
+
+# L1 → L2 → [L3]; i fattori sono generati per L3, più quelli geografici reali sotto Equity
+HIERARCHY = {
+    'Equity': {
+        'Equity Derivatives':  ['Equity Implied Volatility', 'Equity Index'],
+        'Country Allocation':  ['Developed Markets', 'Emerging Markets'],
+        'Industry Allocation': ['Cyclicals', 'Defensives'],
+        'Style':               ['Value', 'Growth', 'Momentum'],
+    },
+    'Term Structure': {
+        'Curve (Local)': ['Govt USD', 'Govt EUR', 'Govt JPY', 'Govt GBP'],
+        'Inflation':     ['Breakeven USD', 'Breakeven EUR'],
+        'Money Market':  ['OIS', 'Deposit'],
+    },
+    'FX': {
+        'G10':      ['EUR/USD', 'JPY/USD', 'GBP/USD'],
+        'Emerging': ['Latam FX', 'Asia FX', 'CEEMEA FX'],
+    },
+    'Spread': {
+        'Credit IG':  ['US IG', 'EU IG'],
+        'Credit HY':  ['US HY', 'EU HY'],
+        'Securitized': ['ABS', 'CMBS'],
+    },
+    'Other': {
+        'Commodities': ['Energy', 'Metals', 'Agriculture'],
+        'Volatility':  ['Rates Vol', 'FX Vol'],
+    },
+}
+
+# Fattori reali con mappatura ISO3 nell'app → livello paese; gli altri restano a livello area
+GEO_FACTORS = [
+    ('S&P 500', 'US'), ('Nasdaq', 'US'), ('VIX', 'US'), ('S&P Mid Cap', 'US'),
+    ('DAX 30', 'Europe'), ('France CAC 40', 'Europe'), ('Italy S&P MIB', 'Europe'),
+    ('FTSE 100', 'Europe'), ('Spain IBEX 35', 'Europe'), ('Switzerland SMI', 'Europe'),
+    ('NIKKEI 225', 'Japan'), ('Hang Seng', 'Pacific ex Japan'), ('S&P ASX 200', 'Pacific ex Japan'),
+    ('Brazil Bovespa', 'Emerging Markets'), ('India BSE 100', 'Emerging Markets'),
+    ('China Offshore', 'Emerging Markets'), ('Mexico', 'Emerging Markets'), ('Canada', 'North America'),
+    ('MS Emerging Mkts', 'Emerging Markets'), ('MSCI EUROPE(EUR)', 'Europe'),
+]
+
+UNITS       = np.array(['bps', 'pct', 'rel %', 'Index Lvl', 'pct/yr'], dtype=object)
+UNIT_WEIGHT = np.array([0.60, 0.34, 0.03, 0.02, 0.01])
+
+
+def _factor_table():
+    """(Factor, L3, L2, L1, Country) per tutti i fattori sintetici."""
+    rows = []
+    for l1, l2s in HIERARCHY.items():
+        for l2, l3s in l2s.items():
+            for l3 in l3s:
+                for i in range(1, 7):
+                    rows.append((f"{l3} F{i}", l3, l2, l1, None))
+    for factor, country in GEO_FACTORS:
+        rows.append((factor, 'Equity Index', 'Equity Derivatives', 'Equity', country))
+    return rows
+
+
+def generate_rows(n_rows, n_scenarios=None, seed=0):
+    """Colonne del foglio Shocks come array numpy (n_rows righe, ordinate per scenario)."""
+    rng         = np.random.default_rng(seed)
+    n_scenarios = n_scenarios or max(50, n_rows // 40)
+    factors     = _factor_table()
+
+    # Numero di shock per scenario ~ Poisson, riscalato per avere esattamente n_rows righe
+    sizes = rng.poisson(n_rows / n_scenarios, n_scenarios).astype(float) + 1
+    sizes = np.floor(sizes * n_rows / sizes.sum()).astype(int)
+    sizes[: n_rows - sizes.sum()] += 1
+    sc_pos = np.repeat(np.arange(n_scenarios), sizes)
+
+    scenarios = np.array([f"SYN_{i:06d}" for i in range(n_scenarios)], dtype=object)
+    types     = np.where(rng.random(n_scenarios) < 0.55, 'BRS', 'EC').astype(object)
+    descs     = np.array([f"Synthetic stress scenario {i} generated for benchmarking."
+                          for i in range(n_scenarios)], dtype=object)
+
+    f_idx  = rng.integers(0, len(factors), n_rows)
+    f_tab  = np.array(factors, dtype=object)
+    bias   = rng.normal(0, 40, n_scenarios)[sc_pos]
+    values = np.round(bias + rng.normal(0, 60, n_rows), 1)
+    units  = UNITS[rng.choice(len(UNITS), n_rows, p=UNIT_WEIGHT)]
+    extra  = np.where(rng.random(n_rows) < 0.3,
+                      np.char.add('target block BRS_GOLD__', (f_idx % 9).astype(str)), None)
+
+    return {
+        'Scenario':      scenarios[sc_pos],
+        'Scenario Type': types[sc_pos],
+        'Description':   descs[sc_pos],
+        'Spread Shocks': np.full(n_rows, 'Absolute', dtype=object),
+        'Factor':        f_tab[f_idx, 0],
+        'Value':         values,
+        'Unit':          units,
+        'Extra':         extra.astype(object),
+        'Livello 3':     f_tab[f_idx, 1],
+        'Livello 2':     f_tab[f_idx, 2],
+        'Livello 1':     f_tab[f_idx, 3],
+        'Country':       f_tab[f_idx, 4],
+    }
+
+
+def write_workbook(path, n_rows, n_scenarios=None, seed=0):
+    """Scrive il workbook in modalità write-only (memoria costante anche a 1M righe)."""
+    cols = generate_rows(n_rows, n_scenarios, seed)
+    wb   = Workbook(write_only=True)
+    ws   = wb.create_sheet('Shocks')
+    ws.append(COLUMNS)
+    for row in zip(*(cols[c] for c in COLUMNS)):
+        ws.append([None if v is None else (float(v) if isinstance(v, np.floating) else v)
+                   for v in row])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    wb.save(path)
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--rows', type=int, default=10_000)
+    ap.add_argument('--scenarios', type=int, default=None)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--out', required=True)
+    args = ap.parse_args()
+    write_workbook(args.out, args.rows, args.scenarios, args.seed)
+    print(args.out)
+
+
+if __name__ == '__main__':
+    main()
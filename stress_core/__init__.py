@@ -0,0 +1,54 @@
+"""Logica analitica della dashboard Stress Test, senza Streamlit.
+
+Dataset, motore delle direzioni, query di drill-down, intersezione multi-asset,
+aggregati geografici, confronto tra versioni, P&L di portafoglio, similarità,
+ricerca ed export (xlsx, csv, parquet, ZIP per scenario) sono funzioni pure su
+DataFrame/array: app.py le avvolge con le cache di Streamlit, job batch e notebook
+le importano direttamente.
+
+    import stress_core as sc
+    ds = sc.load_dataset("Lista_scenari_shocks.xlsx")
+    sc.node_counts(ds.cube, ("Equity",), "BRS")
+
+openpyxl e plotly sono importati solo quando servono (export, choropleth).
+"""
+from .bulk import (
+    BULK_PARALLEL_ROWS, EXPORT_FORMATS, ZIP_MIME, build_scenario_zip, export_file_bytes, write_scenario_zip,
+)
+from .cache import LRUCache
+from .compare import (
+    SHOCK_KEYS, Comparison, compare_datasets, compare_scenarios, compare_shocks, comparison_sheets,
+    direction_flips,
+)
+from .dataset import (
+    CACHE_DIR, FILE_PATH, Dataset, GeoRows, clean_shocks, compact_frame, dataset_summary,
+    dataset_version, freeze_dataset, load_dataset, prepare_dataset, read_only, read_shocks,
+    read_shocks_bytes, scenario_fingerprints, scenario_maps,
+)
+from .directions import (
+    BPS_MULTIPLIER, CUBE_LEVELS, DEFAULT_METHOD, DIR_CODES, DIRECTION_METHODS, MATCH_MODES,
+    bps_values, build_asset_matrix, build_direction_cube, common_direction, count_directions,
+    direction_labels, get_scenario_directions, iter_nodes, match_asset_classes, method_scores,
+    node_children, node_counts, node_directions, scenario_direction, scenario_scores, tally, to_bps,
+)
+from .export import (
+    EXPORT_CHUNK_ROWS, EXPORT_COLUMNS, ExportCache, ExportJob, ExportJobs,
+    build_export_bytes, build_sheets_bytes, column_widths, export_frame, export_key, safe_name,
+)
+from .geo import (
+    FACTOR_TO_ISO3, GEO_COLUMNS, ISO3_TO_AREA, build_geo, choropleth_figure, geo_aggregates,
+    unmapped_factors,
+)
+from .index import scenario_bounds, scenario_rows
+from .pnl import (
+    EXPOSURE_UNITS, PortfolioPnL, build_shock_matrix, pnl_table, portfolio_pnl, read_exposures,
+)
+from .reload import DatasetStore, ScenarioDiff, diff_scenarios, update_dataset
+from .search import (
+    MATCH_WEIGHT, SEARCH_FIELDS, build_search_index, extra_tokens, parse_extra, search_scenarios,
+    tokenize,
+)
+from .similarity import (
+    SIMILAR_K, build_similarity_index, cluster_scenarios, nearest_neighbors, scenario_cluster,
+    scenario_vectors, similar_scenarios,
+)
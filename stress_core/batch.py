@@ -0,0 +1,115 @@
+"""Pacchetto notturno: direzioni ed export Excel per ogni nodo L1/L2/L3, per BRS ed EC.
+
+Per ogni tipo scenario e ogni nodo della gerarchia calcola le liste di scenari
+positivi / negativi / misti (come render_scenario_table) e scrive l'export di
+ciascuna lista non vuota. Gli export sono costruiti in un pool di processi; liste
+identiche (frequenti tra nodi padre e figlio) si costruiscono una volta sola.
+
+    python -m stress_core.batch --out nightly_pack [--types BRS EC] [--workers 8] [--method mean]
+
+Struttura dell'output:
+    <out>/manifest.json                        nodi, conteggi, liste e file
+    <out>/<TYPE>/<L1>[/<L2>[/<L3>]]/scenarios_<pos|neg|zero>.xlsx
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from .dataset import CACHE_DIR, FILE_PATH, load_dataset
+from .directions import DEFAULT_METHOD, DIRECTION_METHODS, iter_nodes, node_directions
+from .export import build_export_bytes, export_key, safe_name
+from .index import scenario_rows
+
+DIRECTIONS = ('pos', 'neg', 'zero')
+
+def node_reports(ds, types=('BRS', 'EC'), method=DEFAULT_METHOD):
+    """Una voce per (tipo, nodo) con le liste di scenari per direzione secondo `method`."""
+    reports = []
+    for type_filter in types:
+        for path in iter_nodes(ds.cube):
+            dirs = node_directions(ds.cube, path, type_filter, method)
+            if dirs.empty:
+                continue
+            lists = {d: sorted(dirs.index[dirs.to_numpy() == d].tolist()) for d in DIRECTIONS}
+            reports.append({'type': type_filter, 'path': list(path), 'level': f"L{len(path)}",
+                            'counts': {d: len(v) for d, v in lists.items()}, 'scenarios': lists})
+    return reports
+
+# ─── WORKER ────────────────────────────────────────────────────────────────────
+_worker_ds = None
+
+def _init_worker(path, cache_dir):
+    global _worker_ds
+    _worker_ds = load_dataset(path, cache_dir)
+
+def _write_export(job):
+    """Costruisce l'export di una lista di scenari e lo scrive in tutte le destinazioni."""
+    scenarios, targets = job
+    ds   = _worker_ds
+    data = build_export_bytes(scenario_rows(ds.df, scenarios, ds.index),
+                              desc_map=ds.desc_map, type_map=ds.type_map)
+    first = targets[0]
+    os.makedirs(os.path.dirname(first), exist_ok=True)
+    with open(first, 'wb') as fh:
+        fh.write(data)
+    for target in targets[1:]:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(first, target)
+    return len(targets)
+
+# ─── DRIVER ────────────────────────────────────────────────────────────────────
+
+def run(path=FILE_PATH, out='nightly_pack', types=('BRS', 'EC'), workers=None,
+        cache_dir=CACHE_DIR, method=DEFAULT_METHOD, log=sys.stderr):
+    t0 = time.perf_counter()
+    ds = load_dataset(path, cache_dir)   # crea anche lo snapshot Parquet letto dai worker
+    reports = node_reports(ds, types, method)
+
+    # Export raggruppati per contenuto: una build per lista distinta di scenari
+    jobs = {}
+    for rep in reports:
+        folder = os.path.join(out, safe_name(rep['type']), *map(safe_name, rep['path']))
+        rep['files'] = {}
+        for d, scenarios in rep['scenarios'].items():
+            if not scenarios:
+                continue
+            target = os.path.join(folder, f"scenarios_{d}.xlsx")
+            rep['files'][d] = os.path.relpath(target, out)
+            jobs.setdefault(export_key(scenarios, 'batch'), (scenarios, []))[1].append(target)
+
+    print(f"{len(reports)} nodes, {sum(len(t) for _, t in jobs.values())} exports "
+          f"({len(jobs)} distinct) on {workers or os.cpu_count()} workers", file=log)
+    # Le liste più grandi per prime: bilancia il carico tra i processi
+    ordered = sorted(jobs.values(), key=lambda job: -len(job[0]))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(path, cache_dir)) as pool:
+        written = sum(pool.map(_write_export, ordered))
+
+    manifest = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'source': os.path.abspath(path), 'types': list(types), 'method': method,
+                'n_scenarios': len(ds.type_map), 'nodes': reports}
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(out, 'manifest.json'), 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    print(f"wrote {written} files to {out} in {time.perf_counter() - t0:.1f}s", file=log)
+    return manifest
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--file', default=FILE_PATH, help="workbook degli shock")
+    ap.add_argument('--out', default='nightly_pack', help="cartella di destinazione")
+    ap.add_argument('--types', nargs='+', default=['BRS', 'EC'])
+    ap.add_argument('--workers', type=int, default=None, help="processi (default: n. core)")
+    ap.add_argument('--cache-dir', default=CACHE_DIR)
+    ap.add_argument('--method', default=DEFAULT_METHOD, choices=list(DIRECTION_METHODS),
+                    help="metodologia di direzione")
+    args = ap.parse_args(argv)
+    run(args.file, args.out, tuple(args.types), args.workers, args.cache_dir, args.method)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Export multi-formato: file unico o archivio ZIP con un file per scenario, in xlsx, csv o parquet.
+
+Ogni formato usa colonne e ordine di export_frame (gli stessi di build_export_bytes).
+Nello ZIP i file dei singoli scenari sono scritti nell'archivio man mano che sono pronti;
+gli ZIP xlsx grandi li costruiscono in un pool di processi.
+
+    data = build_scenario_zip(ds.df, ["Scenario A", "Scenario B"], "csv", ds.desc_map, ds.type_map)
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .export import build_export_bytes, export_frame, safe_name
+from .index import scenario_bounds, scenario_rows
+
+EXPORT_FORMATS = {
+    'xlsx':    ('Excel',   'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv':     ('CSV',     'text/csv'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+}
+ZIP_MIME           = 'application/zip'
+# Righe xlsx da cui il pool di processi ripaga il suo avvio (import di pandas e righe da
+# deserializzare per worker: alcuni secondi); csv e parquet restano nel processo chiamante
+BULK_PARALLEL_ROWS = 50_000
+
+def export_file_bytes(df_sub, fmt='xlsx', desc_map=None, type_map=None, include_all_scenarios=False):
+    """Byte dell'export di df_sub nel formato richiesto."""
+    if fmt == 'xlsx':
+        return build_export_bytes(df_sub, include_all_scenarios, desc_map, type_map)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt} (use {', '.join(EXPORT_FORMATS)})")
+    export_df = export_frame(df_sub, include_all_scenarios, desc_map, type_map)
+    if fmt == 'csv':
+        return export_df.to_csv(index=False).encode('utf-8')
+    # Stringhe semplici: le categorie del dataset intero gonfierebbero ogni file
+    cats = export_df.select_dtypes('category').columns
+    export_df[cats] = export_df[cats].astype(object).where(export_df[cats].notna(), None)
+    buf = io.BytesIO()
+    export_df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+# ─── WORKER ────────────────────────────────────────────────────────────────────
+_worker_state = None
+
+def _init_worker(df, desc_map, type_map, fmt):
+    global _worker_state
+    _worker_state = (df, scenario_bounds(df), desc_map, type_map, fmt)
+
+def _scenario_file(scenario):
+    df, index, desc_map, type_map, fmt = _worker_state
+    return scenario, export_file_bytes(scenario_rows(df, [scenario], index), fmt, desc_map, type_map)
+
+# ─── ARCHIVIO ──────────────────────────────────────────────────────────────────
+def _file_names(scenarios, fmt):
+    """Nome di file valido e univoco per ogni scenario."""
+    names, used = {}, set()
+    for sc in scenarios:
+        base, name, n = safe_name(sc), f"{safe_name(sc)}.{fmt}", 1
+        while name.lower() in used:
+            n += 1
+            name = f"{base}_{n}.{fmt}"
+        used.add(name.lower())
+        names[sc] = name
+    return names
+
+def write_scenario_zip(fileobj, df, scenarios, fmt='xlsx', desc_map=None, type_map=None,
+                       workers=None, progress=None):
+    """Scrive in `fileobj` uno ZIP con un file per scenario presente in df.
+
+    Gli ZIP xlsx da almeno BULK_PARALLEL_ROWS righe, con più di un worker (default: n.
+    core), si costruiscono in un pool di processi (spawn: sicuro anche dentro il server
+    Streamlit); ai worker passano solo le righe degli scenari richiesti. `progress(frazione)` è
+    chiamato a ogni file scritto.
+    Restituisce il numero di file.
+    """
+    index     = scenario_bounds(df)
+    scenarios = sorted(sc for sc in set(scenarios) if sc in index)
+    names     = _file_names(scenarios, fmt)
+    # csv si comprime bene; xlsx e parquet sono già compressi
+    method    = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+    with zipfile.ZipFile(fileobj, 'w', compression=method) as zf:
+        def add(scenario, data, done):
+            zf.writestr(names[scenario], data)
+            if progress:
+                progress(done / len(scenarios))
+
+        rows    = scenario_rows(df, scenarios, index)
+        workers = min(workers or os.cpu_count() or 1, len(scenarios))
+        if workers <= 1 or fmt != 'xlsx' or len(rows) < BULK_PARALLEL_ROWS:
+            for done, sc in enumerate(scenarios, start=1):
+                add(sc, export_file_bytes(scenario_rows(df, [sc], index), fmt, desc_map, type_map), done)
+            return len(scenarios)
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(rows, dict(desc_map or {}), dict(type_map or {}), fmt)) as pool:
+            futures = [pool.submit(_scenario_file, sc) for sc in scenarios]
+            for done, fut in enumerate(as_completed(futures), start=1):
+                add(*fut.result(), done)
+    return len(scenarios)
+
+def build_scenario_zip(df, scenarios, fmt='xlsx', desc_map=None, type_map=None, workers=None, progress=None):
+    """Byte dello ZIP di write_scenario_zip (per scriverlo direttamente su file: write_scenario_zip)."""
+    buf = io.BytesIO()
+    write_scenario_zip(buf, df, scenarios, fmt, desc_map, type_map, workers, progress)
+    return buf.getvalue()
@@ -0,0 +1,50 @@
+"""Cache in memoria condivise tra le sessioni: LRU limitata con build a volo singolo."""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class LRUCache:
+    """LRU limitata a max_items voci, sicura tra thread.
+
+    Richieste concorrenti per la stessa chiave attendono un'unica build.
+    """
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self._items    = OrderedDict()
+        self._pending  = {}
+        self._lock     = threading.Lock()
+
+    def get(self, key, build):
+        return self.lookup(key, build)[0]
+
+    def peek(self, key):
+        """Dati già pronti per `key` o None, senza costruire né aggiornare l'ordine LRU."""
+        with self._lock:
+            return self._items.get(key)
+
+    def lookup(self, key, build):
+        """(dati, hit): hit è False solo per la chiamata che ha eseguito la build."""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key], True
+            fut   = self._pending.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._pending[key] = Future()
+        if not owner:
+            return fut.result(), True
+        try:
+            data = build()
+        except BaseException as exc:
+            with self._lock:
+                self._pending.pop(key, None)
+            fut.set_exception(exc)
+            raise
+        with self._lock:
+            self._items[key] = data
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+            self._pending.pop(key, None)
+        fut.set_result(data)
+        return data, False
@@ -0,0 +1,122 @@
+"""Confronto tra due versioni del foglio Shocks: scenari, shock allineati per chiave e flip di direzione."""
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .directions import CUBE_LEVELS, DEFAULT_METHOD
+
+SHOCK_KEYS = ['Scenario', 'L1', 'L2', 'L3', 'Factor', 'Extra']
+DIR_LABEL  = {'pos': '▲ Positive', 'neg': '▼ Negative', 'zero': '~ Mixed'}
+
+class Comparison(NamedTuple):
+    scenarios: pd.DataFrame   # Scenario, Scenario Type, status (added/removed/common)
+    shocks:    pd.DataFrame   # shock allineati: chiavi, Value/Unit old/new, status
+    flips:     dict           # livello → nodi con direzione cambiata
+    summary:   dict           # conteggi per la strip di riepilogo
+
+def _occurrence(codes):
+    """Numero progressivo di ogni riga tra quelle con lo stesso codice (0, 1, ...)."""
+    return pd.Series(codes).groupby(codes, sort=False).cumcount().to_numpy()
+
+def _key_column(df, col):
+    return df[col].reset_index(drop=True) if col in df.columns else pd.Series(np.nan, index=range(len(df)))
+
+def _key_codes(old_df, new_df):
+    """Codice int64 comune alle due versioni per (Scenario, L1, L2, L3, Factor, Extra, occorrenza).
+
+    Ogni colonna chiave è fattorizzata sull'unione delle due versioni (i vuoti sono un
+    valore come gli altri) e combinata nel codice; l'occorrenza distingue le chiavi
+    ripetute nello stesso scenario.
+    """
+    n_old = len(old_df)
+    code  = np.zeros(n_old + len(new_df), dtype=np.int64)
+    for col in SHOCK_KEYS:
+        both         = pd.concat([_key_column(old_df, col), _key_column(new_df, col)], ignore_index=True)
+        values, uniq = pd.factorize(both, use_na_sentinel=False)
+        code = pd.factorize(code * len(uniq) + values)[0].astype(np.int64)
+    occ  = np.concatenate([_occurrence(code[:n_old]), _occurrence(code[n_old:])])
+    code = code * (occ.max(initial=0) + 1) + occ
+    return code[:n_old], code[n_old:]
+
+def compare_shocks(old_df, new_df):
+    """Allineamento vettoriale su (Scenario, L1, L2, L3, Factor, Extra) con stato per riga.
+
+    Equivale a un join esterno sulle chiavi: righe della versione precedente nel loro
+    ordine, poi gli shock nuovi, ordinati per Scenario.
+    """
+    k_old, k_new = _key_codes(old_df, new_df)
+    in_new = pd.Index(k_new).get_indexer(k_old)          # -1: shock rimosso
+    added  = np.flatnonzero(pd.Index(k_old).get_indexer(k_new) < 0)
+    cols   = [c for c in SHOCK_KEYS + ['Scenario Type'] if c in old_df.columns and c in new_df.columns]
+
+    value_old = pd.to_numeric(old_df['Value'], errors='coerce').reset_index(drop=True)
+    value_new = pd.to_numeric(new_df['Value'], errors='coerce').reset_index(drop=True)
+    unit_old  = old_df['Unit'].reset_index(drop=True)
+    unit_new  = new_df['Unit'].reset_index(drop=True)
+
+    kept = old_df[cols].reset_index(drop=True)
+    kept['Value old'], kept['Unit old'] = value_old, unit_old
+    kept['Value new'] = value_new.reindex(in_new).to_numpy()
+    kept['Unit new']  = unit_new.reindex(in_new).array
+    fresh = new_df[cols].iloc[added].reset_index(drop=True)
+    fresh['Value old'], fresh['Unit old'] = np.nan, unit_new.reindex(np.full(len(added), -1)).array
+    fresh['Value new'], fresh['Unit new'] = value_new.iloc[added].to_numpy(), unit_new.iloc[added].array
+    out = pd.concat([kept, fresh], ignore_index=True)
+
+    vo, vn  = out['Value old'].to_numpy(dtype=float), out['Value new'].to_numpy(dtype=float)
+    uo, un  = out['Unit old'].to_numpy(dtype=object), out['Unit new'].to_numpy(dtype=object)
+    same    = np.isclose(vo, vn, equal_nan=True) & ((uo == un) | (pd.isna(uo) & pd.isna(un)))
+    removed = np.concatenate([in_new < 0, np.zeros(len(added), dtype=bool)])
+    is_new  = np.arange(len(out)) >= len(kept)
+    out['Delta']  = vn - vo
+    out['status'] = np.select([removed, is_new, ~same], ['removed', 'added', 'changed'], default='same')
+    return out.sort_values('Scenario', kind='stable', ignore_index=True)
+
+def compare_scenarios(old_ds, new_ds):
+    old_sc, new_sc = set(old_ds.type_map), set(new_ds.type_map)
+    rows = sorted(old_sc | new_sc)
+    status = ['added' if sc not in old_sc else 'removed' if sc not in new_sc else 'common' for sc in rows]
+    return pd.DataFrame({
+        'Scenario':      rows,
+        'Scenario Type': [new_ds.type_map.get(sc, old_ds.type_map.get(sc)) for sc in rows],
+        'Description':   [new_ds.desc_map.get(sc, old_ds.desc_map.get(sc, '')) for sc in rows],
+        'status':        status,
+    })
+
+def direction_flips(old_ds, new_ds, level='L1', method=DEFAULT_METHOD):
+    """Nodi (Scenario, livello) presenti in entrambe le versioni con direzione diversa."""
+    cols = {f'score_{method}': 'score', f'direction_{method}': 'direction'}
+    old  = old_ds.cube[level][list(cols)].rename(columns=cols)
+    new  = new_ds.cube[level][list(cols) + ['Scenario Type']].rename(columns=cols)
+    both = old.join(new, how='inner', lsuffix=' old', rsuffix=' new')
+    flips = both[both['direction old'] != both['direction new']].reset_index()
+    for side in ('old', 'new'):
+        flips[f'direction {side}'] = flips[f'direction {side}'].map(DIR_LABEL)
+    keys = [c for c in ('Scenario', 'L1', 'L2', 'L3') if c in flips.columns]
+    return flips[keys + ['Scenario Type', 'score old', 'direction old', 'score new', 'direction new']]
+
+def compare_datasets(old_ds, new_ds, method=DEFAULT_METHOD):
+    scenarios = compare_scenarios(old_ds, new_ds)
+    shocks    = compare_shocks(old_ds.df, new_ds.df)
+    sc_counts = scenarios['status'].value_counts()
+    sh_counts = shocks['status'].value_counts()
+    flips     = {level: direction_flips(old_ds, new_ds, level, method) for level in CUBE_LEVELS}
+    summary = {
+        'scenarios_added':   int(sc_counts.get('added', 0)),
+        'scenarios_removed': int(sc_counts.get('removed', 0)),
+        'scenarios_common':  int(sc_counts.get('common', 0)),
+        'shocks_added':      int(sh_counts.get('added', 0)),
+        'shocks_removed':    int(sh_counts.get('removed', 0)),
+        'shocks_changed':    int(sh_counts.get('changed', 0)),
+        **{f'flips_{level}': int(len(f)) for level, f in flips.items()},
+    }
+    return Comparison(scenarios, shocks, flips, summary)
+
+def comparison_sheets(cmp):
+    """Fogli dell'export del confronto: riepilogo, scenari, shock modificati e flip per livello."""
+    sheets = {'Summary':   pd.DataFrame({'Metric': list(cmp.summary), 'Count': list(cmp.summary.values())}),
+              'Scenarios': cmp.scenarios[cmp.scenarios['status'] != 'common'],
+              'Shocks':    cmp.shocks[cmp.shocks['status'] != 'same']}
+    sheets.update({f'Flips {level}': frame for level, frame in cmp.flips.items()})
+    return sheets
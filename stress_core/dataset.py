@@ -0,0 +1,294 @@
+"""Lettura del foglio Shocks (con snapshot Parquet) e preparazione del Dataset con le strutture derivate."""
+import hashlib
+import io
+import json
+import os
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .directions import bps_values, build_asset_matrix, build_direction_cube
+from .geo import build_geo, unmapped_factors
+from .index import scenario_bounds, scenario_rows
+
+FILE_PATH = "Lista_scenari_shocks.xlsx"
+CACHE_DIR = ".shocks_cache"
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _typed(df_raw):
+    """Colonne non numeriche come stringhe (NaN per i vuoti): schema stabile per lo snapshot."""
+    df_raw = df_raw.copy()
+    for col in df_raw.columns:
+        s = df_raw[col]
+        if s.dtype == object or pd.api.types.is_string_dtype(s):
+            df_raw[col] = s.astype(str).where(s.notna(), np.nan)
+    return df_raw
+
+def read_shocks(path=FILE_PATH, cache_dir=CACHE_DIR):
+    """Foglio Shocks dallo snapshot Parquet; l'xlsx viene riletto solo quando cambia.
+
+    Lo snapshot è indicizzato dall'hash del contenuto; il manifest ricorda
+    mtime/size dell'ultimo hash calcolato per evitare di rileggere il file.
+    """
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    stat = os.stat(path)
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = {}
+    if (manifest.get('mtime_ns'), manifest.get('size')) == (stat.st_mtime_ns, stat.st_size):
+        digest = manifest['sha256']
+    else:
+        digest = _file_sha256(path)
+    snapshot = os.path.join(cache_dir, f"shocks_{digest[:16]}.parquet")
+
+    if os.path.exists(snapshot):
+        try:
+            df_raw = _typed(pd.read_parquet(snapshot))
+        except Exception:
+            df_raw = None
+        if df_raw is not None:
+            if manifest.get('sha256') != digest or manifest.get('mtime_ns') != stat.st_mtime_ns:
+                _write_manifest(manifest_path, stat, digest)
+            return df_raw
+
+    df_raw = _typed(pd.read_excel(path, sheet_name="Shocks"))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{snapshot}.{os.getpid()}.tmp"
+        df_raw.to_parquet(tmp, index=False)
+        os.replace(tmp, snapshot)
+        _write_manifest(manifest_path, stat, digest)
+        for name in os.listdir(cache_dir):
+            if name.startswith('shocks_') and name.endswith('.parquet') \
+                    and os.path.join(cache_dir, name) != snapshot:
+                os.remove(os.path.join(cache_dir, name))
+    except (ImportError, OSError, ValueError):
+        pass  # senza pyarrow o con disco in sola lettura si lavora direttamente dall'xlsx
+    return df_raw
+
+def read_shocks_bytes(data):
+    """Foglio Shocks da un workbook in memoria (es. caricato dall'utente), con lo stesso schema di read_shocks."""
+    return _typed(pd.read_excel(io.BytesIO(data), sheet_name="Shocks"))
+
+def _write_manifest(manifest_path, stat, digest):
+    tmp = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as fh:
+        json.dump({'sha256': digest, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}, fh)
+    os.replace(tmp, manifest_path)
+
+# ─── DATASET ───────────────────────────────────────────────────────────────────
+
+class Dataset(NamedTuple):
+    """Shocks puliti e strutture derivate, immutabile: un aggiornamento produce un nuovo Dataset.
+
+    prepare_dataset e update_dataset lo restituiscono già congelato (freeze_dataset).
+    Le righe geografiche (geo) si costruiscono al primo uso della mappa, vedi GeoRows.
+    """
+    df:           pd.DataFrame   # una riga per shock, ordinata per Scenario, con colonna bps
+    desc_map:     dict           # Scenario → Description
+    type_map:     dict           # Scenario → Scenario Type
+    cube:         dict           # livello → score/direzione per (nodo, Scenario)
+    index:        dict           # Scenario → (inizio, fine) in df
+    matrix:       dict           # matrice scenari × L1 per il matching multi-asset
+    geo:          'GeoRows'      # righe con Country, costruite al primo get()
+    fingerprints: dict           # Scenario → impronta delle sue righe grezze
+    version:      str            # impronta dell'intero contenuto
+
+def compact_frame(df):
+    """Testi come categoriche (categorie ordinate) e float come float32 quando la conversione è esatta.
+
+    Il risultato non dipende da come il frame è stato assemblato: un frame ricomposto
+    da parti (hot reload) coincide con quello ricostruito per intero.
+    """
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            out[col] = s.cat.remove_unused_categories()
+        elif s.dtype == object or pd.api.types.is_string_dtype(s):
+            out[col] = s.astype('category')
+        elif s.dtype == np.float64:
+            f32 = s.astype(np.float32)
+            out[col] = f32 if np.array_equal(f32.to_numpy(dtype=float), s.to_numpy(), equal_nan=True) else s
+        else:
+            out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+def without_scenarios(frame, index, scenarios):
+    """Righe di `frame` (ordinato per Scenario) esclusi gli scenari in `scenarios`."""
+    return scenario_rows(frame, [sc for sc in index if sc not in scenarios], index)
+
+def merge_scenarios(kept, fresh):
+    """Unione ordinata per Scenario; le categoriche sono ricompattate come in una ricostruzione integrale."""
+    parts = [p for p in (kept, fresh) if len(p)]
+    if len(parts) == 1:
+        return compact_frame(parts[0].reset_index(drop=True))
+    merged = pd.concat(parts or [kept], ignore_index=True)
+    return compact_frame(merged.sort_values('Scenario', kind='stable', ignore_index=True))
+
+class GeoRows:
+    """Righe geografiche di un Dataset (build_geo sulle righe grezze con Country), costruite al
+    primo get() e poi riusate.
+
+    Fino alla build conserva solo le righe grezze con Country. update() prepara quelle della
+    versione successiva: se questa è già costruita ne riusa le righe degli scenari invariati e
+    ricostruisce solo quelle degli scenari cambiati, come una ricostruzione integrale.
+    """
+    _COLUMNS = ['Scenario', 'Scenario Type', 'Country', 'Factor', 'Value']
+
+    def __init__(self, df_raw, base=None, affected=()):
+        # Solo le righe con Country (senza la colonna: nessuna riga, build_geo dà un geo vuoto)
+        rows   = df_raw['Country'].notna() if 'Country' in df_raw.columns else np.zeros(len(df_raw), dtype=bool)
+        df_raw = df_raw.loc[rows, [c for c in self._COLUMNS if c in df_raw.columns]]
+        self._raw      = df_raw
+        self._base     = base                # geo già costruito di una versione precedente
+        self._affected = frozenset(affected) # scenari di _base da ricostruire da _raw
+        self._data     = None
+        self._lock     = threading.Lock()
+
+    @property
+    def built(self):
+        return self._data is not None
+
+    def get(self):
+        """(geo, fattori non mappati, indice Scenario → righe di geo)."""
+        with self._lock:
+            if self._data is None:
+                fresh = compact_frame(build_geo(self._raw)[0])
+                if self._base is not None:
+                    geo, index = self._base
+                    fresh      = merge_scenarios(without_scenarios(geo, index, self._affected), fresh)
+                fresh      = read_only(fresh)
+                self._data = (fresh, unmapped_factors(fresh), read_only(scenario_bounds(fresh)))
+                self._raw, self._base = None, None
+            return self._data
+
+    def update(self, raw_changed, affected):
+        """GeoRows della versione successiva; raw_changed sono le righe grezze degli scenari in `affected`."""
+        with self._lock:
+            if self._data is not None:
+                return GeoRows(raw_changed, (self._data[0], self._data[2]), affected)
+            keep = ~self._raw['Scenario'].astype(str).str.strip().isin(affected)
+            raw  = pd.concat([self._raw[keep], raw_changed], ignore_index=True) if len(raw_changed) else self._raw[keep]
+            return GeoRows(raw, self._base, self._affected | set(affected))
+
+def read_only(obj):
+    """Struttura condivisa in sola lettura: dict → MappingProxyType, liste → tuple, array non scrivibili.
+
+    Le viste non copiano i dati. I DataFrame diventano frame nuovi sugli stessi array resi
+    non scrivibili: una scrittura in place (ds.df.loc[...] = ..., to_numpy()[...] = ...)
+    solleva ValueError invece di modificare i dati di tutte le sessioni; filtri, slice e
+    assign restano possibili e producono frame propri.
+    """
+    if isinstance(obj, (dict, MappingProxyType)):
+        return MappingProxyType({k: read_only(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'):
+        return tuple(read_only(v) for v in obj)
+    if isinstance(obj, np.ndarray) and obj.flags.writeable:
+        view = obj.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(obj, pd.DataFrame):
+        return pd.DataFrame({col: _read_only_column(obj[col]) for col in obj.columns}, index=obj.index, copy=False)
+    return obj
+
+def _read_only_column(s):
+    # Categoriche: i codici (Categorical.codes è già una vista non scrivibile); numpy: vista non scrivibile
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(s.array.codes, dtype=s.dtype)
+    if isinstance(s.dtype, np.dtype):
+        return read_only(s.to_numpy())
+    if isinstance(s.dtype, pd.StringDtype):
+        # Le stringhe Arrow (default di pandas 3) si sostituiscono in place senza flag di
+        # scrittura: stesso dtype 'str' su un array numpy di oggetti, reso non scrivibile
+        na    = s.dtype.na_value
+        dtype = pd.StringDtype('python') if na is pd.NA else pd.StringDtype('python', na_value=na)
+        arr   = pd.array(s.to_numpy(dtype=object), dtype=dtype)
+        np.asarray(arr).flags.writeable = False
+        return arr
+    return s.array
+
+def freeze_dataset(ds):
+    """Dataset pronto per essere condiviso tra sessioni e thread: frame, mappe e array in sola lettura."""
+    return ds._replace(**{field: read_only(getattr(ds, field))
+                          for field in ('df', 'desc_map', 'type_map', 'cube', 'index', 'matrix', 'fingerprints')})
+
+def clean_shocks(df_raw):
+    """Pulizia testi, scarto righe senza Scenario/L1, ordinamento per Scenario e colonna bps."""
+    df = df_raw.rename(columns={'Livello 1': 'L1', 'Livello 2': 'L2', 'Livello 3': 'L3'})
+
+    for col in ['Scenario', 'Scenario Type', 'L1', 'L2', 'L3', 'Factor', 'Unit']:
+        df[col] = df[col].astype(str).str.strip()
+        df[col] = df[col].replace('nan', np.nan)
+
+    df = df.dropna(subset=['Scenario', 'L1'])
+    df = df[df['L1'].str.strip().astype(bool)]
+    df = df.sort_values('Scenario', kind='stable', ignore_index=True)
+    df['bps'] = bps_values(df)
+    return compact_frame(df)
+
+def scenario_maps(df):
+    """(desc_map, type_map): prima Description / Scenario Type di ogni scenario."""
+    desc_map = (
+        df.dropna(subset=['Description'])
+          .drop_duplicates(subset='Scenario')[['Scenario', 'Description']]
+          .set_index('Scenario')['Description']
+          .to_dict()
+    ) if 'Description' in df.columns else {}
+    type_map = (
+        df.drop_duplicates(subset='Scenario')[['Scenario', 'Scenario Type']]
+          .set_index('Scenario')['Scenario Type']
+          .to_dict()
+    )
+    return desc_map, type_map
+
+def dataset_summary(df):
+    """Conteggi di header, chip e footer: scenari (totali e per tipo), asset class e scenari per L1."""
+    l1_counts = df.groupby('L1', observed=True)['Scenario'].nunique().sort_values(ascending=False)
+    by_type   = df.groupby('Scenario Type', observed=True)['Scenario'].nunique()
+    return {
+        'n_scenarios': int(df['Scenario'].nunique()),
+        'n_l1':        int(df['L1'].nunique()),
+        'l1_counts':   {str(k): int(v) for k, v in l1_counts.items()},
+        'by_type':     {str(k): int(v) for k, v in by_type.items()},
+    }
+
+def scenario_fingerprints(df_raw):
+    """Impronta uint64 delle righe grezze di ogni scenario, sensibile a contenuto e ordine."""
+    key  = df_raw['Scenario'].astype(str).str.strip()
+    pos  = key.groupby(key, sort=False).cumcount().to_numpy()
+    rows = pd.util.hash_pandas_object(df_raw.assign(_pos=pos), index=False).to_numpy()
+    codes, names = pd.factorize(key)
+    fp = np.zeros(len(names), dtype=np.uint64)
+    np.add.at(fp, codes, rows)
+    return dict(zip(names.tolist(), fp.tolist()))
+
+def dataset_version(fingerprints):
+    h = hashlib.sha1()
+    for sc in sorted(fingerprints):
+        h.update(f"{sc}\x1f{fingerprints[sc]}\x1e".encode())
+    return h.hexdigest()[:12]
+
+def prepare_dataset(df_raw):
+    """Dal foglio Shocks grezzo al Dataset completo (ricostruzione integrale)."""
+    df                 = clean_shocks(df_raw)
+    desc_map, type_map = scenario_maps(df)
+    cube               = build_direction_cube(df, type_map)
+    fingerprints       = scenario_fingerprints(df_raw)
+    return freeze_dataset(Dataset(
+        df, desc_map, type_map, cube, scenario_bounds(df), build_asset_matrix(cube, type_map),
+        GeoRows(df_raw), fingerprints, dataset_version(fingerprints)))
+
+def load_dataset(path=FILE_PATH, cache_dir=CACHE_DIR):
+    return prepare_dataset(read_shocks(path, cache_dir))
@@ -0,0 +1,182 @@
+"""Motore delle direzioni: conversione in bps, score per scenario, cubo per nodo e matching multi-asset."""
+import numpy as np
+import pandas as pd
+
+# Moltiplicatori verso bps; le unità assenti (pct/yr, Price, Index Level, FX Rate) non sono direzionali
+BPS_MULTIPLIER = {'bps': 1.0, 'pct': 100.0, 'rel %': 100.0}
+
+def to_bps(value, unit):
+    if pd.isna(value) or pd.isna(unit):
+        return np.nan
+    mult = BPS_MULTIPLIER.get(str(unit).strip().lower())
+    return float(value) * mult if mult is not None else np.nan
+
+def bps_values(df_sub):
+    """Versione vettoriale di to_bps sulle colonne Value/Unit."""
+    mult = df_sub['Unit'].astype(str).str.strip().str.lower().map(BPS_MULTIPLIER)
+    return pd.to_numeric(df_sub['Value'], errors='coerce') * mult.astype(float)
+
+def scenario_direction(score):
+    if pd.isna(score): return 'zero'
+    if score > 0:      return 'pos'
+    if score < 0:      return 'neg'
+    return 'zero'
+
+def direction_labels(scores):
+    scores = np.asarray(scores, dtype=float)
+    return np.select([scores > 0, scores < 0], ['pos', 'neg'], default='zero')
+
+# Metodologie di direzione: tutte calcolate insieme da method_scores, in un solo groupby
+DIRECTION_METHODS = {
+    'mean':     'Mean',                      # media aritmetica dei bps
+    'median':   'Median',                    # mediana dei bps
+    'vote':     'Sign vote',                 # (n. shock > 0 − n. shock < 0) / n. shock direzionali
+    'weighted': 'Magnitude-weighted mean',   # Σ bps·|bps| / Σ |bps|
+}
+DEFAULT_METHOD = 'mean'
+
+def _plain_index(index):
+    """Indice di un groupby su colonne categoriche con livelli di stringhe semplici (come il cubo)."""
+    if isinstance(index, pd.MultiIndex):
+        return index.set_levels([lv.astype(str) for lv in index.levels])
+    return index.astype(str)
+
+def method_scores(df_sub, keys=()):
+    """Score di ogni metodologia (una colonna per metodo) e n_shocks per (keys…, Scenario)."""
+    bps  = df_sub['bps'].to_numpy(dtype=float)
+    absv = np.abs(bps)
+    cols = df_sub[list(keys) + ['Scenario']].assign(bps=bps, _sign=np.sign(bps), _w=bps * absv, _abs=absv)
+    agg  = cols.groupby(list(keys) + ['Scenario'], sort=True, observed=True).agg(
+        mean=('bps', 'mean'), median=('bps', 'median'), vote=('_sign', 'mean'),
+        _w=('_w', 'sum'), _abs=('_abs', 'sum'), n_shocks=('bps', 'size'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        agg['weighted'] = agg['_w'] / agg['_abs'].where(agg['_abs'] > 0)
+    agg.index = _plain_index(agg.index)
+    return agg[list(DIRECTION_METHODS) + ['n_shocks']]
+
+def scenario_scores(df_sub, method=DEFAULT_METHOD):
+    return method_scores(df_sub)[method]
+
+def get_scenario_directions(df_sub, method=DEFAULT_METHOD):
+    scores = scenario_scores(df_sub, method)
+    return dict(zip(scores.index, direction_labels(scores.to_numpy())))
+
+def tally(directions):
+    """(n_pos, n_neg, n_zero) di una sequenza di etichette di direzione."""
+    vc = pd.Series(directions, dtype=object).value_counts()
+    return int(vc.get('pos', 0)), int(vc.get('neg', 0)), int(vc.get('zero', 0))
+
+def count_directions(df_sub, method=DEFAULT_METHOD):
+    return tally(direction_labels(scenario_scores(df_sub, method).to_numpy()))
+
+# ─── CUBO PER NODO ─────────────────────────────────────────────────────────────
+# Nodi della gerarchia su cui si valuta la direzione: L1, L1›L2, L1›L2›L3
+CUBE_LEVELS = {'L1': ['L1'], 'L2': ['L1', 'L2'], 'L3': ['L1', 'L2', 'L3']}
+
+def build_direction_cube(df, type_map):
+    """Per ogni (nodo, Scenario) score e direzione di tutte le metodologie e n. shock, un groupby per livello.
+
+    Colonne: score_<metodo>, direction_<metodo> per ogni metodo di DIRECTION_METHODS,
+    n_shocks, Scenario Type. Cambiare metodologia è una selezione di colonna.
+    """
+    cube = {}
+    for level, keys in CUBE_LEVELS.items():
+        scores = method_scores(df, keys)
+        agg    = scores[['n_shocks']].copy()
+        for method in DIRECTION_METHODS:
+            agg[f'score_{method}']     = scores[method]
+            agg[f'direction_{method}'] = direction_labels(scores[method].to_numpy())
+        agg['Scenario Type'] = agg.index.get_level_values('Scenario').map(type_map)
+        cube[level] = agg
+    return cube
+
+def node_directions(cube, path, type_filter='All', method=DEFAULT_METHOD):
+    """Direzione per scenario del nodo `path` (L1[, L2[, L3]]), con filtro tipo opzionale."""
+    path  = tuple(path)
+    frame = cube[('L1', 'L2', 'L3')[len(path) - 1]]
+    try:
+        sub = frame.loc[path]
+    except KeyError:
+        return pd.Series(dtype=object)
+    if type_filter in ('BRS', 'EC'):
+        sub = sub[sub['Scenario Type'] == type_filter]
+    return sub[f'direction_{method}']
+
+def node_counts(cube, path, type_filter='All', method=DEFAULT_METHOD):
+    return tally(node_directions(cube, path, type_filter, method))
+
+def node_children(cube, path=()):
+    """Figli ordinati del nodo `path` (() → tutte le L1)."""
+    path  = tuple(path)
+    level = ('L1', 'L2', 'L3')[len(path)]
+    frame = cube[level]
+    if path:
+        try:
+            frame = frame.loc[path]
+        except KeyError:
+            return []
+    names = frame.index.get_level_values(level).unique()
+    return sorted(str(n) for n in names if str(n).strip() not in ('', 'nan'))
+
+def iter_nodes(cube):
+    """Tutti i nodi della gerarchia come tuple (L1,), (L1, L2), (L1, L2, L3), in ordine."""
+    for level in CUBE_LEVELS:
+        for node in cube[level].index.droplevel('Scenario').unique().sort_values():
+            yield node if isinstance(node, tuple) else (node,)
+
+# ─── MULTI-ASSET ───────────────────────────────────────────────────────────────
+DIR_CODES = {'pos': 1, 'neg': -1, 'zero': 0}
+
+def build_asset_matrix(cube, type_map):
+    """Matrice densa scenari × L1 dal cubo: presenza (bool) e codice direzione (+1/-1/0) per metodologia."""
+    l1_cube        = cube['L1']
+    l1_pos, l1s    = pd.factorize(l1_cube.index.get_level_values('L1'), sort=True)
+    sc_pos, scs    = pd.factorize(l1_cube.index.get_level_values('Scenario'), sort=True)
+    presence       = np.zeros((len(scs), len(l1s)), dtype=bool)
+    presence[sc_pos, l1_pos] = True
+    dirs = {}
+    for method in DIRECTION_METHODS:
+        dirs[method] = np.zeros((len(scs), len(l1s)), dtype=np.int8)
+        dirs[method][sc_pos, l1_pos] = l1_cube[f'direction_{method}'].map(DIR_CODES).to_numpy(dtype=np.int8)
+    scs = np.asarray(scs, dtype=object)
+    return {'scenarios': scs, 'l1': list(l1s), 'presence': presence, 'dirs': dirs,
+            'types': pd.Series(scs).map(type_map).to_numpy(dtype=object)}
+
+MATCH_MODES = {'all': 'All of', 'any': 'Any of', 'atleast': 'At least k of n', 'except': 'All except'}
+
+def match_asset_classes(matrix, selected, mode='all', k=None, excluded=(), constraints=None,
+                        type_filter='All', method=DEFAULT_METHOD):
+    """Maschera sugli scenari di `matrix` per una combinazione di classi L1.
+
+    Una classe è "colpita" se lo scenario vi ha shock e, se c'è un vincolo in
+    `constraints` ({L1: 'pos'|'neg'|'zero'}), con quella direzione.
+    """
+    cols = [matrix['l1'].index(c) for c in selected]
+    hits = matrix['presence'][:, cols].copy()
+    for j, l1 in enumerate(selected):
+        want = (constraints or {}).get(l1)
+        if want in DIR_CODES:
+            hits[:, j] &= matrix['dirs'][method][:, cols[j]] == DIR_CODES[want]
+    excl = np.isin(np.asarray(selected, dtype=object), list(excluded))
+    if mode == 'any':
+        mask = hits.any(axis=1)
+    elif mode == 'atleast':
+        mask = hits.sum(axis=1) >= (k or len(cols))
+    elif mode == 'except':
+        mask = hits[:, ~excl].all(axis=1) & ~hits[:, excl].any(axis=1)
+    else:
+        mask = hits.all(axis=1)
+    if type_filter in ('BRS', 'EC'):
+        mask &= matrix['types'] == type_filter
+    return mask
+
+def common_direction(matrix, mask, included, method=DEFAULT_METHOD):
+    """Per gli scenari in `mask`: +1/-1 se la direzione è la stessa in tutte le classi incluse
+    in cui hanno shock, 0 altrimenti."""
+    cols = [matrix['l1'].index(c) for c in included]
+    pres = matrix['presence'][mask][:, cols]
+    dirs = matrix['dirs'][method][mask][:, cols]
+    any_ = pres.any(axis=1)
+    pos  = ((dirs == 1) | ~pres).all(axis=1) & any_
+    neg  = ((dirs == -1) | ~pres).all(axis=1) & any_
+    return np.select([pos, neg], [1, -1], default=0)
@@ -0,0 +1,190 @@
+"""Export Excel degli shock: colonne/ordine, writer write-only a blocchi di righe, cache LRU condivisa
+e pool di job in background per gli export pesanti."""
+import hashlib
+import io
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .cache import LRUCache
+
+EXPORT_COLUMNS     = ['Scenario', 'Scenario Type', 'Description', 'Factor',
+                      'Value', 'Unit', 'Extra', 'L3', 'L2', 'L1']
+EXPORT_CHUNK_ROWS  = 5_000
+
+def safe_name(name):
+    """Nome di file o cartella valido su ogni filesystem."""
+    return re.sub(r'[<>:"/\\|?*\x00-\x1f]', '_', str(name)).strip(' .') or '_'
+
+def export_frame(df_sub, include_all_scenarios=False, desc_map=None, type_map=None):
+    """Colonne e ordine dell'export; con include_all_scenarios aggiunge una riga vuota per gli scenari
+    di desc_map/type_map senza shock in df_sub."""
+    cols_out = [c for c in EXPORT_COLUMNS if c in df_sub.columns]
+
+    if include_all_scenarios:
+        desc_map, type_map = desc_map or {}, type_map or {}
+        all_known = set(desc_map.keys()) | set(type_map.keys())
+        present   = set(df_sub['Scenario'].unique())
+        missing   = all_known - present
+        if missing:
+            empty_rows = pd.DataFrame([{
+                'Scenario':      sc,
+                'Scenario Type': type_map.get(sc, ''),
+                'Description':   desc_map.get(sc, ''),
+                'Factor': '', 'Value': np.nan, 'Unit': '',
+                'Extra': '', 'L3': '', 'L2': '', 'L1': '',
+            } for sc in sorted(missing)])
+            df_sub = pd.concat([df_sub, empty_rows], ignore_index=True)
+
+    export_df = df_sub[cols_out].sort_values(
+        ['Scenario', 'L1', 'L2', 'L3'], na_position='last'
+    )
+    return export_df.rename(columns={'L1': 'Livello 1', 'L2': 'Livello 2', 'L3': 'Livello 3'})
+
+def column_widths(export_df):
+    widths = []
+    for col in export_df.columns:
+        s    = export_df[col]
+        lens = s.astype(str).str.len().where(s.notna(), 0)
+        widths.append(min(max(len(str(col)), int(lens.max()) if len(lens) else 0) + 4, 60))
+    return widths
+
+def build_export_bytes(df_sub, include_all_scenarios=False, desc_map=None, type_map=None, progress=None):
+    """Workbook in modalità write-only: righe scritte a blocchi, larghezze calcolate sul DataFrame.
+
+    `progress(frazione)` opzionale è chiamato dopo ogni blocco di righe.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+    from openpyxl.utils import get_column_letter
+
+    export_df = export_frame(df_sub, include_all_scenarios, desc_map, type_map)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Scenarios')
+    for i, width in enumerate(column_widths(export_df), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    thin   = Side(style='thin')
+    header = []
+    for name in export_df.columns:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font      = Font(bold=True)
+        cell.border    = Border(left=thin, right=thin, top=thin, bottom=thin)
+        cell.alignment = Alignment(horizontal='center', vertical='top')
+        header.append(cell)
+    ws.append(header)
+
+    for start in range(0, len(export_df), EXPORT_CHUNK_ROWS):
+        chunk = export_df.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+        for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+            ws.append(row)
+        if progress:
+            progress(0.95 * min(start + EXPORT_CHUNK_ROWS, len(export_df)) / len(export_df))
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def build_sheets_bytes(sheets):
+    """Workbook write-only con un foglio per DataFrame ({nome foglio: DataFrame})."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    for name, frame in sheets.items():
+        ws = wb.create_sheet(name[:31])
+        for i, width in enumerate(column_widths(frame), start=1):
+            ws.column_dimensions[get_column_letter(i)].width = width
+        header = []
+        for col in frame.columns:
+            cell = WriteOnlyCell(ws, value=str(col))
+            cell.font = Font(bold=True)
+            header.append(cell)
+        ws.append(header)
+        for start in range(0, len(frame), EXPORT_CHUNK_ROWS):
+            chunk = frame.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+            for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+                ws.append(row)
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+class ExportCache(LRUCache):
+    """LRU limitata dei file di export, condivisa tra le sessioni."""
+
+class ExportJob:
+    """Export in background: stato (queued/running/done/failed), avanzamento 0–1 e sessioni richiedenti."""
+    __slots__ = ('key', 'state', 'progress', 'error', 'owners')
+
+    def __init__(self, key, owner):
+        self.key, self.state, self.progress, self.error = key, 'queued', 0.0, None
+        self.owners = {owner}
+
+    @property
+    def active(self):
+        return self.state in ('queued', 'running')
+
+class ExportJobs:
+    """Pool limitato di thread per gli export pesanti, con limite di job attivi per sessione.
+
+    I byte finiscono nella ExportCache: a job concluso il download è un hit. Una richiesta
+    per una chiave già in coda o in corso si aggancia allo stesso job.
+    """
+    def __init__(self, cache, workers=2, per_owner=2, keep=64):
+        self.cache, self.per_owner, self.keep = cache, per_owner, keep
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def submit(self, key, build, owner):
+        """Job per `key` con `owner` tra i richiedenti, o None se `owner` ha già per_owner job attivi.
+
+        build(progress) restituisce i byte e aggiorna l'avanzamento con progress(frazione).
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and (job.active or job.state == 'done' and self.cache.peek(key) is not None):
+                job.owners.add(owner)
+                return job
+            if sum(j.active and owner in j.owners for j in self._jobs.values()) >= self.per_owner:
+                return None
+            job = self._jobs[key] = ExportJob(key, owner)
+            self._jobs.move_to_end(key)
+            finished = [k for k, j in self._jobs.items() if not j.active]
+            for k in finished[:max(len(self._jobs) - self.keep, 0)]:
+                del self._jobs[k]
+        self._pool.submit(self._run, job, build)
+        return job
+
+    def _run(self, job, build):
+        def progress(fraction):
+            job.progress = max(job.progress, min(float(fraction), 1.0))
+        job.state = 'running'
+        try:
+            self.cache.lookup(job.key, lambda: build(progress))
+        except Exception as exc:
+            job.state, job.error = 'failed', str(exc) or type(exc).__name__
+            return
+        job.progress, job.state = 1.0, 'done'
+
+def export_key(scenarios, type_filter, include_all=False, fingerprints=None):
+    """Chiave di contenuto dell'export; con le impronte degli scenari (Dataset.fingerprints) un
+    reload invalida solo gli export che contengono scenari cambiati."""
+    fingerprints = fingerprints or {}
+    h = hashlib.sha1(f"{type_filter}\x1f{include_all}".encode())
+    for sc in sorted(map(str, scenarios)):
+        h.update(f"\x1f{sc}\x1d{fingerprints.get(sc, '')}".encode())
+    return h.hexdigest()
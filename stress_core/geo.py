@@ -0,0 +1,184 @@
+"""Dati geografici: mappatura Factor → paese/area, righe geo per shock, aggregati e choropleth di base."""
+import numpy as np
+import pandas as pd
+
+from .index import scenario_rows
+
+# ── Factor → ISO3 specifico (paese singolo) ───────────────────────────────────
+FACTOR_TO_ISO3 = {
+    # Europe
+    'Austria ATX': 'AUT', 'Belgium 20': 'BEL', 'DAX 30': 'DEU',
+    'Denmark OMX Copenhag20': 'DNK', 'FTSE 100': 'GBR',
+    'FTSE All Share - FTSE 100': 'GBR', 'France CAC 40': 'FRA',
+    'Greece ASE/General': 'GRC', 'Ireland ISEQ/General': 'IRL',
+    'Italy S&P MIB': 'ITA', 'Italy S&P MIB - MSCI EUROPE(EUR)': 'ITA',
+    'Luxembourg LUXX': 'LUX', 'Netherlands AEX Stk': 'NLD',
+    'Poland WIG': 'POL', 'Portugal PSI 20': 'PRT',
+    'Spain IBEX 35': 'ESP', 'Sweden OMX': 'SWE', 'Switzerland SMI': 'CHE',
+    # Emerging Markets - indici
+    'Brazil Bovespa': 'BRA', 'China Shanghai SECmp': 'CHN',
+    'China Shenzhen SEAll': 'CHN', 'Czech Republic PX 50': 'CZE',
+    'Hungary BUX': 'HUN', 'India BSE 100': 'IND',
+    'Korea KOSPI Comp': 'KOR', 'Mexican Bolsa': 'MEX',
+    'Pakistan KSE 100': 'PAK', 'Philippines PSEi': 'PHL',
+    'Russia RTS': 'RUS', 'Taiwan TSEC': 'TWN', 'Taiwan TWSE': 'TWN',
+    'Turkey ISE Natl 100': 'TUR',
+    # Emerging Markets - Country Allocation
+    'Argentina': 'ARG', 'Brazil': 'BRA', 'China Domestic': 'CHN',
+    'China Offshore': 'CHN', 'Hungary': 'HUN', 'Indonesia': 'IDN',
+    'Mexico': 'MEX', 'Pakistan': 'PAK', 'Qatar': 'QAT',
+    'Saudi Arabia': 'SAU', 'South Africa': 'ZAF', 'Taiwan': 'TWN',
+    'Turkey': 'TUR', 'Ukraine': 'UKR', 'Venezuela': 'VEN', 'Viet Nam': 'VNM',
+    # Pacific ex Japan
+    'Hang Seng': 'HKG', 'S&P ASX 200': 'AUS', 'Singapore StraitsTms': 'SGP',
+    # North America
+    'Canada': 'CAN',
+    # Japan
+    'NIKKEI 225': 'JPN', 'NIKKEI 225 - MSCI World Net TR': 'JPN',
+    'MSCI Japan - MSCI World Net TR': 'JPN', 'MSCI Japan - MSCI EUROPE(EUR)': 'JPN',
+    # US
+    'S&P 500': 'USA', 'Nasdaq': 'USA', 'VIX': 'USA', 'VIX Volatility': 'USA',
+    'S&P Mid Cap': 'USA', 'S&P Small Cap': 'USA',
+    'Russell 1000 - Russell 2000': 'USA',
+    'Russell 3000 Growth - Russell 3000 Value': 'USA',
+}
+
+# ISO3 -> Area
+ISO3_TO_AREA = {
+    'USA': 'US', 'CAN': 'North America',
+    'GBR': 'Europe', 'DEU': 'Europe', 'FRA': 'Europe', 'ITA': 'Europe',
+    'ESP': 'Europe', 'CHE': 'Europe', 'NLD': 'Europe', 'BEL': 'Europe',
+    'SWE': 'Europe', 'NOR': 'Europe', 'DNK': 'Europe', 'FIN': 'Europe',
+    'AUT': 'Europe', 'POL': 'Europe', 'PRT': 'Europe', 'GRC': 'Europe',
+    'IRL': 'Europe', 'LUX': 'Europe',
+    'JPN': 'Japan',
+    'AUS': 'Pacific ex Japan', 'HKG': 'Pacific ex Japan',
+    'SGP': 'Pacific ex Japan', 'NZL': 'Pacific ex Japan',
+    'KOR': 'Pacific ex Japan', 'TWN': 'Pacific ex Japan',
+    'CHN': 'Emerging Markets', 'IND': 'Emerging Markets',
+    'BRA': 'Emerging Markets', 'MEX': 'Emerging Markets',
+    'RUS': 'Emerging Markets', 'ZAF': 'Emerging Markets',
+    'TUR': 'Emerging Markets', 'SAU': 'Emerging Markets',
+    'IDN': 'Emerging Markets', 'THA': 'Emerging Markets',
+    'MYS': 'Emerging Markets', 'PHL': 'Emerging Markets',
+    'PAK': 'Emerging Markets', 'ARG': 'Emerging Markets',
+    'CHL': 'Emerging Markets', 'COL': 'Emerging Markets',
+    'PER': 'Emerging Markets', 'VEN': 'Emerging Markets',
+    'EGY': 'Emerging Markets', 'MAR': 'Emerging Markets',
+    'NGA': 'Emerging Markets', 'QAT': 'Emerging Markets',
+    'ARE': 'Emerging Markets', 'ISR': 'Emerging Markets',
+    'HUN': 'Emerging Markets', 'CZE': 'Emerging Markets',
+    'UKR': 'Emerging Markets', 'VNM': 'Emerging Markets',
+}
+
+
+GEO_COLUMNS = ['Scenario', 'Scenario Type', 'Area', 'ISO3', 'Value', 'Factor', 'level']
+
+def build_geo(df_raw):
+    """Una riga per shock con Country, risolta a ISO3 (paese) o solo ad area; più i fattori non mappati."""
+    if 'Country' not in df_raw.columns:
+        return pd.DataFrame(columns=GEO_COLUMNS), pd.DataFrame(columns=['Area', 'Factor', 'n_shocks'])
+
+    sub  = df_raw[df_raw['Country'].notna()]
+    iso3 = sub['Factor'].astype(str).str.strip().map(FACTOR_TO_ISO3)
+    geo  = pd.DataFrame({
+        'Scenario':      sub['Scenario'].astype(str).str.strip(),
+        'Scenario Type': sub['Scenario Type'],
+        'Area':          sub['Country'],
+        'ISO3':          iso3,
+        'Value':         sub['Value'],
+        'Factor':        sub['Factor'],
+        'level':         np.where(iso3.notna(), 'country', 'area'),
+    }).sort_values('Scenario', kind='stable', ignore_index=True)
+    return geo, unmapped_factors(geo)
+
+def unmapped_factors(geo):
+    """Fattori risolti solo ad area, con il numero di shock."""
+    return (
+        geo[geo['level'] == 'area'].groupby(['Area', 'Factor'], observed=True).size()
+          .rename('n_shocks').reset_index()
+    )
+
+def geo_aggregates(geo, geo_index, type_map, type_filter='All'):
+    """Aggregati della mappa per filtro tipo: conteggi, liste scenari per paese/area e hover."""
+    if type_filter in ('BRS', 'EC'):
+        geo = scenario_rows(geo, [sc for sc, t in type_map.items() if t == type_filter], geo_index)
+
+    country_df        = geo[geo['level'] == 'country']
+    country_scenarios = {iso: sorted(g.unique()) for iso, g in country_df.groupby('ISO3', observed=True)['Scenario']}
+    area_scenarios    = {a: sorted(g.unique()) for a, g in geo.groupby('Area', observed=True)['Scenario']}
+
+    country_agg = (
+        country_df.groupby(['ISO3', 'Area'], observed=True)['Scenario']
+        .nunique().reset_index()
+        .rename(columns={'Scenario': 'n_sc'})
+    )
+    hover = []
+    for iso, area, n in zip(country_agg['ISO3'], country_agg['Area'], country_agg['n_sc']):
+        scs     = country_scenarios[iso]
+        sc_list = '<br>'.join(f'  · {s}' for s in scs[:8])
+        if len(scs) > 8:
+            sc_list += f'<br>  ... +{len(scs)-8} more'
+        hover.append(f"<b>{iso} ({area})</b><br>Specific scenarios: <b>{n}</b><br><br>{sc_list}")
+    country_agg['hover'] = hover
+
+    area_counts = (
+        pd.DataFrame({'Area': list(area_scenarios),
+                      'n_sc': [len(v) for v in area_scenarios.values()]})
+        .sort_values('n_sc', ascending=False)
+        .reset_index(drop=True)
+    )
+    return {
+        'country_agg':       country_agg,
+        'country_scenarios': country_scenarios,
+        'area_scenarios':    area_scenarios,
+        'area_counts':       area_counts,
+        'n_sc':              geo['Scenario'].nunique(),
+    }
+
+def choropleth_figure(country_agg):
+    """Choropleth di base (senza evidenziazione) come dict serializzabile."""
+    import plotly.graph_objects as go
+
+    max_n = max(country_agg['n_sc'].max() if not country_agg.empty else 1, 1)
+    fig = go.Figure()
+
+    # Layer 1: paesi specifici (rosso, intensità = n scenari)
+    if not country_agg.empty:
+        fig.add_trace(go.Choropleth(
+            locations=country_agg['ISO3'],
+            z=country_agg['n_sc'],
+            customdata=list(zip(
+                country_agg['ISO3'],
+                country_agg['Area'],
+                country_agg['hover'],
+            )),
+            hovertemplate='%{customdata[2]}<extra></extra>',
+            colorscale=[
+                [0.0, '#fee2e2'], [0.33, '#f87171'],
+                [0.66, '#dc2626'], [1.0,  '#7f1d1d'],
+            ],
+            zmin=0, zmax=max_n,
+            marker_line_color='#e5e7eb', marker_line_width=0.6,
+            showscale=True,
+            colorbar=dict(
+                title=dict(text='Country\nscenarios', font=dict(size=10, color='#6b7280')),
+                tickfont=dict(size=9, color='#6b7280'),
+                len=0.45, thickness=11, x=1.01,
+                bgcolor='rgba(255,255,255,0.9)',
+                bordercolor='#e6e6e6', borderwidth=1,
+            ),
+        ))
+
+    fig.update_layout(
+        geo=dict(
+            showframe=False, showcoastlines=True,
+            coastlinecolor='#d1d5db', showland=True, landcolor='#f3f4f6',
+            showocean=True, oceancolor='#eff6ff', showlakes=False,
+            showcountries=True, countrycolor='#e5e7eb',
+            projection_type='natural earth', bgcolor='#ffffff',
+        ),
+        paper_bgcolor='#ffffff', plot_bgcolor='#ffffff',
+        margin=dict(l=0, r=0, t=8, b=0), height=480,
+    )
+    return fig.to_dict()
@@ -0,0 +1,31 @@
+"""Indice scenario → righe per frame ordinati per Scenario: slice e take posizionali al posto delle maschere."""
+import numpy as np
+import pandas as pd
+
+def scenario_bounds(frame):
+    """(inizio, fine) posizionali delle righe di ogni scenario in un frame ordinato per Scenario.
+
+    Con Scenario categorica i confini si cercano sui codici interi; i nomi si
+    materializzano solo per le prime righe di ogni scenario.
+    """
+    sc   = frame['Scenario']
+    keys = sc.cat.codes.to_numpy() if isinstance(sc.dtype, pd.CategoricalDtype) else sc.to_numpy()
+    if not len(keys):
+        return {}
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    stops  = np.r_[starts[1:], len(keys)]
+    return dict(zip(sc.take(starts).tolist(), zip(starts.tolist(), stops.tolist())))
+
+def scenario_rows(frame, scenarios, index=None):
+    """Righe degli scenari richiesti da un frame ordinato per Scenario, senza scansioni.
+
+    Uno scenario → slice posizionale (vista); più scenari → un solo take,
+    sempre in ordine di Scenario. `index` è lo scenario_bounds del frame.
+    """
+    index = scenario_bounds(frame) if index is None else index
+    spans = sorted(index[sc] for sc in set(scenarios) if sc in index)
+    if len(spans) == 1:
+        return frame.iloc[spans[0][0]:spans[0][1]]
+    if not spans:
+        return frame.iloc[:0]
+    return frame.iloc[np.concatenate([np.arange(a, b) for a, b in spans])]
@@ -0,0 +1,91 @@
+"""P&L di portafoglio: matrice sparsa scenari × fattori degli shock in bps ed esposizioni per fattore."""
+import io
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .directions import BPS_MULTIPLIER, CUBE_LEVELS
+
+# Unità delle esposizioni → divisore verso "P&L per 1 bp" (stesse regole di to_bps)
+EXPOSURE_UNITS = {'bp': 1.0, **BPS_MULTIPLIER}
+
+def read_exposures(data, name=''):
+    """Esposizioni per fattore da un file csv/xlsx: colonne Factor, Exposure e Unit opzionale.
+
+    Exposure è il P&L per 1 unità di shock nell'unità indicata (bp di default: DV01;
+    pct per delta equity/FX); le righe dello stesso fattore si sommano.
+    Restituisce una Series Factor → P&L per 1 bp.
+    """
+    raw  = pd.read_csv(io.BytesIO(data)) if name.lower().endswith('.csv') else pd.read_excel(io.BytesIO(data))
+    cols = {str(c).strip().lower(): c for c in raw.columns}
+    if 'factor' not in cols or 'exposure' not in cols:
+        raise ValueError("the file needs a 'Factor' and an 'Exposure' column")
+    factor   = raw[cols['factor']].astype(str).str.strip()
+    exposure = pd.to_numeric(raw[cols['exposure']], errors='coerce')
+    if 'unit' in cols:
+        unit = raw[cols['unit']].astype(str).str.strip().str.lower().where(raw[cols['unit']].notna(), 'bp')
+        mult = unit.map(EXPOSURE_UNITS)
+        if mult.isna().any():
+            bad = sorted(unit[mult.isna()].unique())
+            raise ValueError(f"unknown exposure unit(s): {', '.join(bad)} (use {', '.join(EXPOSURE_UNITS)})")
+        exposure = exposure / mult
+    keep = factor.ne('') & factor.ne('nan') & exposure.notna()
+    return exposure[keep].groupby(factor[keep], sort=True).sum()
+
+def build_shock_matrix(df):
+    """Matrice COO scenari × fattori degli shock convertiti in bps, con i nodi L1/L2/L3 di ogni voce.
+
+    Gli shock in unità non direzionali (bps NaN) sono esclusi. Le voci ripetute per la
+    stessa coppia (scenario, fattore) — righe duplicate o per blocchi diversi — valgono
+    la loro media, così la somma del prodotto matrice-vettore non le conta due volte.
+    """
+    rows         = df[df['bps'].notna() & df['Factor'].notna()]
+    row, scs     = pd.factorize(rows['Scenario'], sort=True)
+    col, factors = pd.factorize(rows['Factor'], sort=True)
+    _, dup, cnt  = np.unique(row.astype(np.int64) * len(factors) + col, return_inverse=True, return_counts=True)
+    data         = rows['bps'].to_numpy(dtype=float) / cnt[dup]
+
+    levels = {}
+    for level, keys in CUBE_LEVELS.items():
+        node, nodes = pd.factorize(pd.MultiIndex.from_frame(rows[keys].astype(object).fillna('')), sort=True)
+        nodes       = nodes.set_names(keys)
+        cells, cell = np.unique(row.astype(np.int64) * len(nodes) + node, return_inverse=True)
+        levels[level] = {'nodes': nodes, 'cells': cells, 'cell': cell}
+    return {'scenarios': np.asarray(scs, dtype=object), 'factors': pd.Index(factors),
+            'row': row, 'col': col, 'data': data, 'levels': levels}
+
+class PortfolioPnL(NamedTuple):
+    pnl:       pd.Series      # Scenario → P&L (tutti gli scenari della matrice)
+    breakdown: dict           # livello → DataFrame Scenario, nodo…, P&L
+    matched:   pd.Series      # esposizioni dei fattori presenti negli shock
+    unmatched: pd.Series      # esposizioni senza alcuno shock corrispondente
+
+def portfolio_pnl(matrix, exposures):
+    """P&L per scenario come prodotto matrice sparsa × vettore esposizioni, con scomposizione per livello."""
+    x       = exposures.reindex(matrix['factors']).fillna(0.0).to_numpy(dtype=float)
+    contrib = matrix['data'] * x[matrix['col']]
+    n_sc    = len(matrix['scenarios'])
+    pnl     = pd.Series(np.bincount(matrix['row'], weights=contrib, minlength=n_sc),
+                        index=pd.Index(matrix['scenarios'], name='Scenario'), name='P&L')
+
+    breakdown = {}
+    for level, lv in matrix['levels'].items():
+        n_nodes = len(lv['nodes'])
+        frame   = lv['nodes'][lv['cells'] % n_nodes].to_frame(index=False)
+        frame.insert(0, 'Scenario', matrix['scenarios'][lv['cells'] // n_nodes])
+        frame['P&L'] = np.bincount(lv['cell'], weights=contrib, minlength=len(lv['cells']))
+        breakdown[level] = frame
+
+    known = exposures.index.isin(matrix['factors'])
+    return PortfolioPnL(pnl, breakdown, exposures[known], exposures[~known])
+
+def pnl_table(result, desc_map, type_map):
+    """Una riga per scenario (dal peggiore) con P&L totale e contributo di ogni L1."""
+    by_l1 = result.breakdown['L1'].pivot(index='Scenario', columns='L1', values='P&L')
+    table = pd.DataFrame({'Scenario': result.pnl.index,
+                          'Scenario Type': result.pnl.index.map(type_map),
+                          'Description': result.pnl.index.map(lambda sc: desc_map.get(sc, '')),
+                          'P&L': result.pnl.to_numpy()})
+    table = table.join(by_l1.fillna(0.0), on='Scenario')
+    return table.sort_values('P&L', kind='stable', ignore_index=True)
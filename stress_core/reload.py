@@ -0,0 +1,134 @@
+"""Hot reload del workbook: diff per scenario, ricalcolo incrementale e swap atomico del Dataset."""
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import pandas as pd
+
+from .dataset import (
+    CACHE_DIR, FILE_PATH, Dataset, clean_shocks, dataset_version, freeze_dataset, load_dataset,
+    merge_scenarios, prepare_dataset, read_shocks, scenario_fingerprints, scenario_maps,
+    without_scenarios,
+)
+from .directions import build_asset_matrix, build_direction_cube
+from .index import scenario_bounds
+
+log = logging.getLogger(__name__)
+
+class ScenarioDiff(NamedTuple):
+    added:   list
+    removed: list
+    changed: list
+
+    @property
+    def affected(self):
+        return set(self.added) | set(self.removed) | set(self.changed)
+
+    def summary(self):
+        return f"+{len(self.added)} −{len(self.removed)} ~{len(self.changed)}"
+
+def diff_scenarios(old_fps, new_fps):
+    """Scenari aggiunti, rimossi e modificati confrontando le impronte."""
+    return ScenarioDiff(
+        added=sorted(set(new_fps) - set(old_fps)),
+        removed=sorted(set(old_fps) - set(new_fps)),
+        changed=sorted(sc for sc in set(old_fps) & set(new_fps) if old_fps[sc] != new_fps[sc]),
+    )
+
+def update_dataset(old, df_raw):
+    """Nuovo Dataset dal foglio aggiornato, ricalcolando solo gli scenari cambiati.
+
+    Le righe degli scenari invariati (pulite, nel cubo e nel geo) sono riusate così
+    come sono; il risultato coincide con prepare_dataset(df_raw). Restituisce (Dataset, diff).
+    """
+    fingerprints = scenario_fingerprints(df_raw)
+    diff         = diff_scenarios(old.fingerprints, fingerprints)
+    affected     = diff.affected
+    if not affected:
+        return old, diff
+
+    renamed = set(df_raw.rename(columns={'Livello 1': 'L1', 'Livello 2': 'L2', 'Livello 3': 'L3'}).columns)
+    if renamed != set(old.df.columns) - {'bps'}:
+        return prepare_dataset(df_raw), diff   # schema cambiato: ricostruzione integrale
+
+    raw_new = df_raw[df_raw['Scenario'].astype(str).str.strip().isin(affected)]
+    df_new  = clean_shocks(raw_new)
+    df      = merge_scenarios(without_scenarios(old.df, old.index, affected), df_new)
+
+    desc_new, type_new = scenario_maps(df_new)
+    desc_map = dict(sorted({**{k: v for k, v in old.desc_map.items() if k not in affected}, **desc_new}.items()))
+    type_map = dict(sorted({**{k: v for k, v in old.type_map.items() if k not in affected}, **type_new}.items()))
+
+    cube_new = build_direction_cube(df_new, type_map)
+    cube     = {}
+    for level, frame in old.cube.items():
+        kept        = frame[~frame.index.get_level_values('Scenario').isin(affected)]
+        cube[level] = pd.concat([kept, cube_new[level]]).sort_index() if len(cube_new[level]) else kept
+
+    new = freeze_dataset(Dataset(
+        df, desc_map, type_map, cube, scenario_bounds(df), build_asset_matrix(cube, type_map),
+        old.geo.update(raw_new, affected), fingerprints, dataset_version(fingerprints)))
+    return new, diff
+
+class DatasetStore:
+    """Dataset corrente condiviso tra le sessioni, aggiornato quando il workbook cambia.
+
+    Il Dataset è immutabile e viene sostituito per riferimento: chi legge current()
+    all'inizio di un rerun lavora su una versione coerente anche durante un reload.
+    """
+    def __init__(self, path=FILE_PATH, cache_dir=CACHE_DIR):
+        self.path, self.cache_dir = path, cache_dir
+        self.last_diff = None
+        self._lock     = threading.RLock()
+        self._thread   = None
+        self._stat     = self._file_stat()
+        self._current  = load_dataset(path, cache_dir)
+
+    def current(self):
+        return self._current
+
+    def _file_stat(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def apply(self, df_raw):
+        """Porta il Dataset al contenuto di df_raw; restituisce il diff applicato."""
+        with self._lock:
+            new, diff = update_dataset(self._current, df_raw)
+            self._current, self.last_diff = new, diff
+            return diff
+
+    def poll(self):
+        """Ricarica se il file è cambiato da ultimo controllo; diff applicato o None."""
+        try:
+            stat = self._file_stat()
+        except OSError:
+            return None                  # file in riscrittura o rimosso: si riprova al prossimo giro
+        if stat == self._stat:
+            return None
+        with self._lock:
+            if stat == self._stat:
+                return None
+            df_raw = read_shocks(self.path, self.cache_dir)
+            diff   = self.apply(df_raw)
+            self._stat = stat
+            return diff
+
+    def watch(self, interval=5.0):
+        """Avvia (una sola volta) il thread che controlla il file ogni `interval` secondi."""
+        with self._lock:
+            if self._thread is None and interval > 0:
+                self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                                name="shocks-watcher", daemon=True)
+                self._thread.start()
+        return self
+
+    def _loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.poll()
+            except Exception as exc:     # es. xlsx salvato a metà: resta la versione corrente
+                log.warning("shocks reload failed: %r", exc)
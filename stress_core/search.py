@@ -0,0 +1,131 @@
+"""Ricerca full-text sugli scenari: indice invertito per termine e indice a trigrammi sul vocabolario."""
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# Peso di ogni campo nel punteggio di uno scenario
+SEARCH_FIELDS = {'Scenario': 5.0, 'Description': 2.0, 'Factor': 2.0, 'Extra': 2.0,
+                 'L3': 1.5, 'L2': 1.0, 'L1': 1.0}
+# Moltiplicatore per tipo di corrispondenza del termine cercato
+MATCH_WEIGHT  = {'exact': 1.0, 'prefix': 0.7, 'infix': 0.4}
+_TOKEN        = re.compile(r'[a-z0-9]+')
+_CODE         = re.compile(r'[a-z0-9]*_[a-z0-9_]*')     # codici tipo BRS_GOLD__4, anche interi
+
+def parse_extra(extra):
+    """Estrae i token con underscore dalla colonna Extra, escludendo 'target block/to'."""
+    return ' · '.join(extra_tokens(extra))
+
+def extra_tokens(extra):
+    if pd.isna(extra) or str(extra).strip() in ('', 'nan'):
+        return []
+    s = re.sub(r'^target\s+(block|to)\s+', '', str(extra).strip(), flags=re.IGNORECASE)
+    tokens = re.split(r'[,\s\-]+', s)
+    return [t.strip() for t in tokens if '_' in t and t.strip()]
+
+def tokenize(text):
+    text = str(text).lower()
+    return _TOKEN.findall(text) + [t for t in _CODE.findall(text) if t.strip('_')]
+
+def _trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+def build_search_index(df, desc_map, type_map):
+    """Indice di ricerca: per ogni termine gli scenari che lo contengono e il peso del campo migliore.
+
+    Le stringhe sono tokenizzate una volta per valore distinto; i token della colonna
+    Extra sono quelli di parse_extra.
+    """
+    scenarios = np.asarray(sorted(df['Scenario'].unique()), dtype=object)
+    doc_of    = {sc: i for i, sc in enumerate(scenarios)}
+
+    parts = [pd.DataFrame({'doc': np.arange(len(scenarios)), 'text': scenarios,
+                           'weight': SEARCH_FIELDS['Scenario']}),
+             pd.DataFrame({'doc': [doc_of[sc] for sc in desc_map if sc in doc_of],
+                           'text': [desc_map[sc] for sc in desc_map if sc in doc_of],
+                           'weight': SEARCH_FIELDS['Description']})]
+    codes = df['Scenario'].map(doc_of).to_numpy()
+    for col in ('Factor', 'L1', 'L2', 'L3', 'Extra'):
+        if col not in df.columns:
+            continue
+        pairs = pd.DataFrame({'doc': codes, 'text': df[col].to_numpy(dtype=object)}).dropna().drop_duplicates()
+        if col == 'Extra':
+            pairs['text'] = pairs['text'].map(lambda e: ' '.join(extra_tokens(e)))
+        parts.append(pairs.assign(weight=SEARCH_FIELDS[col]))
+    pairs = pd.concat(parts, ignore_index=True)
+
+    texts         = pd.unique(pairs['text'].astype(str))
+    tokens        = pd.Series([tokenize(t) for t in texts], index=texts)
+    pairs['term'] = pairs['text'].astype(str).map(tokens)
+    postings = (pairs.explode('term').dropna(subset=['term'])
+                     .groupby(['term', 'doc'], sort=True)['weight'].max().reset_index())
+
+    terms, starts = np.unique(postings['term'].to_numpy(dtype=str), return_index=True)
+    trigram_map   = defaultdict(list)
+    for tid, term in enumerate(terms):
+        for tg in _trigrams(term):
+            trigram_map[tg].append(tid)
+    return {
+        'scenarios': scenarios,
+        'types':     pd.Series(scenarios).map(type_map).to_numpy(dtype=object),
+        'terms':     terms,
+        'starts':    np.append(starts, len(postings)),
+        'docs':      postings['doc'].to_numpy(dtype=np.int32),
+        'weights':   postings['weight'].to_numpy(dtype=np.float32),
+        'trigrams':  {tg: np.asarray(ids, dtype=np.int32) for tg, ids in trigram_map.items()},
+    }
+
+def _matching_terms(index, token, partial):
+    """Termini del vocabolario che corrispondono a `token`, come (id, moltiplicatore)."""
+    terms = index['terms']
+    lo    = np.searchsorted(terms, token)
+    if not partial:
+        return [(lo, MATCH_WEIGHT['exact'])] if lo < len(terms) and terms[lo] == token else []
+    hi  = np.searchsorted(terms, token + '\uffff')
+    out = {tid: MATCH_WEIGHT['exact'] if terms[tid] == token else MATCH_WEIGHT['prefix']
+           for tid in range(lo, hi)}
+    if len(token) >= 3:
+        cand = None
+        for tg in _trigrams(token):
+            ids  = index['trigrams'].get(tg)
+            if ids is None:
+                cand = np.empty(0, dtype=np.int32)
+                break
+            cand = ids if cand is None else np.intersect1d(cand, ids, assume_unique=True)
+        for tid in cand.tolist():
+            if tid not in out and token in terms[tid]:
+                out[tid] = MATCH_WEIGHT['infix']
+    return list(out.items())
+
+def search_scenarios(index, query, type_filter='All', limit=None):
+    """Scenari che contengono tutti i termini della query, dal punteggio più alto.
+
+    Ogni termine corrisponde per intero, come prefisso o (da 3 caratteri) come
+    sottostringa di una parola; l'ultimo termine è sempre trattato come parziale
+    (ricerca mentre si scrive). Restituisce (scenari, punteggi) come array, a parità
+    di punteggio in ordine alfabetico.
+    """
+    q_tokens = list(dict.fromkeys(tokenize(query)))
+    empty    = (index['scenarios'][:0], np.zeros(0, dtype=np.float32))
+    if not q_tokens:
+        return empty
+    n     = len(index['scenarios'])
+    total = np.zeros(n, dtype=np.float32)
+    hit   = np.ones(n, dtype=bool)
+    for pos, token in enumerate(q_tokens):
+        partial = pos == len(q_tokens) - 1 or len(token) >= 3
+        acc     = np.zeros(n, dtype=np.float32)
+        for tid, mult in _matching_terms(index, token, partial):
+            lo, hi = index['starts'][tid], index['starts'][tid + 1]
+            docs   = index['docs'][lo:hi]
+            acc[docs] = np.maximum(acc[docs], index['weights'][lo:hi] * mult)
+        hit   &= acc > 0
+        total += acc
+        if not hit.any():
+            return empty
+    if type_filter in ('BRS', 'EC'):
+        hit &= index['types'] == type_filter
+    docs = np.flatnonzero(hit)                      # id = posizione nell'ordine alfabetico
+    docs = docs[np.argsort(-total[docs], kind='stable')][:limit]
+    return index['scenarios'][docs], total[docs]
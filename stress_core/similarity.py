@@ -0,0 +1,144 @@
+"""Similarità tra scenari: vettori normalizzati scenario × fattore, vicini per coseno e clustering gerarchico."""
+import numpy as np
+import pandas as pd
+
+SIMILAR_K      = 50     # vicini precalcolati per scenario (prima dei filtri per tipo)
+SIMILAR_BLOCK  = 512    # righe per blocco del prodotto X·Xᵀ: memoria O(blocco × scenari)
+
+def scenario_vectors(matrix):
+    """Matrice densa float32 scenari × fattori dalla matrice shock (build_shock_matrix).
+
+    Ogni fattore è scalato per la sua ampiezza tipica (RMS sugli scenari che lo
+    shockano), così un -30% equity non schiaccia uno shock di 50 bps sui tassi;
+    ogni riga è poi normalizzata a norma 1, quindi il prodotto scalare è il coseno.
+    """
+    n_sc, n_f = len(matrix['scenarios']), len(matrix['factors'])
+    flat = matrix['row'].astype(np.int64) * n_f + matrix['col']
+    X    = np.bincount(flat, weights=matrix['data'], minlength=n_sc * n_f).reshape(n_sc, n_f)
+    sq   = (X ** 2).sum(axis=0)
+    cnt  = (X != 0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(cnt > 0, 1.0 / np.sqrt(sq / np.maximum(cnt, 1)), 0.0)
+    X = (X * scale).astype(np.float32)
+    norm = np.linalg.norm(X, axis=1, keepdims=True)
+    return np.divide(X, norm, out=np.zeros_like(X), where=norm > 0)
+
+def nearest_neighbors(X, k=SIMILAR_K, block=SIMILAR_BLOCK):
+    """Top-k vicini per coseno di ogni riga (escluso lo scenario stesso), a blocchi di righe."""
+    n = len(X)
+    k = min(k, max(n - 1, 0))
+    neighbors = np.zeros((n, k), dtype=np.int32)
+    scores    = np.zeros((n, k), dtype=np.float32)
+    if k == 0:
+        return neighbors, scores
+    for lo in range(0, n, block):
+        hi  = min(lo + block, n)
+        sim = X[lo:hi] @ X.T
+        sim[np.arange(hi - lo), np.arange(lo, hi)] = -np.inf
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        val = np.take_along_axis(sim, top, axis=1)
+        order = np.argsort(-val, axis=1, kind='stable')
+        neighbors[lo:hi] = np.take_along_axis(top, order, axis=1)
+        scores[lo:hi]    = np.take_along_axis(val, order, axis=1)
+    return neighbors, scores
+
+def _bisect(X, rng, iters=15):
+    """2-means sferico su righe a norma 1: maschera booleana del secondo gruppo (None se non divisibile)."""
+    c0 = X[rng.integers(len(X))]
+    c1 = X[np.argmin(X @ c0)]
+    side = None
+    for _ in range(iters):
+        new = (X @ c1) > (X @ c0)
+        if side is not None and (new == side).all():
+            break
+        side = new
+        if side.all() or not side.any():
+            return None
+        c0, c1 = X[~side].sum(axis=0), X[side].sum(axis=0)
+        c0 /= np.linalg.norm(c0) or 1.0
+        c1 /= np.linalg.norm(c1) or 1.0
+    return side
+
+def cluster_scenarios(X, n_clusters=None, seed=0):
+    """Clustering gerarchico divisivo (bisecting k-means sferico) fino a n_clusters foglie.
+
+    Ad ogni passo si divide il cluster più disperso (somma di 1 − coseno dal centroide).
+    Restituisce (labels, parent): cluster foglia di ogni riga, numerati per dimensione
+    decrescente, e per ogni nodo dell'albero il padre (-1 per la radice); i nodi foglia
+    sono 0..n_foglie-1, quelli interni seguono.
+    """
+    n = len(X)
+    n_clusters = n_clusters or max(2, int(round(np.sqrt(n / 2))))
+    rng = np.random.default_rng(seed)
+
+    def spread(idx):
+        c = X[idx].sum(axis=0)
+        return len(idx) - np.linalg.norm(c)     # Σ (1 − cos) rispetto al centroide
+
+    nodes  = [np.arange(n)]          # indici di riga per nodo
+    parent = [-1]
+    leaves = {0: spread(nodes[0])}
+    while len(leaves) < n_clusters:
+        cand = [i for i in leaves if len(nodes[i]) > 1 and leaves[i] > 1e-6]
+        if not cand:
+            break
+        node = max(cand, key=leaves.get)
+        side = _bisect(X[nodes[node]], rng)
+        if side is None:
+            leaves[node] = 0.0       # non divisibile: resta foglia
+            continue
+        del leaves[node]
+        for part in (nodes[node][~side], nodes[node][side]):
+            nodes.append(part)
+            parent.append(node)
+            leaves[len(nodes) - 1] = spread(part)
+
+    # Rinumerazione: foglie per dimensione decrescente, poi i nodi interni
+    leaf_ids  = sorted(leaves, key=lambda i: (-len(nodes[i]), i))
+    inner_ids = [i for i in range(len(nodes)) if i not in leaves]
+    remap     = {old: new for new, old in enumerate(leaf_ids + inner_ids)}
+    labels    = np.empty(n, dtype=np.int32)
+    for old in leaf_ids:
+        labels[nodes[old]] = remap[old]
+    new_parent = np.full(len(nodes), -1, dtype=np.int32)
+    for old, p in enumerate(parent):
+        new_parent[remap[old]] = remap[p] if p >= 0 else -1
+    return labels, new_parent
+
+def build_similarity_index(matrix, type_map, k=SIMILAR_K, n_clusters=None):
+    """Indice di similarità per versione del dataset: vicini top-k e cluster di ogni scenario."""
+    X                  = scenario_vectors(matrix)
+    neighbors, scores  = nearest_neighbors(X, k)
+    labels, parent     = cluster_scenarios(X, n_clusters)
+    scenarios          = matrix['scenarios']
+    return {
+        'scenarios': scenarios,
+        'position':  {sc: i for i, sc in enumerate(scenarios)},
+        'types':     pd.Series(scenarios).map(type_map).to_numpy(dtype=object),
+        'neighbors': neighbors,
+        'scores':    scores,
+        'labels':    labels,
+        'parent':    parent,
+        'sizes':     np.bincount(labels, minlength=labels.max(initial=-1) + 1),
+    }
+
+def similar_scenarios(index, scenario, k=10, type_filter='All'):
+    """I k scenari più simili (coseno decrescente, solo > 0: almeno un fattore in comune)
+    come lista di (scenario, similarità)."""
+    i = index['position'].get(scenario)
+    if i is None:
+        return []
+    nb, sc = index['neighbors'][i], index['scores'][i]
+    keep   = sc > 0
+    if type_filter in ('BRS', 'EC'):
+        keep &= index['types'][nb] == type_filter
+    nb, sc = nb[keep], sc[keep]
+    return [(index['scenarios'][j], float(s)) for j, s in zip(nb[:k], sc[:k])]
+
+def scenario_cluster(index, scenario):
+    """(id cluster, scenari del cluster) dello scenario, o (None, []) se non indicizzato."""
+    i = index['position'].get(scenario)
+    if i is None:
+        return None, []
+    label = index['labels'][i]
+    return int(label), index['scenarios'][index['labels'] == label].tolist()